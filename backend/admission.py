@@ -0,0 +1,297 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from observability import logger, REGISTRY
+
+# -----------------------------------------------------------------------------
+# Admission control
+# -----------------------------------------------------------------------------
+#
+# Every extraction takes one of max_inflight slots before it enters the
+# pipeline. Waiting requests queue per priority class and free slots go to the
+# classes by weighted fair (stride) scheduling: with weights 4:1, interactive
+# requests get four slots for every bulk one while both are waiting, and bulk
+# still progresses under a steady interactive load.
+#
+# Requests are checked before anything else happens:
+# - each client has a token bucket per class. An interactive request beyond
+#   its client's interactive rate is demoted to bulk; a bulk request beyond the
+#   bulk rate is refused with 429.
+# - the queue wait is estimated from the work queued ahead of the request and
+#   a moving average of slot hold times. A request that would wait longer than
+#   its class deadline, or find the queue full, is refused with 503 at once,
+#   with a Retry-After of when the queue should have drained enough.
+# A request that was admitted but is still queued when its deadline passes is
+# refused too. Work already accepted (queued jobs, batch documents) waits
+# without a deadline.
+
+PRIORITIES = ("interactive", "bulk")
+# Extractions in the pipeline at once; 0 sizes it from the PDF workers and LLM slots
+ADMISSION_MAX_INFLIGHT = int(os.getenv("INVOICE_ADMISSION_MAX_INFLIGHT", "0"))
+ADMISSION_MAX_QUEUED = int(os.getenv("INVOICE_ADMISSION_MAX_QUEUED", "200"))
+ADMISSION_WEIGHTS = {
+    "interactive": float(os.getenv("INVOICE_ADMISSION_WEIGHT_INTERACTIVE", "4")),
+    "bulk": float(os.getenv("INVOICE_ADMISSION_WEIGHT_BULK", "1")),
+}
+# Longest acceptable queue wait per class, in seconds
+ADMISSION_DEADLINES = {
+    "interactive": float(os.getenv("INVOICE_ADMISSION_DEADLINE_INTERACTIVE", "15")),
+    "bulk": float(os.getenv("INVOICE_ADMISSION_DEADLINE_BULK", "120")),
+}
+# Per-client token buckets: requests per second and burst size (a rate of 0 disables the limit)
+RATE_LIMITS = {
+    "interactive": (float(os.getenv("INVOICE_RATE_INTERACTIVE", "1")),
+                    float(os.getenv("INVOICE_RATE_INTERACTIVE_BURST", "10"))),
+    "bulk": (float(os.getenv("INVOICE_RATE_BULK", "5")),
+             float(os.getenv("INVOICE_RATE_BULK_BURST", "50"))),
+}
+# Header naming the client (e.g. an API key or X-Forwarded-For behind a proxy); the peer address otherwise
+CLIENT_ID_HEADER = os.getenv("INVOICE_CLIENT_ID_HEADER", "")
+# Weight of the newest slot hold time in the service time average
+SERVICE_ALPHA = 0.1
+MAX_CLIENTS = 10000
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused: status_code 429 (rate limit) or 503 (overload)."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, min(MAX_RETRY_AFTER_SECONDS, math.ceil(retry_after)))
+
+
+def client_id(request):
+    """Rate limit key for a request."""
+    if CLIENT_ID_HEADER:
+        value = request.headers.get(CLIENT_ID_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def request_priority(request, default):
+    """Priority class from the X-Priority header, else the endpoint's default."""
+    value = request.headers.get("x-priority", "").strip().lower()
+    return value if value in PRIORITIES else default
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Take one token; returns 0, or the seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full_at(self):
+        return self.updated + (self.burst - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Slots, queues and rate limits for one process; used from the event loop only."""
+
+    def __init__(self, max_inflight, max_queued=ADMISSION_MAX_QUEUED, weights=None, deadlines=None, rate_limits=None):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queued = max_queued
+        self.weights = weights or ADMISSION_WEIGHTS
+        self.deadlines = deadlines or ADMISSION_DEADLINES
+        self.rate_limits = rate_limits or RATE_LIMITS
+        self.inflight = 0
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        # Stride scheduling: the class with the lowest pass is served next; _vtime is the pass last served
+        self._pass = {priority: 0.0 for priority in PRIORITIES}
+        self._vtime = 0.0
+        self.service_seconds = None
+        self._buckets = {}
+        self.counts = {"admitted": 0, "demoted": 0, "rate_limited": 0, "shed": 0, "expired": 0}
+
+    # -- checks before the request is queued -----------------------------------
+
+    def check(self, priority, client, shed=True):
+        """
+        Rate-limit and (with shed) overload check for a new request. Returns the
+        class it runs in (interactive may be demoted to bulk); raises AdmissionRejected.
+        """
+        now = time.monotonic()
+        demoted = False
+        if priority == "interactive" and self._take_token(client, "interactive", now):
+            priority, demoted = "bulk", True
+        if priority == "bulk":
+            wait = self._take_token(client, "bulk", now)
+            if wait:
+                self.counts["rate_limited"] += 1
+                ADMISSION_REJECTIONS.inc(priority="bulk", reason="rate_limited")
+                raise AdmissionRejected(f"Rate limit exceeded for client {client}", 429, wait)
+        if demoted:
+            self.counts["demoted"] += 1
+            ADMISSION_DEMOTIONS.inc()
+        if shed:
+            self._check_load(priority)
+        return priority
+
+    def _take_token(self, client, priority, now):
+        rate, burst = self.rate_limits[priority]
+        if rate <= 0:
+            return 0.0
+        key = (client, priority)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CLIENTS:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+        return bucket.take(now)
+
+    def _prune(self, now):
+        # A bucket that has refilled is the same as a new one
+        for key in [key for key, bucket in self._buckets.items() if bucket.full_at() <= now]:
+            del self._buckets[key]
+
+    def _check_load(self, priority):
+        queued = sum(len(q) for q in self.queues.values())
+        if queued >= self.max_queued:
+            self._shed(priority, "queue_full")
+            raise AdmissionRejected(f"Extraction queue is full ({queued} waiting)", 503, self.estimated_wait(priority))
+        wait = self.estimated_wait(priority)
+        if wait > self.deadlines[priority]:
+            self._shed(priority, "deadline")
+            raise AdmissionRejected(
+                f"Server busy: estimated queue wait {wait:.0f}s exceeds {self.deadlines[priority]:.0f}s",
+                503, wait - self.deadlines[priority],
+            )
+
+    def _shed(self, priority, reason):
+        self.counts["shed"] += 1
+        ADMISSION_REJECTIONS.inc(priority=priority, reason=reason)
+        logger.info("admission.shed priority=%s reason=%s inflight=%d queued=%s",
+                    priority, reason, self.inflight, {p: len(q) for p, q in self.queues.items()})
+
+    def estimated_wait(self, priority):
+        """
+        Seconds a new request of this class would queue, given the work ahead of it.
+        0 until an extraction has finished: with no service time to go by, nothing is shed on estimate.
+        """
+        own = len(self.queues[priority])
+        if self.service_seconds is None or (self.inflight < self.max_inflight and not any(self.queues.values())):
+            return 0.0
+        # Under fair scheduling, other classes get weight-proportional turns until this one is served
+        ahead = own
+        for other, queue in self.queues.items():
+            if other != priority:
+                ahead += min(len(queue), (own + 1) * self.weights[other] / self.weights[priority])
+        return (ahead + 1) * self.service_seconds / self.max_inflight
+
+    # -- slots -------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(self, priority, deadline=True):
+        """
+        Hold one pipeline slot for the body of the block, queueing for it in
+        `priority`'s class. With deadline, raises AdmissionRejected if the class
+        deadline passes first.
+        """
+        waiter = None
+        if self.inflight < self.max_inflight and not any(self.queues.values()):
+            self.inflight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            if not self.queues[priority]:
+                # A class coming back from idle starts level with the others instead of with saved-up credit
+                self._pass[priority] = max(self._pass[priority], self._vtime)
+            self.queues[priority].append(waiter)
+            try:
+                timeout = self.deadlines[priority] if deadline else None
+                await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                self._abandon(priority, waiter)
+                self.counts["expired"] += 1
+                ADMISSION_REJECTIONS.inc(priority=priority, reason="expired")
+                raise AdmissionRejected(
+                    f"Request waited {self.deadlines[priority]:.0f}s in the {priority} queue", 503,
+                    self.estimated_wait(priority),
+                ) from None
+            except BaseException:
+                self._abandon(priority, waiter)
+                raise
+        self.counts["admitted"] += 1
+        ADMISSION_ADMITTED.inc(priority=priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.service_seconds = elapsed if self.service_seconds is None else (
+                SERVICE_ALPHA * elapsed + (1 - SERVICE_ALPHA) * self.service_seconds
+            )
+            self._release()
+
+    def _abandon(self, priority, waiter):
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as we gave up: pass it on
+            self._release()
+        else:
+            waiter.cancel()
+            try:
+                self.queues[priority].remove(waiter)
+            except ValueError:
+                pass
+
+    def _release(self):
+        """Hand a freed slot to the next waiter by stride scheduling, or give it back."""
+        while True:
+            waiting = [p for p in PRIORITIES if self.queues[p]]
+            if not waiting:
+                self.inflight -= 1
+                return
+            priority = min(waiting, key=lambda p: self._pass[p])
+            self._vtime = self._pass[priority]
+            self._pass[priority] += 1.0 / self.weights[priority]
+            waiter = self.queues[priority].popleft()
+            if not waiter.done():
+                # The slot passes straight to the waiter, so inflight stays the same
+                waiter.set_result(None)
+                return
+
+    def snapshot(self):
+        return {
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "max_queued": self.max_queued,
+            "queued": {priority: len(queue) for priority, queue in self.queues.items()},
+            "estimated_wait_seconds": {p: round(self.estimated_wait(p), 2) for p in PRIORITIES},
+            "service_seconds": round(self.service_seconds, 3) if self.service_seconds is not None else None,
+            "weights": self.weights,
+            "deadlines": self.deadlines,
+            "rate_limits": {p: {"per_second": r, "burst": b} for p, (r, b) in self.rate_limits.items()},
+            "clients": len(self._buckets),
+            **self.counts,
+        }
+
+
+ADMISSION_ADMITTED = REGISTRY.counter(
+    "invoice_admission_admitted_total",
+    "Extractions that got a pipeline slot, by priority class",
+    ["priority"],
+)
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "invoice_admission_rejected_total",
+    "Requests refused by admission control (rate_limited, queue_full, deadline, expired)",
+    ["priority", "reason"],
+)
+ADMISSION_DEMOTIONS = REGISTRY.counter(
+    "invoice_admission_demoted_total",
+    "Interactive requests run as bulk because the client exceeded its interactive rate",
+)
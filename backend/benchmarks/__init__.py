@@ -0,0 +1,10 @@
+"""
+Performance benchmarks for the extraction backend.
+
+Run from backend/ so `main` is importable:
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.load --requests 50 --concurrency 8 --latency 1.0 --output load.json
+
+Both print a JSON report (also written to --output) so results from two
+commits can be diffed directly.
+"""
@@ -0,0 +1,183 @@
+"""
+cleaning.py's compiled rules vs the per-call clean_llm_extraction it replaced,
+on synthetic invoice texts of growing size, checking that both give the same
+fields.
+
+Usage (from backend/):
+    python -m benchmarks.clean --chars 2000 20000 200000 1000000 --records 50 --output clean.json
+"""
+import argparse
+import random
+
+from benchmarks.common import environment, run_timed, write_report
+from benchmarks.synth import INVOICE_FIELDS
+from cleaning import DocumentFacts, clean_fields, clean_many
+
+MONTH_NAMES = ("January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December")
+
+
+def legacy_clean(fields, pdf_text):
+    """
+    clean_llm_extraction before cleaning.py, kept for comparison. One change:
+    its date findall returned only the month name (the pattern had a capture
+    group); it returns the whole date here, as cleaning.py does.
+    """
+    import re
+    import ast
+
+    cleaned = {}
+
+    for field_name, field_value in fields.items():
+        if not field_value:
+            cleaned[field_name] = field_value
+            continue
+
+        value = str(field_value).strip()
+
+        if field_name in ['vendor_address', 'customer_address', 'billing_address', 'shipping_address']:
+            if value.startswith('['):
+                try:
+                    addr_list = ast.literal_eval(value)
+                    value = ' '.join([str(part).strip() for part in addr_list if part])
+                except:
+                    value = value.replace('[', '').replace(']', '').replace("'", '').replace('"', '')
+                    value = re.sub(r',\s*', ' ', value)
+
+        label_patterns = [
+            r'^invoice\s+number\s*:?\s*',
+            r'^order\s+number\s*:?\s*',
+            r'^bill\s+number\s*:?\s*',
+            r'^invoice\s+date\s*:?\s*',
+            r'^due\s+date\s*:?\s*',
+            r'^total\s*:?\s*',
+            r'^vendor\s*:?\s*',
+            r'^from\s*:?\s*',
+            r'^address\s*:?\s*',
+            r'^purchase\s+order\s*:?\s*',
+            r'^account\s+number\s*:?\s*',
+            r'^currency\s*:?\s*',
+        ]
+        for pattern in label_patterns:
+            value = re.sub(pattern, '', value, flags=re.IGNORECASE).strip()
+
+        if field_name in ['invoice_date', 'due_date']:
+            date_matches = re.findall(r'(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}', pdf_text)
+            if date_matches and not re.match(r'\w+ \d+,? \d{4}', value):
+                if field_name == 'invoice_date' and len(date_matches) >= 1:
+                    value = date_matches[0]
+                elif field_name == 'due_date' and len(date_matches) >= 2:
+                    value = date_matches[1]
+                elif len(date_matches) >= 1:
+                    value = date_matches[0]
+
+        if field_name == 'vendor_name':
+            value = re.sub(r'\s+order\s+number\s+\d+.*$', '', value, flags=re.IGNORECASE)
+            value = re.sub(r'\s+po\s*#?\s*\d+.*$', '', value, flags=re.IGNORECASE)
+
+        if field_name == 'vendor_address':
+            value = re.sub(r'(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}', '', value, flags=re.IGNORECASE)
+            value = re.sub(r'invoice\s+date|due\s+date|due', '', value, flags=re.IGNORECASE)
+            value = re.sub(r'p\.o\.|po\s*#?\s*\d+', '', value, flags=re.IGNORECASE)
+            value = re.sub(r'\s+', ' ', value).strip()
+
+        if field_name == 'currency':
+            if value and len(value) > 1 and value.upper() in ['USD', 'EUR', 'GBP', 'AUD', 'CAD']:
+                if '$' in pdf_text:
+                    value = '$'
+                elif '€' in pdf_text:
+                    value = '€'
+                elif '£' in pdf_text:
+                    value = '£'
+
+        cleaned[field_name] = value if value else None
+
+    return cleaned
+
+
+def make_text(n_chars, rng):
+    """Invoice-like text: a header with two written dates, then line items with amounts and dates."""
+    lines = [
+        "INVOICE",
+        INVOICE_FIELDS["vendor_name"],
+        INVOICE_FIELDS["vendor_address"],
+        "Invoice Number: " + INVOICE_FIELDS["invoice_number"],
+        "Invoice Date: January 25, 2016",
+        "Due Date: February 24, 2016",
+    ]
+    size = sum(len(line) + 1 for line in lines)
+    while size < n_chars:
+        line = (f"{rng.choice(MONTH_NAMES)} {rng.randint(1, 28)}, 2016  Item {rng.randint(1000, 9999)}"
+                f"  {rng.randint(1, 20)}  ${rng.randint(1, 9999)}.{rng.randint(0, 99):02d}")
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def make_records(rng, n):
+    """LLM answers with the usual mistakes: labels left in, ISO dates, codes for symbols, address lists."""
+    records = []
+    for _ in range(n):
+        fields = dict(INVOICE_FIELDS)
+        fields["invoice_number"] = rng.choice(["", "Invoice Number: "]) + fields["invoice_number"]
+        fields["invoice_date"] = rng.choice(["2016-01-25", "January 25, 2016", "Invoice Date: 25/01/2016"])
+        fields["due_date"] = rng.choice(["2016-02-24", "Due Date: February 24, 2016", None])
+        fields["currency"] = rng.choice(["USD", "$", "Currency: AUD"])
+        fields["vendor_name"] = fields["vendor_name"] + rng.choice(["", " PO # 4411", " Order Number 88 ref"])
+        fields["vendor_address"] = rng.choice([
+            fields["vendor_address"],
+            str(fields["vendor_address"].split(" ", 2)),
+            fields["vendor_address"] + " Invoice Date January 25, 2016 PO 12",
+        ])
+        records.append(fields)
+    # The single-record timings use the first one: make it need every document fact
+    records[0].update(invoice_date="2016-01-25", due_date="2016-02-24", currency="USD")
+    return records
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Field cleaning benchmark")
+    parser.add_argument("--chars", type=int, nargs="+", default=[2000, 20000, 200000, 1000000])
+    parser.add_argument("--records", type=int, default=50,
+                        help="LLM answers cleaned against each text (batch size)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report = {"benchmark": "clean", "environment": environment(), "params": vars(args), "documents": {}}
+    for n_chars in args.chars:
+        text = make_text(n_chars, rng)
+        records = make_records(rng, args.records)
+        expected = [legacy_clean(dict(fields), text) for fields in records]
+        batch = [(dict(fields), text) for fields in records]
+        # The streaming path cleans one field per call
+        per_field = [({name: value}, text) for fields in records[:1] for name, value in fields.items()]
+
+        doc = {
+            "identical": clean_many(batch) == expected,
+            "record": {
+                "legacy": run_timed(lambda: legacy_clean(dict(records[0]), text), args.repeat),
+                "engine": run_timed(lambda: clean_fields(dict(records[0]), text), args.repeat),
+            },
+            "batch": {
+                "legacy": run_timed(lambda: [legacy_clean(f, t) for f, t in batch], args.repeat),
+                "engine": run_timed(lambda: clean_many(batch), args.repeat),
+            },
+            "streamed_fields": {
+                "legacy": run_timed(lambda: [legacy_clean(f, t) for f, t in per_field], args.repeat),
+                "engine": run_timed(
+                    lambda: [clean_fields(f, facts=facts) for facts in [DocumentFacts(text)] for f, _ in per_field],
+                    args.repeat,
+                ),
+            },
+        }
+        for timings in (doc["record"], doc["batch"], doc["streamed_fields"]):
+            timings["speedup"] = round(timings["legacy"]["p50"] / timings["engine"]["p50"], 2)
+        report["documents"][f"{n_chars}_chars"] = doc
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,103 @@
+"""
+Bulk export throughput (export.py) on a synthetic invoice store, per table and
+format, with the process's peak memory after each export.
+
+Usage (from backend/):
+    python -m benchmarks.export --invoices 1000000 --formats csv jsonl parquet --output export.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import environment, write_report
+from benchmarks.synth import INVOICE_FIELDS
+from export import EXPORT_TABLES, export_table, check_format, ExportUnavailableError
+from invoices import InvoiceStore, normalize_date
+from line_items import parse_amount
+
+
+def seed(store, n, rng, batch=10000):
+    """n Done invoices with INVOICE_FIELDS-shaped fields, written straight to the table (no PDFs)."""
+    db = store._db()
+    now = time.time()
+    for start in range(0, n, batch):
+        rows = []
+        for i in range(start, min(n, start + batch)):
+            fields = dict(INVOICE_FIELDS)
+            fields["invoice_number"] = f"INV-{i:07d}"
+            fields["total_amount"] = f"${rng.randint(1, 99999)}.{rng.randint(0, 99):02d}"
+            fields["line_items"] = INVOICE_FIELDS["line_items"][:rng.randint(1, 3)]
+            fields["line_items_source"] = "layout"
+            updated = now - n + i
+            rows.append((
+                f"case {i}", f"invoice-{i}.pdf", 1, "Done", fields["vendor_name"], fields["invoice_number"],
+                fields["invoice_date"], normalize_date(fields["invoice_date"]), fields["due_date"],
+                normalize_date(fields["due_date"]), fields["total_amount"], parse_amount(fields["total_amount"]),
+                fields["currency"], json.dumps(fields), updated, updated,
+            ))
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO invoices (case_name, file_name, pages, status, vendor_name, invoice_number, invoice_date,"
+            " invoice_date_iso, due_date, due_date_iso, total_amount, total_value, currency, fields,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        db.execute("COMMIT")
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Bulk export benchmark")
+    parser.add_argument("--invoices", type=int, default=100000)
+    parser.add_argument("--formats", nargs="+", default=["csv", "jsonl", "parquet"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="export-bench-")
+    try:
+        store = InvoiceStore(os.path.join(workdir, "invoices.sqlite3"))
+        started = time.perf_counter()
+        seed(store, args.invoices, random.Random(args.seed))
+        report = {
+            "benchmark": "export", "environment": environment(), "params": vars(args),
+            "seed_seconds": round(time.perf_counter() - started, 2),
+            "db_bytes": os.path.getsize(store.path),
+            "rss_after_seed_mb": peak_rss_mb(),
+            "exports": {},
+        }
+        for fmt in args.formats:
+            try:
+                check_format(fmt)
+            except ExportUnavailableError as ex:
+                report["exports"][fmt] = {"skipped": str(ex)}
+                continue
+            for table in EXPORT_TABLES:
+                path = os.path.join(workdir, f"{table}.{fmt}")
+                started = time.perf_counter()
+                with open(path, "wb") as f:
+                    for data in export_table(store, table, fmt):
+                        f.write(data)
+                seconds = time.perf_counter() - started
+                report["exports"][f"{table}.{fmt}"] = {
+                    "seconds": round(seconds, 2),
+                    "invoices_per_second": round(args.invoices / seconds),
+                    "bytes": os.path.getsize(path),
+                    "peak_rss_mb": peak_rss_mb(),
+                }
+                os.unlink(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
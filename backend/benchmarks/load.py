@@ -0,0 +1,155 @@
+"""
+End-to-end load test of POST /extract-invoice against a stub Ollama server.
+
+By default this starts the stub (benchmarks.stub_ollama) on a free port and a
+uvicorn server pointed at it, then fires --requests uploads with --concurrency
+clients. Pass --url to target an already running server instead (its
+OLLAMA_HOST is then up to you).
+
+Usage (from backend/):
+    python -m benchmarks.load --requests 50 --concurrency 8 --latency 1.0 --pages 3 --output load.json
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.common import environment, summarize, write_report
+from benchmarks.stub_ollama import start_in_thread
+from benchmarks.synth import make_invoice_pdf
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(ollama_url, extra_env=None):
+    """Start uvicorn on a free port; returns (process, base_url)."""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "OLLAMA_HOST": ollama_url,
+        "INVOICE_CACHE_DIR": tempfile.mkdtemp(prefix="invoice-bench-"),
+        "INVOICE_LOG_LEVEL": "WARNING",
+        **(extra_env or {}),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not become ready")
+
+
+def run_load(base_url, pdf_bytes, requests, concurrency, form=None, timeout=300):
+    """Fire the uploads; returns latencies, per-stage server timings and errors."""
+    latencies = []
+    stages = {}
+    errors = []
+    data = {"use_cache": "false", "include_timings": "true", **(form or {})}
+
+    def one(client, i):
+        start = time.perf_counter()
+        try:
+            resp = client.post(
+                base_url + "/extract-invoice",
+                files={"file": (f"bench-{i}.pdf", pdf_bytes, "application/pdf")},
+                data=data,
+            )
+            elapsed = time.perf_counter() - start
+            if resp.status_code != 200:
+                return elapsed, None, f"HTTP {resp.status_code}: {resp.text[:200]}"
+            return elapsed, resp.json().get("stage_timings") or {}, None
+        except Exception as ex:
+            return time.perf_counter() - start, None, repr(ex)
+
+    with httpx.Client(timeout=timeout) as client, ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        for elapsed, timings, error in pool.map(lambda i: one(client, i), range(requests)):
+            if error:
+                errors.append(error)
+                continue
+            latencies.append(elapsed)
+            for stage, seconds in timings.items():
+                stages.setdefault(stage, []).append(seconds)
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "errors": errors[:10],
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 4) if wall else None,
+        "latency": summarize(latencies),
+        "server_stages": {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test /extract-invoice")
+    parser.add_argument("--url", help="target an existing server instead of starting one")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=1.0, help="stub LLM latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--layout", default="classic")
+    parser.add_argument("--form", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra form fields for /extract-invoice (repeatable)")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    pdf_bytes = make_invoice_pdf(args.pages, args.words_per_page, args.layout)
+    form = dict(item.split("=", 1) for item in args.form)
+
+    stub = proc = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            stub, ollama_url = start_in_thread(
+                port=0, latency=args.latency, jitter=args.jitter, tokens_per_second=args.tokens_per_second
+            )
+            proc, base_url = start_server(ollama_url)
+        result = run_load(base_url, pdf_bytes, args.requests, args.concurrency, form)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if stub is not None:
+            stub.shutdown()
+
+    write_report({
+        "benchmark": "load",
+        "environment": environment(),
+        "params": vars(args),
+        "result": result,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,64 @@
+"""
+Microbenchmarks for the CPU-side pipeline stages on synthetic invoices.
+
+Usage (from backend/):
+    python -m benchmarks.micro --pages 1 10 50 --words-per-page 400 --repeat 5 --output micro.json
+"""
+import argparse
+import contextlib
+import copy
+import io
+import os
+import tempfile
+
+import main
+from benchmarks.common import environment, run_timed, write_report
+from benchmarks.synth import INVOICE_FIELDS, make_invoice_pdf
+
+
+def bench_document(path, repeat):
+    results = {}
+    results["extract_pdf_content"] = run_timed(lambda: main.extract_pdf_content(path), repeat)
+    text, pages = main.extract_pdf_content(path)
+
+    # The LLM usually reformats something; give the cleaner real work to do
+    llm_fields = copy.deepcopy(INVOICE_FIELDS)
+    llm_fields["invoice_date"] = "2016-01-25"
+    llm_fields["currency"] = "USD"
+    llm_fields["vendor_name"] = "Vendor: " + llm_fields["vendor_name"]
+    results["clean_llm_extraction"] = run_timed(lambda: main.clean_llm_extraction(dict(llm_fields), text), repeat * 10)
+
+    cleaned = main.clean_llm_extraction(dict(llm_fields), text)
+    words = pages[0]["words"]
+    results["find_address_tokens"] = run_timed(
+        lambda: main.find_address_tokens(words, INVOICE_FIELDS["vendor_address"]), repeat * 10
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["find_boxes_for_fields"] = run_timed(lambda: main.find_boxes_for_fields(cleaned, pages), repeat)
+        results["boxes_found"] = len(main.find_boxes_for_fields(cleaned, pages))
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for extraction stages")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--layout", default="statement")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = {"benchmark": "micro", "environment": environment(), "params": vars(args), "documents": {}}
+    for n_pages in args.pages:
+        pdf = make_invoice_pdf(n_pages, args.words_per_page, args.layout)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(pdf)
+        try:
+            report["documents"][f"{n_pages}_pages"] = bench_document(tmp.name, args.repeat)
+        finally:
+            os.unlink(tmp.name)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,84 @@
+"""
+Sharded vs single-worker PDF parsing (parse_pdf vs extract_pdf_content) on
+synthetic statements, checking that both return the same pages.
+
+Usage (from backend/):
+    python -m benchmarks.parse --pages 10 50 100 200 300 --shard-pages 8 16 32 --workers 4 --output parse.json
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import environment, run_timed, write_report
+from benchmarks.synth import make_invoice_pdf
+
+
+def same_output(expected, actual):
+    """Do two (text, pages) results match page for page, word for word?"""
+    (text_a, pages_a), (text_b, pages_b) = expected, actual
+    if text_a != text_b or len(pages_a) != len(pages_b):
+        return False
+    for a, b in zip(pages_a, pages_b):
+        if (a["text"], a["width"], a["height"]) != (b["text"], b["width"], b["height"]):
+            return False
+        if (a["words"] is None) != (b["words"] is None):
+            return False
+        if a["words"] is not None:
+            wa, wb = a["words"], b["words"]
+            if list(wa.text) != list(wb.text):
+                return False
+            if not all(np.array_equal(getattr(wa, c), getattr(wb, c)) for c in ("x0", "x1", "top", "bottom")):
+                return False
+    return True
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Sharded PDF parsing benchmark")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100, 200, 300])
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--layout", default="statement")
+    parser.add_argument("--shard-pages", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 2))
+    parser.add_argument("--char-budget", type=int, default=None,
+                        help="parse like the server does (only as far as the LLM reads); default: every page")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # The pool size is read at import
+    os.environ["INVOICE_PDF_WORKERS"] = str(args.workers)
+    os.environ["INVOICE_PDF_SHARD_WORKERS"] = str(args.workers)
+    os.environ.setdefault("INVOICE_LOG_LEVEL", "WARNING")
+    import main
+    import workers
+
+    report = {"benchmark": "parse", "environment": environment(), "params": vars(args), "documents": {}}
+    try:
+        for n_pages in args.pages:
+            pdf = make_invoice_pdf(n_pages, args.words_per_page, args.layout)
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+                tmp.write(pdf)
+            try:
+                expected = main.extract_pdf_content(tmp.name, args.char_budget)
+                single = run_timed(lambda: main.extract_pdf_content(tmp.name, args.char_budget), args.repeat)
+                doc = {"single_worker": single, "sharded": {}}
+                for shard_pages in args.shard_pages:
+                    main.PDF_SHARD_PAGES = shard_pages
+                    actual = asyncio.run(main.parse_pdf(tmp.name, args.char_budget))
+                    timed = run_timed(lambda: asyncio.run(main.parse_pdf(tmp.name, args.char_budget)), args.repeat)
+                    timed["speedup"] = round(single["p50"] / timed["p50"], 2)
+                    timed["identical"] = same_output(expected, actual)
+                    doc["sharded"][str(shard_pages)] = timed
+                report["documents"][f"{n_pages}_pages"] = doc
+            finally:
+                os.unlink(tmp.name)
+    finally:
+        workers.shutdown_pools()
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,220 @@
+"""
+Minimal stand-in for an Ollama server, for load tests without a GPU.
+
+Speaks enough of the HTTP API for the ollama Python client: POST /api/chat
+(streaming and non-streaming), POST /api/generate, GET /api/tags,
+GET /api/ps and GET /api/version. Every chat answers with the synthetic invoice fields after a
+configurable latency, so the rest of the pipeline runs for real. Only the fields
+the system prompt asks for ("<field>:") are returned, so grouped prompts get
+proportionally shorter answers.
+
+Like Ollama, it keeps the last prompt of each of `slots` slots and only
+"prefills" what follows the longest prefix shared with one of them (reported as
+prompt_eval_count / prompt_eval_duration at prefill_tokens_per_second), reloads
+the model when num_ctx changes (taking load_seconds), and reports the loaded model's size in
+GET /api/ps from that num_ctx.
+
+Usage (from backend/):
+    python -m benchmarks.stub_ollama --port 11435 --latency 1.5 --jitter 0.2
+    OLLAMA_HOST=http://127.0.0.1:11435 python run.py
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synth import INVOICE_FIELDS
+
+CHARS_PER_TOKEN = 4
+# qwen2.5:3b: weights, and fp16 K+V for 36 layers x 2 KV heads x 128 dims per token
+MODEL_BYTES = 1_930_000_000
+KV_BYTES_PER_TOKEN = 36 * 2 * 2 * 128 * 2
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set on the server class by make_server()
+    latency = 0.0
+    jitter = 0.0
+    tokens_per_second = 0.0
+    prefill_tokens_per_second = 0.0
+    load_seconds = 0.0
+    slots = 4
+    response_fields = INVOICE_FIELDS
+    # Shared by every handler of one server; set by make_server()
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload):
+        line = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(b"%x\r\n" % len(line) + line + b"\r\n")
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._send_json({"models": [{"name": "stub", "model": "stub"}]})
+        elif self.path.startswith("/api/ps"):
+            with self.state["lock"]:
+                num_ctx = self.state["num_ctx"]
+            models = []
+            if num_ctx:
+                size = MODEL_BYTES + num_ctx * self.slots * KV_BYTES_PER_TOKEN
+                models.append({"name": "stub", "model": "stub", "size": size, "size_vram": size, "context_length": num_ctx})
+            self._send_json({"models": models})
+        elif self.path.startswith("/api/version"):
+            self._send_json({"version": "0.0.0-stub"})
+        else:
+            self._send_json({"status": "ok"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path.startswith("/api/chat"):
+            self._answer(request, chat=True)
+        elif self.path.startswith("/api/generate"):
+            self._answer(request, chat=False)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _requested_fields(self, request):
+        system = " ".join(m.get("content", "") for m in request.get("messages", []) if m.get("role") == "system")
+        fields = {k: v for k, v in self.response_fields.items() if f"{k}:" in system}
+        return fields or self.response_fields
+
+    def _prefill(self, prompt, num_ctx):
+        """(tokens to evaluate, model reloaded?) against the slot caches, updating them."""
+        with self.state["lock"]:
+            reloaded = num_ctx != self.state["num_ctx"]
+            if reloaded:
+                self.state["num_ctx"] = num_ctx
+                self.state["cache"] = []
+            cache = self.state["cache"]
+            shared, best = 0, None
+            for i, cached in enumerate(cache):
+                n = len(os.path.commonprefix([cached, prompt]))
+                if n > shared:
+                    shared, best = n, i
+            if best is not None:
+                cache.pop(best)
+            elif len(cache) >= self.slots:
+                cache.pop(0)
+            cache.append(prompt)
+        return max(1, (len(prompt) - shared) // CHARS_PER_TOKEN), reloaded
+
+    def _answer(self, request, chat):
+        content = json.dumps(self._requested_fields(request))
+        messages = request.get("messages", [])
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages) or request.get("prompt", "")
+        options = request.get("options") or {}
+        prompt_tokens, reloaded = self._prefill(prompt, options.get("num_ctx", 2048))
+        eval_count = len(content) // CHARS_PER_TOKEN
+        if options.get("num_predict", -1) >= 0 and eval_count > options["num_predict"]:
+            content = content[:options["num_predict"] * CHARS_PER_TOKEN]
+            eval_count = options["num_predict"]
+        prefill = prompt_tokens / self.prefill_tokens_per_second if self.prefill_tokens_per_second else 0.0
+        load = self.load_seconds if reloaded else 0.0
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)) + prefill + load
+        stats = {
+            "done": True,
+            "done_reason": "length" if eval_count == options.get("num_predict") else "stop",
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prefill * 1e9),
+            "load_duration": int(load * 1e9),
+            "eval_count": eval_count,
+            "total_duration": int(delay * 1e9),
+        }
+
+        def message(text):
+            if chat:
+                return {"message": {"role": "assistant", "content": text}}
+            return {"response": text}
+
+        base = {"model": request.get("model", "stub"), "created_at": "2024-01-01T00:00:00Z"}
+        if not request.get("stream", True):
+            decode = stats["eval_count"] / self.tokens_per_second if self.tokens_per_second else 0
+            time.sleep(delay + decode)
+            self._send_json({**base, **message(content), **stats})
+            return
+
+        # Streaming: spend the latency as time-to-first-token, then emit chunks
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(delay)
+        step = 8
+        per_chunk = step / 4 / self.tokens_per_second if self.tokens_per_second else 0
+        for i in range(0, len(content), step):
+            self._send_chunk({**base, **message(content[i:i + step]), "done": False})
+            if per_chunk:
+                time.sleep(per_chunk)
+        self._send_chunk({**base, **message(""), **stats})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=11435, latency=0.5, jitter=0.0, tokens_per_second=0.0, fields=None,
+                prefill_tokens_per_second=0.0, slots=4, load_seconds=0.0):
+    handler = type("Handler", (StubOllamaHandler,), {
+        "latency": latency,
+        "jitter": jitter,
+        "tokens_per_second": tokens_per_second,
+        "prefill_tokens_per_second": prefill_tokens_per_second,
+        "slots": slots,
+        "load_seconds": load_seconds,
+        "response_fields": fields or INVOICE_FIELDS,
+        "state": {"lock": threading.Lock(), "num_ctx": None, "cache": []},
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_in_thread(**kwargs):
+    """Start a stub server on a daemon thread; returns (server, base_url)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of uniform jitter")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="simulated decode speed (0 = instant)")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0.0,
+                        help="simulated prompt evaluation speed (0 = instant)")
+    parser.add_argument("--slots", type=int, default=4, help="prompt caches kept (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="simulated model (re)load time")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.tokens_per_second,
+                         prefill_tokens_per_second=args.prefill_tokens_per_second, slots=args.slots,
+                         load_seconds=args.load_seconds)
+    print(f"stub ollama listening on http://{args.host}:{args.port} latency={args.latency}s")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
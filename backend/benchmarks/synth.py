@@ -0,0 +1,179 @@
+"""
+Synthetic invoice PDF generator for benchmarks.
+
+Writes plain PDF 1.4 with the built-in Helvetica font, so no PDF library is
+needed. Every document carries the same header fields (INVOICE_FIELDS), which
+the stub Ollama server returns, so box finding has real work to do.
+
+Usage (from backend/):
+    python -m benchmarks.synth out.pdf --pages 50 --words-per-page 400 --layout statement
+"""
+import argparse
+import random
+
+INVOICE_FIELDS = {
+    "invoice_number": "INV-20417",
+    "invoice_date": "January 25, 2016",
+    "due_date": "February 24, 2016",
+    "vendor_name": "Northwind Traders Pty Ltd",
+    "vendor_address": "Suite 5A-1204 123 Somewhere Street Springfield VIC 3000",
+    "purchase_order": "PO-7781",
+    "account_number": "ACC # 1234 1234 BSB # 4321 432",
+    "line_items": [
+        {"description": "Widget large", "quantity": "2", "unit_price": "$10.00", "amount": "$20.00"},
+        {"description": "Gadget small", "quantity": "3", "unit_price": "$5.00", "amount": "$15.00"},
+        {"description": "Service fee", "quantity": "1", "unit_price": "$58.50", "amount": "$58.50"},
+    ],
+    "total_amount": "$93.50",
+    "currency": "$",
+}
+
+LAYOUTS = ("classic", "stacked", "statement")
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+_FILLER = (
+    "statement entry reference payment received transfer service charge credit "
+    "debit period ending summary details interest adjustment account balance "
+    "fee consolidated ledger posting settlement remittance"
+).split()
+
+
+def _header_lines(layout):
+    f = INVOICE_FIELDS
+    vendor = [
+        f["vendor_name"],
+        "Suite 5A-1204",
+        "123 Somewhere Street",
+        "Springfield VIC 3000",
+    ]
+    meta = [
+        f"Invoice Number: {f['invoice_number']}",
+        f"Invoice Date: {f['invoice_date']}",
+        f"Due Date: {f['due_date']}",
+        f"PO # {f['purchase_order']}",
+    ]
+    lines = []
+    if layout == "stacked":
+        for i, text in enumerate(vendor + [""] + meta):
+            if text:
+                lines.append((50, 740 - 14 * i, text))
+        y = 740 - 14 * (len(vendor) + len(meta) + 2)
+    else:
+        for i, text in enumerate(vendor):
+            lines.append((50, 740 - 14 * i, text))
+        for i, text in enumerate(meta):
+            lines.append((360, 740 - 14 * i, text))
+        y = 740 - 14 * (max(len(vendor), len(meta)) + 2)
+
+    lines += [(50, y, "Description"), (300, y, "Qty"), (380, y, "Unit Price"), (480, y, "Amount")]
+    for item in f["line_items"]:
+        y -= 15
+        lines += [
+            (50, y, item["description"]),
+            (300, y, item["quantity"]),
+            (380, y, item["unit_price"]),
+            (480, y, item["amount"]),
+        ]
+    y -= 30
+    lines += [(380, y, "Total"), (480, y, f["total_amount"])]
+    y -= 30
+    lines.append((50, y, f["account_number"]))
+    return lines, y - 20
+
+
+def _filler_lines(rng, n_words, top, columns=6):
+    """Statement-style rows of short phrases, filling downwards from `top`."""
+    lines = []
+    col_width = (PAGE_WIDTH - 80) // columns
+    y = top
+    col = 0
+    words_left = n_words
+    while words_left > 0 and y > 40:
+        k = min(words_left, 3)
+        phrase = " ".join(rng.choice(_FILLER) for _ in range(k - 1)) + f" {rng.randint(100, 99999)}"
+        lines.append((40 + col * col_width, y, phrase.strip()))
+        words_left -= k
+        col += 1
+        if col == columns:
+            col = 0
+            y -= 12
+    return lines
+
+
+def make_invoice_pdf(pages=1, words_per_page=300, layout="classic", seed=0):
+    """Return the bytes of a synthetic invoice PDF."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}")
+    rng = random.Random(seed)
+    page_lines = []
+    for page_no in range(pages):
+        if page_no == 0:
+            lines, top = _header_lines(layout)
+            used = sum(len(t.split()) for _, _, t in lines)
+            lines += _filler_lines(rng, max(0, words_per_page - used), top)
+        else:
+            lines = _filler_lines(rng, words_per_page, 760, columns=3 if layout == "statement" else 6)
+        if layout == "statement" and page_no == pages - 1 and pages > 1:
+            # Statements repeat the amount due at the end of the document
+            lines.append((380, 30, f"Amount Due {INVOICE_FIELDS['total_amount']}"))
+        page_lines.append(lines)
+    return _write_pdf(page_lines)
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _write_pdf(page_lines):
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pages_id = len(objects) + 2 * len(page_lines) + 1
+    kids = []
+    for lines in page_lines:
+        ops = ["BT /F1 10 Tf"]
+        for x, y, text in lines:
+            ops.append(f"1 0 0 1 {x} {y} Tm ({_escape(text)}) Tj")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add((
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}]"
+            f" /Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>"
+        ).encode()))
+    add(f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode())
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic invoice PDF")
+    parser.add_argument("output")
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--layout", choices=LAYOUTS, default="classic")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    with open(args.output, "wb") as fh:
+        fh.write(make_invoice_pdf(args.pages, args.words_per_page, args.layout, args.seed))
+
+
+if __name__ == "__main__":
+    main()
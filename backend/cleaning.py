@@ -0,0 +1,200 @@
+import re
+import ast
+import functools
+import itertools
+
+# -----------------------------------------------------------------------------
+# LLM output cleaning
+# -----------------------------------------------------------------------------
+#
+# The fixes applied to each field are declared in FIELD_RULES and compiled once
+# at import into a tuple of functions per field. The regexes are compiled with
+# them, and the dozen label prefixes are tried only when one combined regex
+# says the value starts with a label at all.
+#
+# Rules that look at the PDF text (the date and currency fixes) read
+# DocumentFacts: facts about the whole text, each computed on first use and
+# then shared by every field, and by every call that is handed the same facts
+# (the streaming path cleans one field at a time). The month-name dates come
+# from one regex pass that stops at the second date (no rule reads further);
+# the currency symbols are single-character membership checks, which scan
+# faster than a regex.
+#
+# clean_many() cleans a batch of records and builds the facts once per
+# distinct text.
+
+MONTHS = "January|February|March|April|May|June|July|August|September|October|November|December"
+MONTH_DATE_RE = re.compile(rf"(?:{MONTHS})\s+\d{{1,2}},?\s+\d{{4}}")
+MONTH_DATE_ANY_CASE_RE = re.compile(MONTH_DATE_RE.pattern, re.IGNORECASE)
+# A value already in "Month D, YYYY" shape is left alone
+WRITTEN_DATE_RE = re.compile(r"\w+ \d+,? \d{4}")
+# date_from_text picks the first or the second date printed
+DATE_CANDIDATES = 2
+
+# Removed from the start of any value, in this order
+FIELD_LABELS = (
+    "invoice number", "order number", "bill number", "invoice date", "due date", "total",
+    "vendor", "from", "address", "purchase order", "account number", "currency",
+)
+LABEL_RES = tuple(
+    re.compile("^" + label.replace(" ", r"\s+") + r"\s*:?\s*", re.IGNORECASE) for label in FIELD_LABELS
+)
+ANY_LABEL_RE = re.compile(
+    "^(?:" + "|".join(label.replace(" ", r"\s+") for label in FIELD_LABELS) + ")", re.IGNORECASE
+)
+
+VENDOR_REFERENCE_RE = re.compile(r"\s+(?:order\s+number\s+\d+|po\s*#?\s*\d+).*$", re.IGNORECASE)
+ADDRESS_LABEL_RE = re.compile(r"invoice\s+date|due\s+date|due", re.IGNORECASE)
+ADDRESS_PO_RE = re.compile(r"p\.o\.|po\s*#?\s*\d+", re.IGNORECASE)
+_WS_RE = re.compile(r"\s+")
+_LIST_SEPARATOR_RE = re.compile(r",\s*")
+
+CURRENCY_CODES = ("USD", "EUR", "GBP", "AUD", "CAD")
+# Checked in this order: the first one printed anywhere in the text wins
+CURRENCY_SYMBOLS = ("$", "€", "£")
+
+
+class DocumentFacts:
+    """Facts about one document's text, computed on first use."""
+
+    def __init__(self, text):
+        self.text = text or ""
+
+    @functools.cached_property
+    def dates(self):
+        """The first DATE_CANDIDATES month-name dates ("January 25, 2016") in the text."""
+        return [m.group(0) for m in itertools.islice(MONTH_DATE_RE.finditer(self.text), DATE_CANDIDATES)]
+
+    @functools.cached_property
+    def currency_symbol(self):
+        return next((symbol for symbol in CURRENCY_SYMBOLS if symbol in self.text), None)
+
+
+# -- rules: (value, facts, *args) -> value ------------------------------------
+
+def join_address_list(value, facts):
+    """Addresses some models return as a list: ['Suite 5A-1204', '123 Somewhere Street']."""
+    if not value.startswith("["):
+        return value
+    try:
+        return " ".join(str(part).strip() for part in ast.literal_eval(value) if part)
+    except Exception:
+        value = value.replace("[", "").replace("]", "").replace("'", "").replace('"', "")
+        return _LIST_SEPARATOR_RE.sub(" ", value)
+
+
+def strip_labels(value, facts):
+    if not ANY_LABEL_RE.match(value):
+        return value
+    for label_re in LABEL_RES:
+        value = label_re.sub("", value).strip()
+    return value
+
+
+def date_from_text(value, facts, index):
+    """Swap a reformatted date ("2016-01-25") for the date as printed; the index-th one if there are enough."""
+    if WRITTEN_DATE_RE.match(value) or not facts.dates:
+        return value
+    return facts.dates[index] if len(facts.dates) > index else facts.dates[0]
+
+
+def cut_vendor_reference(value, facts):
+    """Drop an order or PO number run into the vendor name."""
+    return VENDOR_REFERENCE_RE.sub("", value)
+
+
+def strip_address_noise(value, facts):
+    """Drop dates, date labels and PO numbers the model mixed into an address."""
+    value = MONTH_DATE_ANY_CASE_RE.sub("", value)
+    value = ADDRESS_LABEL_RE.sub("", value)
+    value = ADDRESS_PO_RE.sub("", value)
+    return _WS_RE.sub(" ", value).strip()
+
+
+def currency_symbol(value, facts):
+    """Prefer the symbol the PDF prints over a currency code."""
+    if value.upper() in CURRENCY_CODES and facts.currency_symbol:
+        return facts.currency_symbol
+    return value
+
+
+RULES = {
+    "join_address_list": join_address_list,
+    "strip_labels": strip_labels,
+    "date_from_text": date_from_text,
+    "cut_vendor_reference": cut_vendor_reference,
+    "strip_address_noise": strip_address_noise,
+    "currency_symbol": currency_symbol,
+}
+
+# Field -> rules applied in order; a rule is a name or (name, *args)
+DEFAULT_RULES = ("strip_labels",)
+FIELD_RULES = {
+    "vendor_address": ("join_address_list", "strip_labels", "strip_address_noise"),
+    "customer_address": ("join_address_list", "strip_labels"),
+    "billing_address": ("join_address_list", "strip_labels"),
+    "shipping_address": ("join_address_list", "strip_labels"),
+    "invoice_date": ("strip_labels", ("date_from_text", 0)),
+    "due_date": ("strip_labels", ("date_from_text", 1)),
+    "vendor_name": ("strip_labels", "cut_vendor_reference"),
+    "currency": ("strip_labels", "currency_symbol"),
+}
+
+
+def compile_rule(rule):
+    """A FIELD_RULES entry as a (value, facts) -> value function."""
+    name, *args = (rule,) if isinstance(rule, str) else rule
+    fn = RULES[name]
+    if not args:
+        return fn
+    return lambda value, facts: fn(value, facts, *args)
+
+
+class CleaningEngine:
+    def __init__(self, field_rules=None, default_rules=DEFAULT_RULES):
+        self._rules = {
+            field: tuple(compile_rule(rule) for rule in rules)
+            for field, rules in (field_rules or FIELD_RULES).items()
+        }
+        self._default = tuple(compile_rule(rule) for rule in default_rules)
+
+    def clean(self, fields, pdf_text=None, facts=None):
+        """
+        Clean up LLM output so values match the PDF text: labels left in values,
+        reformatted dates, fields run together, lists for addresses. Pass facts to
+        share them between calls on the same document.
+        """
+        if facts is None:
+            facts = DocumentFacts(pdf_text)
+        cleaned = {}
+        for field_name, field_value in fields.items():
+            if not field_value:
+                cleaned[field_name] = field_value
+                continue
+            value = str(field_value).strip()
+            for rule in self._rules.get(field_name, self._default):
+                value = rule(value, facts)
+            cleaned[field_name] = value if value else None
+        return cleaned
+
+    def clean_many(self, records):
+        """Clean [(fields, pdf_text)]; records with the same text share one DocumentFacts."""
+        facts_by_text = {}
+        results = []
+        for fields, pdf_text in records:
+            facts = facts_by_text.get(pdf_text)
+            if facts is None:
+                facts = facts_by_text[pdf_text] = DocumentFacts(pdf_text)
+            results.append(self.clean(fields, facts=facts))
+        return results
+
+
+ENGINE = CleaningEngine()
+
+
+def clean_fields(fields, pdf_text=None, facts=None):
+    return ENGINE.clean(fields, pdf_text, facts)
+
+
+def clean_many(records):
+    return ENGINE.clean_many(records)
@@ -0,0 +1,125 @@
+import re
+
+# -----------------------------------------------------------------------------
+# LLM context selection
+# -----------------------------------------------------------------------------
+#
+# Instead of sending the first N characters of a document, pick the lines most
+# likely to hold the invoice fields and fit them to a token budget: the header
+# block of page 1, lines carrying field labels (and the line after them, where
+# values often sit), the totals area, and the tail of the last page. Page
+# furniture (page numbers, running headers/footers) and repeated lines are
+# dropped first. Selected lines go out in document order.
+
+# Conservative: numbers and codes tokenize worse than prose
+CHARS_PER_TOKEN = 3
+MAX_LINE_CHARS = 400
+HEADER_LINES = 20
+TAIL_LINES = 15
+
+LABEL_RE = re.compile(
+    r"\b(invoice|inv|bill(ed)?|date|due|p\.?o\.?|purchase|order|account|acc|bsb|iban|swift|abn|"
+    r"ref(erence)?|customer|client|vendor|supplier|from|remit|terms|currency)\b",
+    re.IGNORECASE,
+)
+TOTAL_RE = re.compile(
+    r"\b(total|sub-?total|balance|amount\s+(due|payable|owing)|pay(able)?\s+by|gst|vat|tax)\b",
+    re.IGNORECASE,
+)
+MONEY_RE = re.compile(r"[$€£¥]\s?\d|\d[\d,]*\.\d{2}\b")
+BOILERPLATE_RE = re.compile(
+    r"^(page\s*\d+(\s*(of|/)\s*\d+)?|\d+\s*(of|/)\s*\d+|continued(\s+on\s+next\s+page)?|"
+    r"see\s+over|this\s+page\s+(is\s+)?intentionally\s+left\s+blank)$",
+    re.IGNORECASE,
+)
+_WS_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _document_lines(pages):
+    """(page_index, line) for every kept line of the parsed pages, boilerplate and repeats removed."""
+    lines = []
+    seen = set()
+    for page_index, page in enumerate(pages):
+        text = page.get("text")
+        if not text:
+            continue
+        for raw in text.splitlines():
+            line = _WS_RE.sub(" ", raw).strip()
+            if not line or not any(ch.isalnum() for ch in line) or BOILERPLATE_RE.match(line):
+                continue
+            key = line.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            lines.append((page_index, line[:MAX_LINE_CHARS]))
+    return lines
+
+
+def _score_lines(lines):
+    scores = [1] * len(lines)
+
+    def bump(i, score):
+        if 0 <= i < len(lines) and scores[i] < score:
+            scores[i] = score
+
+    first_page = lines[0][0]
+    last_page = lines[-1][0]
+    last_page_start = next(i for i, (p, _) in enumerate(lines) if p == last_page)
+    for i, (page_index, line) in enumerate(lines):
+        if page_index == first_page and i < HEADER_LINES:
+            bump(i, 5)
+        if TOTAL_RE.search(line):
+            bump(i, 5)
+            for j in (i - 2, i - 1, i + 1, i + 2):
+                bump(j, 3)
+        if LABEL_RE.search(line):
+            bump(i, 4)
+            bump(i + 1, 3)
+        if page_index == last_page and i >= max(last_page_start, len(lines) - TAIL_LINES):
+            bump(i, 3)
+        if MONEY_RE.search(line):
+            # Line items
+            bump(i, 2)
+    return scores
+
+
+def build_context(pages, token_budget):
+    """
+    LLM input text for pages from extract_pdf_content, fitted to token_budget.
+    Returns (text, stats) where stats has lines_total, lines_kept and chars.
+    """
+    lines = _document_lines(pages)
+    if not lines:
+        return "", {"lines_total": 0, "lines_kept": 0, "chars": 0}
+    multi_page = lines[0][0] != lines[-1][0]
+    char_budget = max(0, token_budget) * CHARS_PER_TOKEN
+
+    total_chars = sum(len(line) + 1 for _, line in lines)
+    if total_chars <= char_budget:
+        keep = range(len(lines))
+    else:
+        scores = _score_lines(lines)
+        # Page markers cost a few characters per page
+        remaining = char_budget - (16 * (lines[-1][0] + 1) if multi_page else 0)
+        keep = []
+        for i in sorted(range(len(lines)), key=lambda i: (-scores[i], i)):
+            cost = len(lines[i][1]) + 1
+            if cost <= remaining:
+                keep.append(i)
+                remaining -= cost
+        keep.sort()
+
+    out = []
+    current_page = None
+    for i in keep:
+        page_index, line = lines[i]
+        if multi_page and page_index != current_page:
+            out.append(f"[page {page_index + 1}]")
+            current_page = page_index
+        out.append(line)
+    text = "\n".join(out)
+    return text, {"lines_total": len(lines), "lines_kept": len(keep), "chars": len(text)}
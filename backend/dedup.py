@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+from extraction_cache import CACHE_DIR
+from observability import REGISTRY
+
+# -----------------------------------------------------------------------------
+# Near-duplicate detection
+# -----------------------------------------------------------------------------
+#
+# Re-sent and re-exported invoices have different bytes, so they miss the
+# content-hash cache, but their text is the same. After the PDF is parsed we
+# take a MinHash signature of the text's word shingles and look it up in an LSH
+# index: the signature is cut into BANDS bands and each band hashed to a bucket,
+# so candidates come from BANDS indexed point lookups whatever the corpus size.
+# Candidates are then scored by signature agreement (an estimate of the Jaccard
+# similarity of the shingle sets).
+#
+# A match at or above DEDUP_THRESHOLD is reused only if both documents also
+# print exactly the same numbers (amounts, dates, invoice and PO numbers). The
+# next invoice from the same vendor shares almost all of its text with the last
+# one and differs only there. Matches with other numbers are flagged on the
+# result instead.
+#
+# INVOICE_DEDUP: "reuse" (default) skips the LLM for reusable matches, "flag"
+# only reports them, "off" disables the stage.
+
+DEDUP_MODES = ("off", "flag", "reuse")
+DEDUP_MODE = os.getenv("INVOICE_DEDUP", "reuse")
+if DEDUP_MODE not in DEDUP_MODES:
+    # Fail at import: a typo would otherwise run the lookups but never reuse a match
+    raise ValueError(f"INVOICE_DEDUP must be one of {', '.join(DEDUP_MODES)}, not {DEDUP_MODE!r}")
+DEDUP_THRESHOLD = float(os.getenv("INVOICE_DEDUP_THRESHOLD", "0.9"))
+
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs at 0.9 similarity share a bucket 99.99% of the time, at 0.5 only 6%
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+# Shorter texts (scans without a text layer, one-line PDFs) are never matched
+MIN_SHINGLES = 20
+# Candidates verified per lookup, newest first; bounds work for very repetitive vendors
+MAX_CANDIDATES = 50
+
+MERSENNE_PRIME = (1 << 31) - 1
+# Fixed seed: stored signatures must stay comparable across restarts
+_rng = np.random.default_rng(20240611)
+PERM_A = _rng.integers(1, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.integers(0, MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+
+WORD_RE = re.compile(r"\w+")
+NUMBER_RE = re.compile(r"\d[\d.,/\-]*\d|\d")
+
+
+def _shingle_hashes(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS + MIN_SHINGLES - 1:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+
+def number_digest(text):
+    """Digest of the set of numbers printed in the text (order and layout ignored)."""
+    numbers = sorted({re.sub(r"[.,]", "", n) for n in NUMBER_RE.findall(text)})
+    return hashlib.sha1("\n".join(numbers).encode()).hexdigest()[:16]
+
+
+def minhash(text):
+    """MinHash signature (uint32[NUM_PERM]) of the text's word shingles, or None if too short."""
+    hashes = _shingle_hashes(text or "")
+    if hashes is None:
+        return None
+    # (a * x + b) mod p for every permutation and shingle; products stay below 2^62
+    values = (np.outer(PERM_A, hashes) + PERM_B[:, None]) % MERSENNE_PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signature):
+    """One signed 64-bit bucket key per band (the band number is part of the key)."""
+    buckets = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+class DuplicateIndex:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "dedup.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " content_sha256 TEXT NOT NULL,"
+                " prompt_key TEXT NOT NULL,"
+                " signature BLOB NOT NULL,"
+                " numbers TEXT NOT NULL,"
+                " result TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " UNIQUE (content_sha256, prompt_key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands ("
+                " bucket INTEGER NOT NULL,"
+                " doc_id INTEGER NOT NULL,"
+                " PRIMARY KEY (bucket, doc_id)) WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+
+    def fingerprint(self, text):
+        """(signature, number digest) for a document's text; signature None if too short to compare."""
+        return minhash(text), number_digest(text or "")
+
+    def lookup(self, fingerprint, prompt_key):
+        """
+        Best earlier document at or above DEDUP_THRESHOLD for the same prompt:
+        {"content_sha256", "similarity", "same_numbers", "result"}, or None.
+        """
+        signature, numbers = fingerprint
+        if signature is None:
+            return None
+        buckets = band_buckets(signature)
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT d.id, d.content_sha256, d.signature, d.numbers FROM documents d"
+                f" WHERE d.id IN (SELECT doc_id FROM bands WHERE bucket IN ({', '.join('?' for _ in buckets)}))"
+                " AND d.prompt_key = ? ORDER BY d.id DESC LIMIT ?",
+                buckets + [prompt_key, MAX_CANDIDATES],
+            ).fetchall()
+        best = None
+        for doc_id, sha256, blob, their_numbers in rows:
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity < DEDUP_THRESHOLD:
+                continue
+            candidate = (their_numbers == numbers, similarity, doc_id, sha256)
+            if best is None or candidate > best:
+                best = candidate
+        if best is None:
+            return None
+        same_numbers, similarity, doc_id, sha256 = best
+        with self._lock:
+            result = self._db().execute("SELECT result FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return {
+            "content_sha256": sha256,
+            "similarity": round(similarity, 4),
+            "same_numbers": same_numbers,
+            "result": json.loads(result[0]) if result else None,
+        }
+
+    def add(self, fingerprint, prompt_key, content_sha256, result):
+        """Remember a document's extracted fields (replaces an earlier entry for the same PDF and prompt)."""
+        signature, numbers = fingerprint
+        if signature is None:
+            return
+        buckets = band_buckets(signature)
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                old = db.execute(
+                    "SELECT id, signature FROM documents WHERE content_sha256 = ? AND prompt_key = ?",
+                    (content_sha256, prompt_key),
+                ).fetchone()
+                if old is not None:
+                    old_buckets = band_buckets(np.frombuffer(old[1], dtype=np.uint32))
+                    db.executemany("DELETE FROM bands WHERE bucket = ? AND doc_id = ?", [(b, old[0]) for b in old_buckets])
+                    db.execute("DELETE FROM documents WHERE id = ?", (old[0],))
+                cur = db.execute(
+                    "INSERT INTO documents (content_sha256, prompt_key, signature, numbers, result, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (content_sha256, prompt_key, signature.tobytes(), numbers, json.dumps(result), time.time()),
+                )
+                db.executemany(
+                    "INSERT OR IGNORE INTO bands (bucket, doc_id) VALUES (?, ?)",
+                    [(bucket, cur.lastrowid) for bucket in buckets],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def snapshot(self):
+        with self._lock:
+            documents = self._db().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {
+            "mode": DEDUP_MODE,
+            "threshold": DEDUP_THRESHOLD,
+            "documents": documents,
+            "num_perm": NUM_PERM,
+            "bands": BANDS,
+        }
+
+
+DEDUP_LOOKUPS = REGISTRY.counter(
+    "invoice_dedup_lookups_total",
+    "Near-duplicate lookups by outcome (reused, flagged, unique, skipped)",
+    ["outcome"],
+)
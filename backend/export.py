@@ -0,0 +1,327 @@
+"""
+Bulk export of stored invoices for a warehouse: one row per invoice, and a
+separate table with one row per line item.
+
+Usage (from backend/):
+    python export.py --format parquet --out exports/ --state exports/watermark.json
+    python export.py --format csv --out exports/ --status Done --date-from 2024-01-01
+"""
+import io
+import os
+import ast
+import csv
+import json
+import time
+import argparse
+import datetime
+
+from invoices import InvoiceStore, EXPORT_CHUNK_ROWS
+from line_items import parse_amount
+from observability import REGISTRY
+
+# -----------------------------------------------------------------------------
+# Bulk export
+# -----------------------------------------------------------------------------
+#
+# Exports read the invoice store in keyset chunks ordered by (updated_at, id)
+# and write each chunk out before reading the next, so memory stays at one
+# chunk whatever the number of invoices. CSV and JSONL are written row by row;
+# Parquet writes one row group per chunk to a sink that is drained after each
+# one, so it streams too. Parquet needs pyarrow, which is optional.
+#
+# Incremental exports take a watermark: an export covers invoices updated in
+# (since, until] and returns until as the next watermark. until defaults to a
+# few seconds before now: a save that took its timestamp just before the
+# export started may still be committing, and leaving the last seconds for the
+# next run means it is not skipped. An invoice changed after its export is
+# exported again by the next run. Consumers upsert invoices by id and replace
+# an invoice's line items by invoice_id.
+
+EXPORT_TABLES = ("invoices", "line_items")
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_SETTLE_SECONDS = float(os.getenv("INVOICE_EXPORT_SETTLE_SECONDS", "5"))
+
+# (column, type); types are "int", "float" or "str"
+INVOICE_COLUMNS = (
+    ("id", "int"),
+    ("case_name", "str"),
+    ("file_name", "str"),
+    ("pages", "int"),
+    ("status", "str"),
+    ("vendor_name", "str"),
+    ("vendor_address", "str"),
+    ("invoice_number", "str"),
+    ("purchase_order", "str"),
+    ("account_number", "str"),
+    ("invoice_date", "str"),
+    ("invoice_date_iso", "str"),
+    ("due_date", "str"),
+    ("due_date_iso", "str"),
+    ("total_amount", "str"),
+    ("total_value", "float"),
+    ("currency", "str"),
+    ("line_items", "int"),
+    ("line_items_source", "str"),
+    ("content_sha256", "str"),
+    ("created_at", "float"),
+    ("updated_at", "float"),
+)
+LINE_ITEM_COLUMNS = (
+    ("invoice_id", "int"),
+    ("line", "int"),
+    ("description", "str"),
+    ("quantity", "str"),
+    ("unit_price", "str"),
+    ("amount", "str"),
+    ("amount_value", "float"),
+    ("invoice_updated_at", "float"),
+)
+TABLE_COLUMNS = {"invoices": INVOICE_COLUMNS, "line_items": LINE_ITEM_COLUMNS}
+
+
+class ExportUnavailableError(Exception):
+    """Raised for an export format whose library is not installed."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailableError("Parquet export needs pyarrow (pip install pyarrow)") from None
+    return pyarrow, pyarrow.parquet
+
+
+def check_format(fmt):
+    """Raise ValueError for an unknown format and ExportUnavailableError for one that cannot run here."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet":
+        _pyarrow()
+
+
+def parse_watermark(value):
+    """Epoch seconds from a number or an ISO timestamp (UTC unless it has an offset); None passes through."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        moment = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid watermark {value!r}: give epoch seconds or an ISO timestamp") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def default_until():
+    return round(time.time() - EXPORT_SETTLE_SECONDS, 6)
+
+
+# -- rows ----------------------------------------------------------------------
+
+def _text(value):
+    if value is None or value == "":
+        return None
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _line_items(value):
+    """The stored line items as a list of dicts (older results keep them as a printed list)."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = ast.literal_eval(value)
+            except Exception:
+                return []
+    if not isinstance(value, list):
+        return []
+    return [item for item in value if isinstance(item, dict)]
+
+
+def table_rows(table, chunks):
+    """Rows (tuples in TABLE_COLUMNS order) of `table`, a list per store chunk."""
+    for chunk in chunks:
+        rows = []
+        for (invoice_id, case_name, file_name, pages, status, vendor, number, invoice_date, invoice_date_iso,
+             due_date, due_date_iso, total, total_value, currency, sha256, fields, created_at, updated_at) in chunk:
+            fields = json.loads(fields)
+            items = _line_items(fields.get("line_items"))
+            if table == "invoices":
+                rows.append((
+                    invoice_id, case_name, file_name, pages, status, vendor, _text(fields.get("vendor_address")),
+                    number, _text(fields.get("purchase_order")), _text(fields.get("account_number")),
+                    invoice_date, invoice_date_iso, due_date, due_date_iso, total, total_value, currency,
+                    len(items), _text(fields.get("line_items_source")), sha256, created_at, updated_at,
+                ))
+            else:
+                for line, item in enumerate(items, 1):
+                    amount = _text(item.get("amount"))
+                    rows.append((
+                        invoice_id, line, _text(item.get("description")), _text(item.get("quantity")),
+                        _text(item.get("unit_price")), amount, parse_amount(amount), updated_at,
+                    ))
+        if rows:
+            yield rows
+
+
+# -- writers: row chunks in, bytes out ----------------------------------------
+
+def write_csv(columns, row_chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for rows in row_chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def write_jsonl(columns, row_chunks):
+    names = [name for name, _ in columns]
+    for rows in row_chunks:
+        yield "".join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows).encode()
+
+
+class _ChunkSink:
+    """Write-only file that hands back what was written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def write_parquet(columns, row_chunks):
+    pa, pq = _pyarrow()
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in row_chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def export_table(store, table, fmt, since=None, until=None, status=None, date_from=None, date_to=None,
+                 chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Bytes of `table` in `fmt` for invoices updated in (since, until], as a
+    generator of chunks. Raises ValueError for an unknown table or format.
+    """
+    if table not in TABLE_COLUMNS:
+        raise ValueError(f"table must be one of {', '.join(EXPORT_TABLES)}")
+    check_format(fmt)
+    chunks = store.export_chunks(since, until, status, date_from, date_to, chunk_size)
+
+    def counted(row_chunks):
+        for rows in row_chunks:
+            EXPORT_ROWS.inc(len(rows), table=table, format=fmt)
+            yield rows
+
+    return WRITERS[fmt](TABLE_COLUMNS[table], counted(table_rows(table, chunks)))
+
+
+# -- CLI -----------------------------------------------------------------------
+
+def _write_file(path, chunks):
+    partial = path + ".partial"
+    size = 0
+    with open(partial, "wb") as f:
+        for data in chunks:
+            f.write(data)
+            size += len(data)
+    os.replace(partial, path)
+    return size
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Export stored invoices and their line items")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--out", required=True, help="directory for the export files")
+    parser.add_argument("--tables", nargs="+", choices=EXPORT_TABLES, default=list(EXPORT_TABLES))
+    parser.add_argument("--since", help="watermark: epoch seconds or ISO timestamp (exclusive)")
+    parser.add_argument("--until", help="upper bound (inclusive); default: now minus INVOICE_EXPORT_SETTLE_SECONDS")
+    parser.add_argument("--state", help="JSON file holding the watermark: read for --since, updated after a full export")
+    parser.add_argument("--status", help="comma-separated statuses, e.g. Done")
+    parser.add_argument("--date-from", help="earliest invoice date (ISO)")
+    parser.add_argument("--date-to", help="latest invoice date (ISO)")
+    parser.add_argument("--db", help="invoice store path; default: the server's")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    try:
+        check_format(args.format)
+    except ExportUnavailableError as ex:
+        parser.error(str(ex))
+    since = parse_watermark(args.since)
+    if since is None and args.state and os.path.exists(args.state):
+        with open(args.state) as f:
+            since = json.load(f)["watermark"]
+    until = parse_watermark(args.until)
+    if until is None:
+        until = default_until()
+    status = [s for s in args.status.split(",") if s] if args.status else None
+
+    store = InvoiceStore(args.db)
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.datetime.fromtimestamp(until, datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    summary = {"since": since, "until": until, "files": {}}
+    started = time.perf_counter()
+    for table in args.tables:
+        path = os.path.join(args.out, f"{table}-{stamp}.{args.format}")
+        chunks = export_table(store, table, args.format, since, until, status, args.date_from, args.date_to,
+                              args.chunk_rows)
+        summary["files"][table] = {"path": path, "bytes": _write_file(path, chunks)}
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    if args.state:
+        with open(args.state + ".partial", "w") as f:
+            json.dump({"watermark": until}, f)
+        os.replace(args.state + ".partial", args.state)
+    print(json.dumps(summary, indent=2))
+
+
+EXPORT_ROWS = REGISTRY.counter(
+    "invoice_export_rows_total",
+    "Rows written by bulk exports, by table and format",
+    ["table", "format"],
+)
+
+
+if __name__ == "__main__":
+    main_cli()
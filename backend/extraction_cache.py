@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------------
+# Extraction result cache
+# -----------------------------------------------------------------------------
+#
+# Two tiers:
+#   1. in-process LRU (OrderedDict) for hot repeats within one worker
+#   2. SQLite file that survives restarts and is shared between workers
+#
+# Keys are content-addressed: sha256(pdf bytes) + custom_prompt + model name,
+# so a re-uploaded PDF with the same prompt never hits the LLM twice.
+#
+# With several workers another process may overwrite or delete a row this
+# worker still holds in memory (DELETE /cache, refresh_cache). Each memory entry
+# remembers SQLite's data_version from when it was read, which only moves when
+# another connection commits; an entry from an older version is looked up on
+# disk again before it is served.
+
+CACHE_DIR = os.getenv("INVOICE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+CACHE_MEMORY_ENTRIES = int(os.getenv("INVOICE_CACHE_MEMORY_ENTRIES", "256"))
+CACHE_DISK_ENTRIES = int(os.getenv("INVOICE_CACHE_DISK_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = int(os.getenv("INVOICE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Disk eviction (TTL and size) runs on every Nth put, not on each one: the disk
+# tier may run up to N entries per worker over CACHE_DISK_ENTRIES in between
+CACHE_EVICT_EVERY = int(os.getenv("INVOICE_CACHE_EVICT_EVERY", "64"))
+
+
+def make_cache_key(content_hash, custom_prompt, model):
+    """Build the cache key from the PDF content hash, prompt and model name."""
+    h = hashlib.sha256()
+    for part in (content_hash, custom_prompt or "", model or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """LRU memory tier in front of a SQLite disk tier, with TTL and size eviction."""
+
+    def __init__(self, path=None, memory_entries=CACHE_MEMORY_ENTRIES,
+                 disk_entries=CACHE_DISK_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS, evict_every=CACHE_EVICT_EVERY):
+        self.path = path or os.path.join(CACHE_DIR, "extractions.sqlite3")
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = max(1, evict_every)
+        self._puts_since_evict = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def _db(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_accessed ON extraction_cache(accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_created ON extraction_cache(created_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _version(self):
+        """SQLite's data_version: changes whenever another connection commits. Caller holds the lock."""
+        return self._db().execute("PRAGMA data_version").fetchone()[0]
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """Return a cached result dict or None."""
+        now = time.time()
+        with self._lock:
+            version = self._version()
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value, seen = entry
+                if seen == version and not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return json.loads(value)
+                del self._memory[key]
+
+            db = self._db()
+            row = db.execute(
+                "SELECT value, created_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value, created_at = row
+            if self._expired(created_at, now):
+                db.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                db.commit()
+                self.stats["evictions"] += 1
+                self.stats["misses"] += 1
+                return None
+            db.execute("UPDATE extraction_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            self._remember(key, created_at, value, version)
+            self.stats["disk_hits"] += 1
+            return json.loads(value)
+
+    def put(self, key, result):
+        """Store a result dict in both tiers."""
+        now = time.time()
+        value = json.dumps(result)
+        with self._lock:
+            self._remember(key, now, value, self._version())
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            # The first put evicts too, so a restart with an overfull table catches up at once
+            if self._puts_since_evict % self.evict_every == 0:
+                self._evict_disk(db, now)
+            self._puts_since_evict += 1
+            db.commit()
+            self.stats["writes"] += 1
+
+    def invalidate(self, key):
+        """Drop a key from both tiers. Returns True if anything was removed."""
+        with self._lock:
+            removed = self._memory.pop(key, None) is not None
+            db = self._db()
+            cur = db.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+            db.commit()
+            removed = removed or cur.rowcount > 0
+            if removed:
+                self.stats["invalidations"] += 1
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            db.execute("DELETE FROM extraction_cache")
+            db.commit()
+
+    def snapshot(self):
+        """Counters plus current sizes, for the stats endpoint."""
+        with self._lock:
+            db = self._db()
+            disk_entries = db.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_capacity": self.memory_entries,
+                "disk_entries": disk_entries,
+                "disk_capacity": self.disk_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _remember(self, key, created_at, value, version):
+        self._memory[key] = (created_at, value, version)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, db, now):
+        if self.ttl_seconds > 0:
+            cur = db.execute("DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.stats["evictions"] += max(cur.rowcount, 0)
+        count = db.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        overflow = count - self.disk_entries
+        if overflow > 0:
+            db.execute(
+                "DELETE FROM extraction_cache WHERE key IN ("
+                " SELECT key FROM extraction_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.stats["evictions"] += overflow
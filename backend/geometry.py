@@ -0,0 +1,123 @@
+import sys
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Columnar word geometry
+# -----------------------------------------------------------------------------
+#
+# pdfplumber gives us one dict per word (~10 keys each). For box finding we only
+# need the text and four coordinates, so pages keep them as parallel NumPy
+# arrays plus an interned text array. That is a fraction of the memory, pickles
+# cheaply across the process pool, and lets the geometry math run vectorized.
+
+
+class PageGeometry:
+    """
+    Words of one page as columns: text (interned str objects), x0, x1, top, bottom.
+    Behaves like the old list of word dicts (len, iteration, words[i]) so callers
+    that only need a few words can still treat it as such.
+    """
+
+    __slots__ = ("text", "x0", "x1", "top", "bottom")
+
+    def __init__(self, text, x0, x1, top, bottom):
+        self.text = text
+        self.x0 = x0
+        self.x1 = x1
+        self.top = top
+        self.bottom = bottom
+
+    @classmethod
+    def from_words(cls, words):
+        """Build from a list of pdfplumber word dicts (PageGeometry is returned as-is)."""
+        if isinstance(words, cls):
+            return words
+        words = words or []
+        n = len(words)
+        text = np.empty(n, dtype=object)
+        text[:] = [sys.intern(str(w.get("text", ""))) for w in words]
+        coords = np.array(
+            [(w.get("x0", 0), w.get("x1", 0), w.get("top", 0), w.get("bottom", 0)) for w in words],
+            dtype=np.float64,
+        ).reshape(n, 4)
+        return cls(text, coords[:, 0].copy(), coords[:, 1].copy(), coords[:, 2].copy(), coords[:, 3].copy())
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, i):
+        return {
+            "text": self.text[i],
+            "x0": float(self.x0[i]),
+            "x1": float(self.x1[i]),
+            "top": float(self.top[i]),
+            "bottom": float(self.bottom[i]),
+        }
+
+    def __iter__(self):
+        for i in range(len(self.text)):
+            yield self[i]
+
+    def texts(self, indexes):
+        return [self.text[i] for i in indexes]
+
+    def nbytes(self):
+        """Approximate memory held by the columns (text objects are shared via interning)."""
+        return self.x0.nbytes * 4 + self.text.nbytes
+
+
+def merge_box(geometry, indexes, page_w, page_h):
+    """
+    Union bounding box of the given words with 5%/10% padding, clamped to the
+    page and normalized to 0-1 top-left coordinates. Shared by every field type.
+    """
+    idx = np.asarray(indexes, dtype=np.intp)
+    x0 = geometry.x0[idx].min()
+    x1 = geometry.x1[idx].max()
+    # PDF y axis grows upwards: y0/y1 are measured from the page bottom
+    y0 = page_h - geometry.bottom[idx].max()
+    y1 = page_h - geometry.top[idx].min()
+
+    # Add padding
+    padding_x = (x1 - x0) * 0.05
+    padding_y = (y1 - y0) * 0.1
+
+    x0 = max(0, x0 - padding_x)
+    y0 = max(0, y0 - padding_y)
+    x1 = min(page_w, x1 + padding_x)
+    y1 = min(page_h, y1 + padding_y)
+
+    # Convert to top-left origin for canvas, normalized to 0-1
+    return {
+        'x': float(x0 / page_w),
+        'y': float((page_h - y1) / page_h),
+        'width': float((x1 - x0) / page_w),
+        'height': float((y1 - y0) / page_h),
+    }
+
+
+def address_cluster(geometry, candidate_mask, max_x_offset=150, max_gap=50):
+    """
+    Indexes of the largest vertical cluster among candidate words: drop words more
+    than max_x_offset from the median x0, sort top-to-bottom, split where the
+    vertical gap exceeds max_gap, and keep the cluster with the most words.
+    """
+    candidates = np.flatnonzero(candidate_mask)
+    if candidates.size == 0:
+        return candidates
+
+    # Horizontal filtering: discard outliers relative to the median X
+    x0 = geometry.x0[candidates]
+    median_x = np.median(x0)
+    kept = candidates[np.abs(x0 - median_x) <= max_x_offset]
+    if kept.size == 0:
+        return kept
+
+    # Sort by position (top to bottom, left to right); lexsort is stable
+    kept = kept[np.lexsort((geometry.x0[kept], geometry.top[kept]))]
+
+    # Vertical clustering: a gap of more than max_gap starts a new cluster
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(geometry.top[kept]) > max_gap) + 1))
+    sizes = np.diff(np.concatenate((starts, [kept.size])))
+    best = int(np.argmax(sizes))  # first largest, like max(clusters, key=len)
+    return kept[starts[best]:starts[best] + sizes[best]]
@@ -0,0 +1,66 @@
+import json
+
+# -----------------------------------------------------------------------------
+# Incremental JSON object parsing
+# -----------------------------------------------------------------------------
+#
+# The LLM streams one JSON object a few characters at a time. Each top-level
+# member is complete once we are back at depth 1 and see the ',' or '}' after
+# it, so we only track nesting and strings, slice the member out and json.loads
+# just that slice. Anything before the first '{' (e.g. a ```json fence) is
+# skipped; the final full-text parse stays the source of truth.
+
+
+class IncrementalObjectParser:
+    """Feed text chunks of a JSON object; get back top-level (key, value) pairs as they complete."""
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if self.done:
+                break
+            if ch == '"':
+                self._in_string = self._depth > 0
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = i + 1
+            elif ch in "}]":
+                if self._depth == 1:
+                    completed.extend(self._member(text[self._member_start:i]))
+                    self.done = True
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                completed.extend(self._member(text[self._member_start:i]))
+                self._member_start = i + 1
+        self._pos = len(text)
+        return completed
+
+    @staticmethod
+    def _member(member):
+        if not member.strip():
+            return []
+        try:
+            return list(json.loads("{" + member + "}").items())
+        except ValueError:
+            return []
@@ -0,0 +1,415 @@
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import datetime
+import threading
+
+from extraction_cache import CACHE_DIR
+from line_items import parse_amount
+
+# -----------------------------------------------------------------------------
+# Invoice store
+# -----------------------------------------------------------------------------
+#
+# Invoices (case name, status, extracted fields, boxes and the PDF itself) live
+# in SQLite next to the other stores, so every browser and every uvicorn worker
+# sees the same list. The fields people filter and sort on are copied out of
+# the JSON into real, indexed columns: vendor, invoice/due date (normalized to
+# ISO so they sort), total as a number, status.
+#
+# Listing is keyset-paginated: the cursor carries the last row's sort value and
+# id, so page N costs the same as page 1 and rows inserted meanwhile don't shift
+# pages. NULL sort values (no date or total extracted yet) come after all others.
+
+INVOICE_STATUSES = ("Pending", "Done", "Error")
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+
+# sort name -> column (each has an index ending in id)
+SORT_COLUMNS = {
+    "id": "id",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "case_name": "case_name",
+    "vendor": "vendor_name",
+    "invoice_date": "invoice_date_iso",
+    "due_date": "due_date_iso",
+    "total": "total_value",
+    "status": "status",
+}
+NULLABLE_SORTS = {"vendor_name", "invoice_date_iso", "due_date_iso", "total_value"}
+
+# Printed date formats we can normalize; day-first wins for ambiguous numeric dates
+DATE_FORMATS = (
+    "%Y-%m-%d", "%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y",
+    "%d-%b-%Y", "%d/%m/%Y", "%m/%d/%Y", "%d.%m.%Y", "%d/%m/%y", "%m/%d/%y", "%Y/%m/%d",
+)
+
+COLUMNS = (
+    "id, case_name, file_name, pages, status, vendor_name, invoice_number, invoice_date, due_date,"
+    " total_amount, currency, content_sha256, fields, boxes, created_at, updated_at"
+)
+# What exports read: no boxes, plus the normalized date and total columns
+EXPORT_COLUMNS = (
+    "id, case_name, file_name, pages, status, vendor_name, invoice_number, invoice_date, invoice_date_iso,"
+    " due_date, due_date_iso, total_amount, total_value, currency, content_sha256, fields, created_at, updated_at"
+)
+EXPORT_CHUNK_ROWS = 5000
+
+
+class InvoiceNotFoundError(Exception):
+    """Raised for an invoice id that does not exist."""
+
+
+def normalize_date(text):
+    """ISO date (YYYY-MM-DD) for a printed date, or None."""
+    if not text or not isinstance(text, str):
+        return None
+    value = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text.strip())
+    value = re.sub(r"\s+", " ", value)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """[sort value, id] from a cursor string; raises ValueError on garbage."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as ex:
+        raise ValueError("Invalid cursor") from ex
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _text(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class InvoiceStore:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "invoices.sqlite3")
+        self.files_dir = os.path.join(os.path.dirname(self.path), "invoices")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(self.files_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoices ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " case_name TEXT NOT NULL,"
+                " file_name TEXT,"
+                " pdf_path TEXT,"
+                " pages INTEGER,"
+                " status TEXT NOT NULL DEFAULT 'Pending',"
+                " vendor_name TEXT COLLATE NOCASE,"
+                " invoice_number TEXT,"
+                " invoice_date TEXT,"
+                " invoice_date_iso TEXT,"
+                " due_date TEXT,"
+                " due_date_iso TEXT,"
+                " total_amount TEXT,"
+                " total_value REAL,"
+                " currency TEXT,"
+                " content_sha256 TEXT,"
+                " fields TEXT NOT NULL DEFAULT '{}',"
+                " boxes TEXT NOT NULL DEFAULT '[]',"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            for name, column in (
+                ("status", "status"),
+                ("vendor", "vendor_name"),
+                ("invoice_date", "invoice_date_iso"),
+                ("due_date", "due_date_iso"),
+                ("total", "total_value"),
+                ("created", "created_at"),
+                ("updated", "updated_at"),
+                ("case_name", "case_name"),
+            ):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_invoices_{name} ON invoices({column}, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_sha256 ON invoices(content_sha256)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args)
+
+    # Rows are read under the lock too: the connection is shared between threads
+    def _fetchone(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args).fetchone()
+
+    def _fetchall(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args).fetchall()
+
+    @staticmethod
+    def _row(row):
+        (invoice_id, case_name, file_name, pages, status, vendor, number, invoice_date, due_date,
+         total, currency, sha256, fields, boxes, created_at, updated_at) = row
+        return {
+            "id": invoice_id,
+            "case_name": case_name,
+            "file_name": file_name,
+            "pages": pages,
+            "status": status,
+            "vendor_name": vendor,
+            "invoice_number": number,
+            "invoice_date": invoice_date,
+            "due_date": due_date,
+            "total_amount": total,
+            "currency": currency,
+            "content_sha256": sha256,
+            "fields": json.loads(fields),
+            "boxes": json.loads(boxes),
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    # -- writes ----------------------------------------------------------------
+
+    def create(self, case_name, file_name=None, pages=None, document=None):
+        """New Pending invoice; `document` (uploads.StoredDocument) is kept as its PDF."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                "INSERT INTO invoices (case_name, file_name, pages, content_sha256, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (case_name, file_name, pages, document.sha256 if document else None, now, now),
+            )
+            invoice_id = cur.lastrowid
+        if document is not None:
+            pdf_path = os.path.join(self.files_dir, f"{invoice_id}.pdf")
+            document.save_to(pdf_path)
+            self._execute("UPDATE invoices SET pdf_path = ? WHERE id = ?", (pdf_path, invoice_id))
+        return self.get(invoice_id)
+
+    def update(self, invoice_id, case_name=None, status=None, fields=None, boxes=None):
+        """Change any of case name, status, fields (API field names) and boxes."""
+        sets, args = [], []
+        if case_name is not None:
+            sets.append("case_name = ?")
+            args.append(case_name)
+        if status is not None:
+            if status not in INVOICE_STATUSES:
+                raise ValueError(f"status must be one of {', '.join(INVOICE_STATUSES)}")
+            sets.append("status = ?")
+            args.append(status)
+        if fields is not None:
+            vendor = _text(fields.get("vendor_name"))
+            invoice_date = _text(fields.get("invoice_date"))
+            due_date = _text(fields.get("due_date"))
+            total = _text(fields.get("total_amount"))
+            sets.append(
+                "fields = ?, vendor_name = ?, invoice_number = ?, invoice_date = ?, invoice_date_iso = ?,"
+                " due_date = ?, due_date_iso = ?, total_amount = ?, total_value = ?, currency = ?"
+            )
+            args += [
+                json.dumps(fields), vendor or None, _text(fields.get("invoice_number")) or None,
+                invoice_date or None, normalize_date(invoice_date), due_date or None, normalize_date(due_date),
+                total or None, parse_amount(total), _text(fields.get("currency")) or None,
+            ]
+        if boxes is not None:
+            sets.append("boxes = ?")
+            args.append(json.dumps(boxes))
+        if sets:
+            sets.append("updated_at = ?")
+            args += [time.time(), invoice_id]
+            cur = self._execute(f"UPDATE invoices SET {', '.join(sets)} WHERE id = ?", args)
+            if cur.rowcount == 0:
+                raise InvoiceNotFoundError(invoice_id)
+        invoice = self.get(invoice_id)
+        if invoice is None:
+            raise InvoiceNotFoundError(invoice_id)
+        return invoice
+
+    def delete(self, invoice_id):
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT pdf_path FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+            if row is None:
+                return False
+            db.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+        if row[0] and os.path.exists(row[0]):
+            os.unlink(row[0])
+        return True
+
+    # -- reads -----------------------------------------------------------------
+
+    def get(self, invoice_id):
+        row = self._fetchone(f"SELECT {COLUMNS} FROM invoices WHERE id = ?", (invoice_id,))
+        return self._row(row) if row else None
+
+    def get_many(self, invoice_ids):
+        """{id: invoice} for the ids that exist."""
+        if not invoice_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in invoice_ids)
+        rows = self._fetchall(f"SELECT {COLUMNS} FROM invoices WHERE id IN ({placeholders})", list(invoice_ids))
+        return {row[0]: self._row(row) for row in rows}
+
+    def pdf_path(self, invoice_id):
+        row = self._fetchone("SELECT pdf_path FROM invoices WHERE id = ?", (invoice_id,))
+        return row[0] if row and row[0] and os.path.exists(row[0]) else None
+
+    def status_counts(self):
+        rows = self._fetchall("SELECT status, COUNT(*) FROM invoices GROUP BY status")
+        counts = {status: count for status, count in rows}
+        return {"total": sum(counts.values()), "by_status": counts}
+
+    def list(self, status=None, vendor=None, q=None, date_from=None, date_to=None, min_total=None,
+             max_total=None, sort="id", order="desc", limit=PAGE_SIZE_DEFAULT, cursor=None):
+        """
+        One page of invoices: {"items": [...], "next_cursor": str or None}.
+        status is a list of statuses; vendor matches a name prefix (case-insensitive);
+        q matches the case name, file name or invoice number anywhere, or the id;
+        date_from/date_to bound the invoice date (ISO); min_total/max_total the total.
+        Raises ValueError for an unknown sort/order or a bad cursor.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        column = SORT_COLUMNS[sort]
+        limit = max(1, min(int(limit), PAGE_SIZE_MAX))
+
+        where, args = [], []
+        if status:
+            where.append(f"status IN ({', '.join('?' for _ in status)})")
+            args += list(status)
+        if vendor:
+            where.append("vendor_name LIKE ? ESCAPE '\\'")
+            args.append(re.sub(r"([%_\\])", r"\\\1", vendor) + "%")
+        if q:
+            like = "%" + re.sub(r"([%_\\])", r"\\\1", q) + "%"
+            clause = ("case_name LIKE ? ESCAPE '\\' OR file_name LIKE ? ESCAPE '\\'"
+                      " OR invoice_number LIKE ? ESCAPE '\\'")
+            qargs = [like, like, like]
+            if q.strip().isdigit():
+                clause += " OR id = ?"
+                qargs.append(int(q.strip()))
+            where.append(f"({clause})")
+            args += qargs
+        if date_from:
+            where.append("invoice_date_iso >= ?")
+            args.append(date_from)
+        if date_to:
+            where.append("invoice_date_iso <= ?")
+            args.append(date_to)
+        if min_total is not None:
+            where.append("total_value >= ?")
+            args.append(min_total)
+        if max_total is not None:
+            where.append("total_value <= ?")
+            args.append(max_total)
+
+        after = decode_cursor(cursor) if cursor else None
+        op = ">" if order == "asc" else "<"
+        direction = order.upper()
+        nullable = column in NULLABLE_SORTS
+        rows = []
+        # Non-NULL sort values first (index range scan on (column, id)) ...
+        if not (nullable and after is not None and after[0] is None):
+            clauses = list(where)
+            page_args = list(args)
+            if nullable:
+                clauses.append(f"{column} IS NOT NULL")
+            if after is not None:
+                clauses.append(f"({column}, id) {op} (?, ?)")
+                page_args += after
+            rows = self._select(column, clauses, page_args, f"{column} {direction}, id {direction}", limit + 1)
+        # ... then the rows without one, by id
+        if nullable and len(rows) <= limit:
+            clauses = list(where) + [f"{column} IS NULL"]
+            page_args = list(args)
+            if after is not None and after[0] is None:
+                clauses.append(f"id {op} ?")
+                page_args.append(after[1])
+            rows += self._select(column, clauses, page_args, f"id {direction}", limit + 1 - len(rows))
+
+        items = [self._row(row[1:]) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor([last[0], last[1]])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def export_chunks(self, since=None, until=None, status=None, date_from=None, date_to=None,
+                      chunk_size=EXPORT_CHUNK_ROWS):
+        """
+        Invoices last updated in (since, until], oldest first, as lists of up to
+        chunk_size rows (EXPORT_COLUMNS, fields still JSON text). status and the
+        invoice date bounds filter as in list(). Reads on its own connection, one
+        short query per chunk, so the API is not held up by a long export.
+        """
+        where, args = [], []
+        if since is not None:
+            where.append("updated_at > ?")
+            args.append(since)
+        if until is not None:
+            where.append("updated_at <= ?")
+            args.append(until)
+        if status:
+            where.append(f"status IN ({', '.join('?' for _ in status)})")
+            args += list(status)
+        if date_from:
+            where.append("invoice_date_iso >= ?")
+            args.append(date_from)
+        if date_to:
+            where.append("invoice_date_iso <= ?")
+            args.append(date_to)
+        self._db()
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA busy_timeout=5000")
+            after = None
+            while True:
+                clauses = list(where)
+                page_args = list(args)
+                if after is not None:
+                    # Keyset on the (updated_at, id) index
+                    clauses.append("(updated_at, id) > (?, ?)")
+                    page_args += after
+                sql = f"SELECT {EXPORT_COLUMNS} FROM invoices"
+                if clauses:
+                    sql += " WHERE " + " AND ".join(clauses)
+                sql += " ORDER BY updated_at, id LIMIT ?"
+                rows = conn.execute(sql, page_args + [chunk_size]).fetchall()
+                if not rows:
+                    return
+                yield rows
+                if len(rows) < chunk_size:
+                    return
+                after = [rows[-1][-1], rows[-1][0]]
+        finally:
+            conn.close()
+
+    def _select(self, column, clauses, args, order_by, limit):
+        """Rows of (sort value, *COLUMNS)."""
+        sql = f"SELECT {column}, {COLUMNS} FROM invoices"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by} LIMIT ?"
+        return self._fetchall(sql, list(args) + [limit])
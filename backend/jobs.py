@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+
+from extraction_cache import CACHE_DIR
+
+# -----------------------------------------------------------------------------
+# Persistent extraction job queue
+# -----------------------------------------------------------------------------
+#
+# Jobs live in SQLite next to the extraction cache and their PDFs are kept on
+# disk until the job finishes, so a restart simply picks queued work back up.
+# Workers claim jobs with an atomic UPDATE, which also makes the queue safe to
+# share between several uvicorn worker processes. Running jobs carry a
+# heartbeat; a job whose owner stopped heartbeating goes back to the queue.
+# The heartbeat also refreshes last_stats, the per-status counts the metrics
+# endpoint reports, so a scrape never queries SQLite.
+
+JOB_WORKERS = int(os.getenv("INVOICE_JOB_WORKERS", os.getenv("INVOICE_LLM_CONCURRENCY", "2")))
+JOB_MAX_PENDING = int(os.getenv("INVOICE_JOB_MAX_PENDING", "200"))
+JOB_RETENTION_SECONDS = int(os.getenv("INVOICE_JOB_RETENTION_SECONDS", str(24 * 3600)))
+JOB_HEARTBEAT_SECONDS = 10
+JOB_STALE_SECONDS = 3 * JOB_HEARTBEAT_SECONDS
+
+JOB_STAGES = ["queued", "pdf_parsed", "template_matched", "llm_done", "cleaned", "boxes_done"]
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds JOB_MAX_PENDING unfinished jobs."""
+
+    def __init__(self, pending, retry_after):
+        super().__init__(f"Extraction queue is full ({pending} pending jobs)")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    def __init__(self, path=None, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        self.path = path or os.path.join(CACHE_DIR, "jobs.sqlite3")
+        self.files_dir = os.path.join(os.path.dirname(self.path), "jobs")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = None
+        self._loop = None
+        self._wakeup = None
+        self._changed = None
+        self._tasks = []
+        self._handler = None
+        self.last_stats = {"workers": workers, "max_pending": max_pending, "counts": {}}
+
+    # -- storage ---------------------------------------------------------------
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(self.files_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " pdf_path TEXT,"
+                " params TEXT NOT NULL,"
+                " progress TEXT NOT NULL DEFAULT '[]',"
+                " result TEXT,"
+                " error TEXT,"
+                " owner TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " heartbeat_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args)
+
+    # Rows are read under the lock too: the connection is shared between threads
+    def _fetchone(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args).fetchone()
+
+    def _fetchall(self, sql, args=()):
+        with self._lock:
+            return self._db().execute(sql, args).fetchall()
+
+    def get(self, job_id):
+        with self._lock:
+            cur = self._db().execute(
+                "SELECT id, status, stage, params, result, error, created_at, updated_at, progress FROM jobs WHERE id = ?",
+                (job_id,),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row[0],
+            "status": row[1],
+            "stage": row[2],
+            "params": json.loads(row[3]),
+            "progress": json.loads(row[8]),
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+        if row[4] is not None:
+            job["result"] = json.loads(row[4])
+        if row[5] is not None:
+            job["error"] = row[5]
+        if row[1] == "queued":
+            job["queue_position"] = self._fetchone(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?", (row[6],)
+            )[0]
+        return job
+
+    def pending_count(self):
+        return self._fetchone("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')")[0]
+
+    def stats(self):
+        rows = self._fetchall("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        self.last_stats = {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "counts": {status: count for status, count in rows},
+        }
+        return self.last_stats
+
+    # -- producer side ---------------------------------------------------------
+
+    def submit(self, document, params):
+        """
+        Persist the PDF (an uploads.StoredDocument) and enqueue a job.
+        Raises QueueFullError under backpressure. Blocking; run in a thread.
+        """
+        pending = self.pending_count()
+        if pending >= self.max_pending:
+            # Rough estimate: each worker clears a job every ~10s
+            retry_after = max(1, int(10 * (pending - self.max_pending + 1) / max(1, self.workers)))
+            raise QueueFullError(pending, retry_after)
+
+        job_id = uuid.uuid4().hex
+        pdf_path = os.path.join(self.files_dir, f"{job_id}.pdf")
+        self._db()
+        document.save_to(pdf_path)
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, stage, pdf_path, params, created_at, updated_at)"
+            " VALUES (?, 'queued', 'queued', ?, ?, ?, ?)",
+            (job_id, pdf_path, json.dumps(params), now, now),
+        )
+        self._notify()
+        return job_id
+
+    # -- worker side -----------------------------------------------------------
+
+    def start(self, handler):
+        """
+        Start the worker tasks. `handler(pdf_path, params, on_stage)` is an async
+        callable returning the result dict; on_stage(stage) reports progress.
+        """
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        self.requeue_stale()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._notify()
+        self.stats()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        # Hand our running jobs back to the queue so the next start resumes them
+        self._execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', progress = '[]', owner = NULL"
+            " WHERE status = 'running' AND owner = ?",
+            (self.owner,),
+        )
+
+    def requeue_stale(self):
+        """Put running jobs whose owner stopped heartbeating back in the queue."""
+        cutoff = time.time() - JOB_STALE_SECONDS
+        with self._lock:
+            return self._db().execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', progress = '[]', owner = NULL"
+                " WHERE status = 'running' AND COALESCE(heartbeat_at, updated_at) < ?",
+                (cutoff,),
+            ).rowcount
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running and return it."""
+        with self._lock:
+            db = self._db()
+            while True:
+                row = db.execute(
+                    "SELECT id, pdf_path, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                cur = db.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, updated_at = ?, heartbeat_at = ?"
+                    " WHERE id = ? AND status = 'queued'",
+                    (self.owner, now, now, row[0]),
+                )
+                if cur.rowcount == 1:
+                    return row[0], row[1], json.loads(row[2])
+                # Another process claimed it first; try the next one
+
+    def _set_stage(self, job_id, stage):
+        # progress keeps every stage with its timestamp, so SSE subscribers see
+        # stages that completed faster than they poll
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET stage = ?, progress = json_insert(progress, '$[#]', json_object('stage', ?, 'at', ?)),"
+            " updated_at = ?, heartbeat_at = ? WHERE id = ?",
+            (stage, stage, now, now, now, job_id),
+        )
+        self._notify()
+
+    def _finish(self, job_id, pdf_path, result=None, error=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, pdf_path = NULL, owner = NULL, updated_at = ? WHERE id = ?",
+            (
+                "failed" if error else "done",
+                json.dumps(result) if result is not None else None,
+                error,
+                time.time(),
+                job_id,
+            ),
+        )
+        if pdf_path and os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+        self._notify()
+
+    async def _worker(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    # Poll as well, so jobs submitted by other processes are picked up
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, pdf_path, params = claimed
+            try:
+                result = await self._handler(pdf_path, params, lambda stage: self._set_stage(job_id, stage))
+                self._finish(job_id, pdf_path, result=result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self._finish(job_id, pdf_path, error=str(ex))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            now = time.time()
+            self._execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                (now, self.owner),
+            )
+            if self.requeue_stale():
+                self._notify()
+            if JOB_RETENTION_SECONDS > 0:
+                self._execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                    (now - JOB_RETENTION_SECONDS,),
+                )
+            await asyncio.to_thread(self.stats)
+
+    def _notify(self):
+        if self._loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if not on_loop:
+            # Called from a thread (submit): the events belong to the loop
+            self._loop.call_soon_threadsafe(self._notify)
+            return
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._changed is not None:
+            # Swap in a fresh event so every current waiter wakes exactly once
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout):
+        """Sleep until a local job changes state or the timeout elapses."""
+        if self._changed is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,259 @@
+import re
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Layout-based line-item tables
+# -----------------------------------------------------------------------------
+#
+# Line items are most of the LLM's output tokens and the part it truncates. Most
+# invoices print them as a grid, so we read them from word geometry instead:
+# group words into rows, find the header row (a description column and an
+# amount column, optionally quantity and unit price), cut column boundaries
+# halfway between header cells and read body rows until the totals block or a
+# large vertical gap. Lines without an amount continue the previous item's
+# description.
+#
+# Rows are only trusted when they add up: every quantity x unit price must match
+# its amount, and the amounts must sum to a total printed in the document (on
+# its own, or plus a tax line). Anything else goes back to the LLM.
+
+ROLE_PATTERNS = (
+    ("description", re.compile(r"^(item\s+)?(description|items?|services?|products?|details|particulars)$")),
+    ("quantity", re.compile(r"^(qty|quantity|units|hours|hrs)$")),
+    ("unit_price", re.compile(r"^(unit\s+(price|cost|rate)|price|rate|each|unit)$")),
+    ("amount", re.compile(r"^(amount|line\s+total|total|ext(ended)?(\s+(price|amount))?|net(\s+amount)?)$")),
+)
+STOP_RE = re.compile(
+    r"^(sub-?\s?total|total|amount\s+(due|payable|owing)|balance|tax|gst|vat|notes?|terms|thank)\b",
+    re.IGNORECASE,
+)
+TOTAL_LINE_RE = re.compile(r"\b(sub-?\s?total|total|amount\s+(due|payable|owing)|balance\s+due)\b", re.IGNORECASE)
+TAX_LINE_RE = re.compile(r"\b(tax|gst|vat)\b", re.IGNORECASE)
+LINE_MONEY_RE = re.compile(r"\(?-?[$€£¥]?\s?-?\d[\d,]*\.\d{2}\)?")
+NUMBER_RE = re.compile(r"^\(?-?[$€£¥]?\s?-?\d[\d,.]*\)?(-|cr)?$", re.IGNORECASE)
+CURRENCY_CODE_RE = re.compile(r"\b[A-Z]{3}\b")
+
+# Header words closer than this many line heights belong to one cell ("Unit Price")
+CELL_GAP = 0.6
+# A body row further than this many row pitches below the previous one ends the table
+MAX_ROW_GAP = 2.2
+# Description-only rows allowed in a row before we assume the table is over
+MAX_CONTINUATION_ROWS = 3
+
+
+def parse_amount(text):
+    """Float value of a printed amount ("$1,234.50", "(20.00)", "1.234,50", "15.00 CR"), or None."""
+    if not text:
+        return None
+    t = CURRENCY_CODE_RE.sub("", str(text)).replace(" ", "")
+    if not t or not NUMBER_RE.match(t):
+        return None
+    negative = (t.startswith("(") and t.endswith(")")) or "-" in t or t.lower().endswith("cr")
+    digits = re.sub(r"[^\d.,]", "", t)
+    if "," in digits and "." in digits:
+        # Whichever separator comes last is the decimal point
+        if digits.rfind(",") > digits.rfind("."):
+            digits = digits.replace(".", "").replace(",", ".")
+        else:
+            digits = digits.replace(",", "")
+    elif "," in digits:
+        head, _, tail = digits.rpartition(",")
+        digits = f"{head.replace(',', '')}.{tail}" if len(tail) == 2 else digits.replace(",", "")
+    try:
+        value = float(digits)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def _rows(geometry):
+    """Word indexes grouped into visual lines, top to bottom, each sorted left to right."""
+    if geometry is None or len(geometry) == 0:
+        return [], 0.0
+    heights = geometry.bottom - geometry.top
+    height = float(np.median(heights)) or 1.0
+    order = np.argsort(geometry.top, kind="stable")
+    rows = []
+    current = []
+    row_top = None
+    for i in order:
+        top = geometry.top[i]
+        if row_top is not None and top - row_top > height * 0.5:
+            rows.append(current)
+            current = []
+            row_top = None
+        if row_top is None:
+            row_top = top
+        current.append(int(i))
+    if current:
+        rows.append(current)
+    return [sorted(row, key=lambda i: geometry.x0[i]) for row in rows], height
+
+
+def _cells(geometry, row, height):
+    """Merge a row's words into cells: [(x0, x1, text)]."""
+    cells = []
+    for i in row:
+        x0, x1, text = float(geometry.x0[i]), float(geometry.x1[i]), str(geometry.text[i])
+        if cells and x0 - cells[-1][1] <= height * CELL_GAP:
+            px0, _, ptext = cells[-1]
+            cells[-1] = (px0, x1, f"{ptext} {text}")
+        else:
+            cells.append((x0, x1, text))
+    return cells
+
+
+def _role(text):
+    key = re.sub(r"[^a-z ]", "", text.lower())
+    key = re.sub(r"\s+", " ", key).strip()
+    for role, pattern in ROLE_PATTERNS:
+        if pattern.match(key):
+            return role
+    return None
+
+
+def _header_columns(cells):
+    """[(left, right, role)] column spans if the cells look like a line-item header, else None."""
+    roles = [_role(text) for _, _, text in cells]
+    if "description" not in roles or "amount" not in roles:
+        return None
+    # Nothing else on the row may claim a role twice ("Total ... Total" is a totals line)
+    named = [r for r in roles if r]
+    if len(named) != len(set(named)) or len(named) < len(cells) / 2:
+        return None
+    columns = []
+    for k, ((x0, x1, _), role) in enumerate(zip(cells, roles)):
+        left = -np.inf if k == 0 else (cells[k - 1][1] + x0) / 2
+        right = np.inf if k == len(cells) - 1 else (x1 + cells[k + 1][0]) / 2
+        columns.append((left, right, role))
+    return columns
+
+
+def _split_row(geometry, row, columns):
+    """{role: text} for one body row, words placed by their horizontal centre."""
+    parts = {}
+    for i in row:
+        centre = (geometry.x0[i] + geometry.x1[i]) / 2
+        for left, right, role in columns:
+            if left <= centre < right:
+                if role:
+                    parts.setdefault(role, []).append(str(geometry.text[i]))
+                break
+    return {role: " ".join(words) for role, words in parts.items()}
+
+
+def _page_items(geometry):
+    """Line items of one page's table, or None if the page has no line-item header."""
+    rows, height = _rows(geometry)
+    for h, row in enumerate(rows):
+        columns = _header_columns(_cells(geometry, row, height))
+        if columns is not None:
+            break
+    else:
+        return None
+
+    items = []
+    pitch = None
+    last_top = float(geometry.top[rows[h][0]])
+    continuation_rows = 0
+    for row in rows[h + 1:]:
+        top = float(geometry.top[row[0]])
+        gap = top - last_top
+        if pitch is not None and gap > MAX_ROW_GAP * max(pitch, height * 1.2):
+            break
+        parts = _split_row(geometry, row, columns)
+        description = parts.get("description", "")
+        first_text = str(geometry.text[row[0]])
+        if STOP_RE.match(description) or (not description and STOP_RE.match(first_text)):
+            break
+        amount = parts.get("amount")
+        if amount is not None and parse_amount(amount) is not None:
+            items.append({
+                "description": description or None,
+                "quantity": parts.get("quantity"),
+                "unit_price": parts.get("unit_price"),
+                "amount": amount,
+            })
+            continuation_rows = 0
+        elif description and items and continuation_rows < MAX_CONTINUATION_ROWS and amount is None:
+            items[-1]["description"] = f"{items[-1]['description'] or ''} {description}".strip()
+            continuation_rows += 1
+        else:
+            break
+        if pitch is None:
+            pitch = gap
+        last_top = top
+    return items
+
+
+def _document_totals(pages):
+    """Amounts printed on total-like lines, and on tax lines, of the parsed pages."""
+    totals, taxes = [], []
+    for page in pages:
+        for line in (page.get("text") or "").splitlines():
+            amounts = [parse_amount(m) for m in LINE_MONEY_RE.findall(line)]
+            amounts = [a for a in amounts if a is not None]
+            if not amounts:
+                continue
+            if TOTAL_LINE_RE.search(line):
+                totals.extend(amounts)
+            elif TAX_LINE_RE.search(line):
+                taxes.extend(amounts)
+    return totals, taxes
+
+
+def _row_consistent(item):
+    quantity = parse_amount(item["quantity"])
+    unit_price = parse_amount(item["unit_price"])
+    amount = parse_amount(item["amount"])
+    if quantity is None or unit_price is None:
+        return True
+    return abs(quantity * unit_price - amount) <= max(0.011, abs(amount) * 0.005)
+
+
+def reconcile(items, pages, total_amount=None):
+    """Printed total (as a float) the item amounts add up to, or None if they don't."""
+    if not items or not all(_row_consistent(item) for item in items):
+        return None
+    total = sum(parse_amount(item["amount"]) for item in items)
+    tolerance = 0.011 + 0.005 * len(items)
+    totals, taxes = _document_totals(pages)
+    extra = parse_amount(total_amount)
+    if extra is not None:
+        totals.append(extra)
+    for candidate in totals:
+        if abs(total - candidate) <= tolerance:
+            return candidate
+        for tax in taxes:
+            if abs(total + tax - candidate) <= tolerance:
+                return candidate
+    return None
+
+
+def extract_line_items(pages, total_amount=None):
+    """
+    Line items read from the layout of the parsed pages (pages with words=None are skipped).
+    Returns None when no page has a line-item table, else a dict with rows (the
+    LLM's line_items shape), pages (1-based), sum, and verified/matched_total
+    from reconcile().
+    """
+    rows = []
+    table_pages = []
+    for page_index, page in enumerate(pages):
+        if page.get("words") is None:
+            continue
+        items = _page_items(page["words"])
+        if items:
+            rows.extend(items)
+            table_pages.append(page_index + 1)
+    if not rows:
+        return None
+    matched = reconcile(rows, pages, total_amount)
+    return {
+        "rows": rows,
+        "pages": table_pages,
+        "sum": round(sum(parse_amount(row["amount"]) for row in rows), 2),
+        "verified": matched is not None,
+        "matched_total": matched,
+    }
@@ -0,0 +1,406 @@
+import os
+import time
+import random
+import asyncio
+
+import httpx
+import ollama
+
+from observability import logger, REGISTRY
+from workers import LLM_CONCURRENCY
+
+# -----------------------------------------------------------------------------
+# Ollama node pool
+# -----------------------------------------------------------------------------
+#
+# OLLAMA_HOSTS lists every Ollama server we may send generations to (comma
+# separated; falls back to OLLAMA_HOST, then the local default). Each node keeps
+# one persistent async client and runs at most INVOICE_LLM_CONCURRENCY
+# generations at a time (match it to the node's OLLAMA_NUM_PARALLEL).
+#
+# Requests go to the healthy node with the fewest outstanding requests. A failed
+# or timed-out attempt is retried on another node after a short backoff. A 4xx
+# answer (unknown model, bad request) would fail the same way on every node, so
+# it goes straight back to the caller without a retry and without counting
+# against the node; only connection errors, timeouts and 5xx do. Nodes
+# that keep failing trip a circuit breaker and sit out CIRCUIT_RESET_SECONDS
+# before a single trial request may close it again. A background task polls
+# every node's /api/tags so dead nodes are noticed without costing a request,
+# and /api/ps for the memory of the models it has loaded.
+#
+# Ollama unloads a model LLM_KEEP_ALIVE after its last request. A keep-alive
+# task sends an empty chat (which only loads the model) to every node that has
+# been idle for KEEPALIVE_INTERVAL_SECONDS, so the next request never pays the
+# load. The ping must carry the num_ctx real requests use, or it would itself
+# make Ollama reload the model.
+
+LLM_HOSTS = [h.strip() for h in os.getenv(
+    "OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+).split(",") if h.strip()]
+LLM_TIMEOUT_SECONDS = float(os.getenv("INVOICE_LLM_TIMEOUT_SECONDS", "120"))
+LLM_CONNECT_TIMEOUT_SECONDS = 5.0
+LLM_RETRIES = int(os.getenv("INVOICE_LLM_RETRIES", "2"))
+LLM_BACKOFF_SECONDS = 0.5
+HEALTH_INTERVAL_SECONDS = float(os.getenv("INVOICE_LLM_HEALTH_INTERVAL_SECONDS", "10"))
+CIRCUIT_FAILURES = int(os.getenv("INVOICE_LLM_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("INVOICE_LLM_CIRCUIT_RESET_SECONDS", "30"))
+# Weight of the newest sample in the per-node latency average
+LATENCY_ALPHA = 0.2
+LLM_KEEP_ALIVE = os.getenv("INVOICE_LLM_KEEP_ALIVE", "5m")
+# 0 turns the keep-alive pings off
+KEEPALIVE_INTERVAL_SECONDS = float(os.getenv("INVOICE_LLM_KEEPALIVE_INTERVAL_SECONDS", "120"))
+
+
+class LLMUnavailableError(Exception):
+    """Raised when no Ollama node could serve a request (all down, open, or every attempt failed)."""
+
+
+def _request_error(ex):
+    """Is ex Ollama rejecting the request itself (4xx) rather than the node failing?"""
+    return isinstance(ex, ollama.ResponseError) and 400 <= (ex.status_code or 0) < 500
+
+
+class OllamaNode:
+    def __init__(self, host, max_inflight=LLM_CONCURRENCY):
+        self.host = host
+        self.max_inflight = max(1, max_inflight)
+        # Our own connection pool, so stop() can close it without reaching into the client
+        self.transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=self.max_inflight + 2, max_keepalive_connections=self.max_inflight + 2),
+        )
+        self.client = ollama.AsyncClient(
+            host=host,
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            transport=self.transport,
+        )
+        self.outstanding = 0
+        self.healthy = True
+        self.models = None
+        # Models in memory and their size (Ollama /api/ps), refreshed by the health check
+        self.loaded = None
+        self.circuit = "closed"
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self.last_used = None
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+
+    def available(self, now):
+        """Can this node take one more request right now?"""
+        if not self.healthy or self.outstanding >= self.max_inflight:
+            return False
+        if self.circuit == "open":
+            if now - self.opened_at < CIRCUIT_RESET_SECONDS:
+                return False
+            # Reset period over: let exactly one trial request through
+            self.circuit = "half_open"
+            return self.outstanding == 0
+        if self.circuit == "half_open":
+            return self.outstanding == 0
+        return True
+
+    def record_success(self, seconds):
+        self.last_used = time.monotonic()
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.circuit = "closed"
+        self.latency_ewma = seconds if self.latency_ewma is None else (
+            LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.latency_ewma
+        )
+
+    def record_failure(self, error):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"[:300]
+        if self.circuit == "half_open" or self.consecutive_failures >= CIRCUIT_FAILURES:
+            if self.circuit != "open":
+                logger.warning("llm.circuit_open host=%s failures=%d error=%s", self.host, self.consecutive_failures, self.last_error)
+            self.circuit = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "outstanding": self.outstanding,
+            "max_inflight": self.max_inflight,
+            "latency_ewma_seconds": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+            "models": self.models,
+            "loaded": self.loaded,
+        }
+
+
+class OllamaPool:
+    def __init__(self, hosts=None, max_inflight=LLM_CONCURRENCY):
+        self.nodes = [OllamaNode(host, max_inflight) for host in (hosts or LLM_HOSTS)]
+        self._changed = None
+        self._health_task = None
+        self._keepalive_task = None
+
+    @property
+    def capacity(self):
+        return sum(node.max_inflight for node in self.nodes)
+
+    def _condition(self):
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def _pick(self, exclude):
+        now = time.monotonic()
+        candidates = [n for n in self.nodes if n not in exclude and n.available(now)]
+        if not candidates:
+            return None
+        # Least outstanding requests; the faster node breaks ties
+        return min(candidates, key=lambda n: (n.outstanding / n.max_inflight, n.latency_ewma or 0.0))
+
+    def _usable(self, exclude):
+        """Is any node (outside exclude) worth waiting for?"""
+        now = time.monotonic()
+        return any(
+            n not in exclude and n.healthy and (n.circuit != "open" or now - n.opened_at >= CIRCUIT_RESET_SECONDS)
+            for n in self.nodes
+        )
+
+    async def _acquire(self, exclude):
+        """Wait for a free slot on the best node. Raises LLMUnavailableError if none can ever serve."""
+        changed = self._condition()
+        async with changed:
+            while True:
+                node = self._pick(exclude)
+                if node is not None:
+                    node.outstanding += 1
+                    return node
+                if not self._usable(exclude):
+                    if exclude and self._usable(()):
+                        # Every other node is out; going back to one we already tried beats failing
+                        exclude = ()
+                        continue
+                    raise LLMUnavailableError("No healthy Ollama node available")
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self, node):
+        changed = self._condition()
+        async with changed:
+            node.outstanding -= 1
+            changed.notify_all()
+
+    async def _backoff(self, attempt):
+        await asyncio.sleep(LLM_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random()))
+
+    async def chat(self, **kwargs):
+        """ollama chat() on the pool with timeout, retries on other nodes and circuit breaking."""
+        tried = []
+        last_error = None
+        for attempt in range(LLM_RETRIES + 1):
+            node = await self._acquire(tried)
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(node.client.chat(**kwargs), timeout=LLM_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if _request_error(ex):
+                    LLM_REQUESTS.inc(node=node.host, outcome="rejected")
+                    raise
+                last_error = ex
+                node.record_failure(ex)
+                LLM_REQUESTS.inc(node=node.host, outcome="error")
+                logger.warning("llm.attempt_failed host=%s attempt=%d error=%s", node.host, attempt + 1, node.last_error)
+            else:
+                node.record_success(time.perf_counter() - started)
+                LLM_REQUESTS.inc(node=node.host, outcome="ok")
+                return response
+            finally:
+                await self._release(node)
+            tried.append(node)
+            if attempt < LLM_RETRIES:
+                await self._backoff(attempt)
+        raise LLMUnavailableError(f"All {LLM_RETRIES + 1} attempts failed: {last_error}") from last_error
+
+    async def stream_chat(self, **kwargs):
+        """
+        Streaming chat() on the pool. Failures before the first chunk are retried
+        on another node like chat(); once output has started it cannot be replayed,
+        so a mid-stream failure is raised to the caller. Each attempt has the same
+        LLM_TIMEOUT_SECONDS deadline as a chat() call, not just a per-read timeout.
+        """
+        tried = []
+        last_error = None
+        for attempt in range(LLM_RETRIES + 1):
+            node = await self._acquire(tried)
+            started = time.perf_counter()
+            yielded = False
+            # Enforced around our own awaits only, so it can never fire in the
+            # caller's code between chunks
+            deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT_SECONDS
+            try:
+                async with asyncio.timeout_at(deadline):
+                    stream = await node.client.chat(**kwargs, stream=True)
+                while True:
+                    async with asyncio.timeout_at(deadline):
+                        part = await anext(stream, None)
+                    if part is None:
+                        break
+                    yielded = True
+                    yield part
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if _request_error(ex):
+                    LLM_REQUESTS.inc(node=node.host, outcome="rejected")
+                    raise
+                last_error = ex
+                node.record_failure(ex)
+                LLM_REQUESTS.inc(node=node.host, outcome="error")
+                logger.warning("llm.attempt_failed host=%s attempt=%d streaming=1 error=%s", node.host, attempt + 1, node.last_error)
+                if yielded:
+                    raise
+            else:
+                node.record_success(time.perf_counter() - started)
+                LLM_REQUESTS.inc(node=node.host, outcome="ok")
+                return
+            finally:
+                await self._release(node)
+            tried.append(node)
+            if attempt < LLM_RETRIES:
+                await self._backoff(attempt)
+        raise LLMUnavailableError(f"All {LLM_RETRIES + 1} attempts failed: {last_error}") from last_error
+
+    # -- health checks ---------------------------------------------------------
+
+    async def check_node(self, node):
+        try:
+            listing = await asyncio.wait_for(node.client.list(), timeout=LLM_CONNECT_TIMEOUT_SECONDS)
+            node.models = sorted(m.model for m in listing.models if m.model)
+            if not node.healthy:
+                logger.info("llm.node_up host=%s", node.host)
+            node.healthy = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            if node.healthy:
+                logger.warning("llm.node_down host=%s error=%s", node.host, ex)
+            node.healthy = False
+            node.last_error = f"health: {type(ex).__name__}: {ex}"[:300]
+        node.last_check = time.time()
+        if node.healthy:
+            await self._check_loaded(node)
+
+    async def _check_loaded(self, node):
+        # Informational only: an Ollama without /api/ps is still a healthy node
+        try:
+            running = await asyncio.wait_for(node.client.ps(), timeout=LLM_CONNECT_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            node.loaded = None
+            return
+        node.loaded = [
+            {"model": m.model, "size": m.size, "size_vram": m.size_vram, "context_length": m.context_length}
+            for m in running.models
+        ]
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check_node(node) for node in self.nodes))
+            changed = self._condition()
+            async with changed:
+                changed.notify_all()
+            await asyncio.sleep(HEALTH_INTERVAL_SECONDS)
+
+    # -- model residency -------------------------------------------------------
+
+    async def preload(self, node, model, options):
+        """Load the model on one node (an empty chat only loads it); returns the seconds taken."""
+        started = time.perf_counter()
+        await asyncio.wait_for(
+            node.client.chat(model=model, messages=[], keep_alive=LLM_KEEP_ALIVE, options=options),
+            timeout=LLM_TIMEOUT_SECONDS,
+        )
+        node.last_used = time.monotonic()
+        return time.perf_counter() - started
+
+    async def preload_all(self, model, options):
+        """Load the model on every healthy node. Raises LLMUnavailableError if none could load it."""
+        nodes = [node for node in self.nodes if node.healthy and node.circuit != "open"]
+        results = await asyncio.gather(*(self.preload(node, model, options) for node in nodes), return_exceptions=True)
+        loaded = {}
+        for node, result in zip(nodes, results):
+            if isinstance(result, BaseException):
+                logger.warning("llm.preload_failed host=%s error=%s", node.host, result)
+            else:
+                loaded[node.host] = round(result, 3)
+        if not loaded:
+            raise LLMUnavailableError(f"Model {model} could not be loaded on any Ollama node")
+        return loaded
+
+    async def _keepalive_loop(self, model, options):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL_SECONDS)
+            now = time.monotonic()
+            idle = [
+                node for node in self.nodes
+                if node.healthy and node.circuit != "open"
+                and (node.last_used is None or now - node.last_used >= KEEPALIVE_INTERVAL_SECONDS)
+            ]
+            results = await asyncio.gather(*(self.preload(node, model, options()) for node in idle), return_exceptions=True)
+            for node, result in zip(idle, results):
+                outcome = "error" if isinstance(result, BaseException) else "ok"
+                LLM_KEEPALIVES.inc(node=node.host, outcome=outcome)
+                if outcome == "error":
+                    logger.warning("llm.keepalive_failed host=%s error=%s", node.host, result)
+
+    def start(self, keepalive=None):
+        """
+        Start the health checks, and with keepalive=(model, options()) the
+        keep-alive pings (options() gives the chat options to load it with).
+        """
+        if self._health_task is None and HEALTH_INTERVAL_SECONDS > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        if self._keepalive_task is None and keepalive is not None and KEEPALIVE_INTERVAL_SECONDS > 0:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop(*keepalive))
+
+    async def stop(self):
+        for task in (self._health_task, self._keepalive_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._health_task = None
+        self._keepalive_task = None
+        for node in self.nodes:
+            await node.transport.aclose()
+        # Clients belong to the loop that just ended; the next start gets fresh ones
+        self.nodes = [OllamaNode(node.host, node.max_inflight) for node in self.nodes]
+        self._changed = None
+
+    def snapshot(self):
+        return {
+            "capacity": self.capacity,
+            "outstanding": sum(node.outstanding for node in self.nodes),
+            "nodes": [node.snapshot() for node in self.nodes],
+        }
+
+
+LLM_REQUESTS = REGISTRY.counter(
+    "invoice_llm_node_requests_total",
+    "LLM attempts per Ollama node by outcome (ok, error, rejected)",
+    ["node", "outcome"],
+)
+LLM_KEEPALIVES = REGISTRY.counter(
+    "invoice_llm_keepalive_pings_total",
+    "Keep-alive model loads sent to idle Ollama nodes by outcome (ok, error)",
+    ["node", "outcome"],
+)
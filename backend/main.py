@@ -1,33 +1,238 @@
 import os
 import pdfplumber
-import ollama
+from pdfplumber.utils.text import WordExtractor
 import json
 import time
-from fastapi import FastAPI, UploadFile, File, Form
+import hashlib
+import logging
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
+import re
 import tempfile
+import shutil
+import asyncio
+import zipfile
+from typing import List
+
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from geometry import PageGeometry, merge_box, address_cluster
+from context_builder import build_context, estimate_tokens, MONEY_RE
+from prompts import FIELD_PROMPTS, PROMPT_VERSION, ContextSizer, system_prefix, user_message, answer_budget, prompt_registry
+from incremental_json import IncrementalObjectParser
+from templates import TemplateStore, TEMPLATE_MIN_CONFIDENCE, fingerprint
+from line_items import extract_line_items
+from cleaning import DocumentFacts, clean_fields
+from extraction_cache import ExtractionCache, make_cache_key
+from observability import (
+    logger, configure_logging, shutdown_logging, REGISTRY, CONTENT_TYPE,
+    STAGE_SECONDS, EXTRACTIONS, DOCUMENT_PAGES, DOCUMENT_PAGES_PARSED,
+    DOCUMENT_WORDS, DOCUMENT_CHARS, DOCUMENT_CONTEXT_CHARS, LLM_TOKENS, LLM_MODE_RUNS, LINE_ITEM_TABLES,
+    LLM_PREFILL_SECONDS, LLM_CONTEXT_REQUESTS, LLM_TRUNCATED,
+    BOX_LOOKUPS, BOX_HITS,
+)
+from jobs import JobQueue, QueueFullError, TERMINAL_STATUSES
+from invoices import InvoiceStore, InvoiceNotFoundError, PAGE_SIZE_DEFAULT
+from search import SearchIndex, SEARCH_PAGE_SIZE_DEFAULT
+from export import EXPORT_FORMATS, ExportUnavailableError, export_table, parse_watermark, default_until
+from dedup import DuplicateIndex, DEDUP_MODE, DEDUP_LOOKUPS
+from admission import AdmissionController, AdmissionRejected, ADMISSION_MAX_INFLIGHT, client_id, request_priority
+from uploads import (
+    UPLOAD_MAX_BYTES, UploadTooLargeError, UploadLimitMiddleware,
+    open_pdf_source, spool_stream, document_from_path,
+)
+from workers import run_cpu, shutdown_pools, PDF_WORKERS, PDF_SHARD_PAGES, PDF_SHARD_WORKERS
+from llm_pool import OllamaPool, LLMUnavailableError, LLM_KEEP_ALIVE
+from warmup import Warmup, warmup_pdf
+
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "qwen2.5:3b")
+# Characters of document text parsed up front for the LLM; later pages (except
+# the last, where totals live) are only parsed if box finding needs them
+LLM_TEXT_CHARS = 10000
+# Largest context and answer a request may get; each request is sized below
+# these from its own prompt and fields (see prompts.py)
+LLM_NUM_CTX = int(os.getenv("INVOICE_LLM_NUM_CTX", "4096"))
+LLM_NUM_PREDICT = 1000
+LLM_CTX_SIZES = sorted({
+    min(int(size), LLM_NUM_CTX) for size in os.getenv("INVOICE_LLM_CTX_SIZES", "2048,4096").split(",") if size.strip()
+} | {LLM_NUM_CTX})
+LLM_CTX_SHRINK_AFTER = int(os.getenv("INVOICE_LLM_CTX_SHRINK_AFTER", "20"))
+# Extraction cache and near-duplicate entries are only valid for the model and prompt version that made them
+LLM_RESULT_KEY = f"{MODEL_NAME}/prompt-v{PROMPT_VERSION}"
+# Documents in flight per batch: enough to keep every PDF worker busy parsing
+# document k+1 while the LLM slots (across all Ollama nodes) work on document
+# k, without loading the whole batch into memory at once. 0 sizes it from
+# INVOICE_PDF_WORKERS and the LLM pool capacity.
+BATCH_WINDOW = int(os.getenv("INVOICE_BATCH_WINDOW", "0"))
+BATCH_MAX_DOCUMENTS = int(os.getenv("INVOICE_BATCH_MAX_DOCUMENTS", "1000"))
+# Whole batch request body (each PDF in it is still held to INVOICE_UPLOAD_MAX_BYTES)
+BATCH_MAX_BYTES = int(os.getenv("INVOICE_BATCH_MAX_BYTES", str(2 * 1024 ** 3)))
 
 # -----------------------------------------------------------------------------
 # PDF utilities
 # -----------------------------------------------------------------------------
 
-def extract_pdf_content(file_path):
-    """Return extracted text plus per-page words and dimensions for box mapping."""
+def _extract_page(page):
+    """
+    Words and text for one page from a single word-extraction pass.
+    page.extract_text() and page.extract_words() each group the page's chars
+    into words; building both from one WordMap gives identical output at half
+    the cost.
+    """
+    wordmap = WordExtractor().extract_wordmap(page.chars)
+    words = [word for word, _ in wordmap.tuples]
+    text = wordmap.to_textmap(
+        layout_bbox=page.bbox,
+        layout_width=page.width,
+        layout_height=page.height,
+        presorted=True,
+    ).as_string
+    # Drop pdfminer's layout objects now; they dominate memory on long documents
+    page.close()
+    return text, words
+
+
+def extract_pdf_content(source, char_budget=None):
+    """
+    Return extracted text plus per-page words (as PageGeometry) and dimensions for box mapping.
+    With char_budget, pages after the one that fills the budget are not parsed
+    (the last page always is, for the totals): they only carry width/height and
+    "words": None, to be loaded on demand (see find_boxes_in_pdf).
+    `source` is a file path or the PDF bytes.
+    """
     pages = []
-    full_text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            words = page.extract_words() or []
+    texts = []
+    total_chars = 0
+    with pdfplumber.open(open_pdf_source(source)) as pdf:
+        last_index = len(pdf.pages) - 1
+        for page_index, page in enumerate(pdf.pages):
+            if char_budget is not None and total_chars >= char_budget and page_index != last_index:
+                pages.append({
+                    "text": None,
+                    "words": None,
+                    "width": page.width,
+                    "height": page.height,
+                })
+                continue
+            text, words = _extract_page(page)
             pages.append({
                 "text": text,
-                "words": words,
+                "words": PageGeometry.from_words(words),
                 "width": page.width,
                 "height": page.height,
             })
-            full_text += text
-    return full_text, pages
+            texts.append(text)
+            total_chars += len(text)
+    return "".join(texts), pages
+
+
+def count_pdf_pages(source):
+    with pdfplumber.open(open_pdf_source(source)) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page_range(source, start, stop, char_budget=None, with_last=False):
+    """
+    One shard of parse_pdf, from an independent open of the PDF: the (width,
+    height) of every page and {page index: page as extract_pdf_content parses
+    it} for start..stop-1. With char_budget, parsing stops once the range's text
+    fills it; with_last also parses the last page.
+    """
+    with pdfplumber.open(open_pdf_source(source)) as pdf:
+        sizes = [(page.width, page.height) for page in pdf.pages]
+        wanted = list(range(start, min(stop, len(sizes))))
+        parsed = {}
+        total_chars = 0
+        for page_index in wanted:
+            if char_budget is not None and total_chars >= char_budget:
+                break
+            parsed[page_index] = _parse_page(pdf.pages[page_index])
+            total_chars += len(parsed[page_index]["text"])
+        last_index = len(sizes) - 1
+        if with_last and last_index >= 0 and last_index not in parsed:
+            parsed[last_index] = _parse_page(pdf.pages[last_index])
+    return sizes, parsed
+
+
+def _parse_page(page):
+    width, height = page.width, page.height
+    text, words = _extract_page(page)
+    return {"text": text, "words": PageGeometry.from_words(words), "width": width, "height": height}
+
+
+async def parse_pdf(source, char_budget=None):
+    """
+    extract_pdf_content(source, char_budget) on the PDF pool, with long
+    documents split into page ranges parsed by several workers at once. Each
+    worker opens the PDF itself and returns its pages' text and word geometry;
+    the ranges are put back in order, so the result is identical to the
+    single-worker call. The first range goes alone and stops at char_budget
+    (usually all the LLM needs); only if it falls short are the remaining
+    ranges parsed, PDF_SHARD_WORKERS at a time, and pages past the budget
+    dropped again.
+    """
+    if PDF_WORKERS < 2 or PDF_SHARD_WORKERS < 2 or PDF_SHARD_PAGES <= 0:
+        return await run_cpu(extract_pdf_content, source, char_budget)
+
+    sizes, parsed = await run_cpu(
+        extract_page_range, source, 0, PDF_SHARD_PAGES, char_budget, char_budget is not None
+    )
+    page_count = len(sizes)
+    last_index = page_count - 1
+
+    def budget_page():
+        """Index of the page that fills char_budget, once the parsed prefix tells."""
+        total = 0
+        for page_index in range(page_count):
+            if page_index not in parsed:
+                return None
+            total += len(parsed[page_index]["text"])
+            if total >= char_budget:
+                return page_index
+        return last_index
+
+    cut = budget_page() if char_budget is not None else None
+    shards = [
+        (start, min(start + PDF_SHARD_PAGES, page_count))
+        for start in range(PDF_SHARD_PAGES, page_count, PDF_SHARD_PAGES)
+    ]
+    next_shard = 0
+    while next_shard < len(shards) and cut is None:
+        wave = shards[next_shard:next_shard + PDF_SHARD_WORKERS]
+        next_shard += len(wave)
+        results = await asyncio.gather(*(
+            run_cpu(extract_page_range, source, start, stop) for start, stop in wave
+        ))
+        for _, shard_pages in results:
+            parsed.update(shard_pages)
+        if char_budget is not None:
+            cut = budget_page()
+    if cut is None:
+        cut = last_index
+
+    pages = []
+    texts = []
+    for page_index, (width, height) in enumerate(sizes):
+        if cut < page_index < last_index:
+            pages.append({"text": None, "words": None, "width": width, "height": height})
+        else:
+            pages.append(parsed[page_index])
+            texts.append(parsed[page_index]["text"])
+    return "".join(texts), pages
+
+
+def load_page_words(source, page_indexes):
+    """Word lists for the given 0-based page indexes, parsed on demand."""
+    loaded = {}
+    with pdfplumber.open(open_pdf_source(source)) as pdf:
+        for page_index in page_indexes:
+            page = pdf.pages[page_index]
+            loaded[page_index] = PageGeometry.from_words(page.extract_words())
+            page.close()
+    return loaded
 
 
 def _to_scalar_text(value):
@@ -75,86 +280,112 @@ def find_address_tokens(words, address_text):
     Find address tokens with noise filtering, horizontal filtering, and vertical clustering.
     Filters tokens <3 chars, keeps tokens near median X, clusters by vertical proximity (<50px), returns largest cluster.
     """
-    import re
-    
+    geometry = PageGeometry.from_words(words)
+    return [geometry[i] for i in find_address_indexes(geometry, address_text)]
+
+
+def find_address_indexes(geometry, address_text):
+    """find_address_tokens on a PageGeometry, returning word indexes."""
     # Filter noise: only keep address parts with 3+ characters
-    address_parts = [p for p in re.findall(r'\S+', address_text) if len(p) > 2]
+    address_parts = [p.lower() for p in re.findall(r'\S+', address_text) if len(p) > 2]
     
     if not address_parts:
-        return []
-    
-    candidate_tokens = []
-    
-    for word in words:
-        word_text = word['text'].strip()
-        
-        # Filter noise: ignore tokens shorter than 3 characters
-        if len(word_text) <= 2:
-            continue
-            
-        for part in address_parts:
-            if part.lower() in word_text.lower() or word_text.lower() in part.lower():
-                candidate_tokens.append(word)
-                break
-    
-    if not candidate_tokens:
-        return []
-    
-    # Horizontal filtering: calculate median X and discard outliers
-    x_positions = sorted([t['x0'] for t in candidate_tokens])
-    n = len(x_positions)
-    
-    if n % 2 == 0:
-        median_x = (x_positions[n // 2 - 1] + x_positions[n // 2]) / 2
-    else:
-        median_x = x_positions[n // 2]
-    
-    # Keep only tokens within 150px of median X
-    horizontally_filtered = [
-        t for t in candidate_tokens
-        if abs(t['x0'] - median_x) <= 150
-    ]
+        return np.empty(0, dtype=np.intp)
     
-    if not horizontally_filtered:
-        return []
+    # Substring test once per distinct word text; tokens shorter than 3 chars are noise
+    verdicts = {}
+    for text in geometry.text:
+        if text not in verdicts:
+            word_text = text.strip().lower()
+            verdicts[text] = len(word_text) > 2 and any(
+                part in word_text or word_text in part for part in address_parts
+            )
+    candidate_mask = np.fromiter((verdicts[t] for t in geometry.text), dtype=bool, count=len(geometry))
     
-    # Sort by position (top to bottom, left to right)
-    horizontally_filtered.sort(key=lambda w: (w['top'], w['x0']))
-    
-    # Vertical clustering: group tokens with <50px vertical gap
-    clusters = []
-    current_cluster = [horizontally_filtered[0]]
-    
-    for i in range(1, len(horizontally_filtered)):
-        prev_token = horizontally_filtered[i - 1]
-        curr_token = horizontally_filtered[i]
-        
-        # Calculate vertical gap
-        vertical_gap = curr_token['top'] - prev_token['top']
-        
-        if vertical_gap > 50:
-            # Start new cluster
-            clusters.append(current_cluster)
-            current_cluster = [curr_token]
-        else:
-            # Add to current cluster
-            current_cluster.append(curr_token)
-    
-    # Don't forget the last cluster
-    clusters.append(current_cluster)
-    
-    # Selection: return the largest cluster (most words)
-    if clusters:
-        largest_cluster = max(clusters, key=len)
-        return largest_cluster
-    
-    return []
+    return address_cluster(geometry, candidate_mask)
+
 
+# Words that are likely field labels rather than values (matched as substrings)
+LABEL_KEYWORDS = (
+    'invoice', 'number', 'date', 'due', 'total', 'amount',
+    'vendor', 'address', 'customer', 'bill', 'order',
+    'subtotal', 'tax', 'from', 'to', 'purchase',
+    'po', 'currency', 'balance'
+)
+LABEL_KEYWORDS_RE = re.compile('|'.join(LABEL_KEYWORDS))
+# For account_number, "ACC" and "BSB" are part of the value, not labels
+ACCOUNT_LABEL_EXCEPTIONS = ('ACC', 'BSB', 'A.C.C', 'B.S.B')
 
-def find_boxes_for_fields(parsed_result, pages):
+
+class PageWordIndex:
+    """
+    Per-page lookup structure for find_boxes_for_fields, built once per document.
+    Holds the normalized text of every word, an inverted index from each distinct
+    normalized text to its word positions, and the label-word masks. Substring
+    candidates are found by scanning the distinct texts (far fewer than words).
+    """
+
+    def __init__(self, geometry):
+        raw = geometry.text
+        self.norm = [t.strip().lower() for t in raw]
+        self.positions = {}
+        for pos, text in enumerate(self.norm):
+            self.positions.setdefault(text, []).append(pos)
+        # Label checks run once per distinct word text, not once per comparison
+        label_by_text = {t: LABEL_KEYWORDS_RE.search(t.lower()) is not None for t in set(raw)}
+        self.is_label = [label_by_text[t] for t in raw]
+        self.is_account_exception = [t.upper() in ACCOUNT_LABEL_EXCEPTIONS for t in raw]
+
+    def label_mask(self, field_name):
+        if field_name == 'account_number':
+            return [lab and not exc for lab, exc in zip(self.is_label, self.is_account_exception)]
+        return self.is_label
+
+    def candidates(self, token):
+        """Sorted positions of words w where token is in w or w is in token."""
+        texts = [t for t in self.positions if token in t or t in token]
+        found = []
+        for t in texts:
+            found.extend(self.positions[t])
+        found.sort()
+        return found
+
+
+# Fields that get bounding boxes, mapped to the frontend's field names
+BOX_FIELD_MAP = {
+    "invoice_number": "invoiceNumber",
+    "invoice_date": "invoiceDate",
+    "due_date": "dueDate",
+    "vendor_name": "vendor",
+    "vendor_address": "vendorAddress",
+    "purchase_order": "purchaseOrder",
+    "account_number": "accountNumber",
+    "total_amount": "total",
+    "currency": "currency",
+}
+# Fields to skip for bounding boxes
+SKIP_FIELDS = ['currency', 'line_items', 'email_from', 'email_to', 'additional_info']
+
+
+def find_boxes_in_pdf(parsed_result, pages, source, page_cache=None):
+    """
+    find_boxes_for_fields for pages from extract_pdf_content(char_budget=...):
+    word geometry of deferred pages is parsed from source only if a field
+    was not found on the pages already loaded.
+    """
+    def load_words(page_index):
+        return load_page_words(source, [page_index])[page_index]
+
+    return find_boxes_for_fields(parsed_result, pages, load_words, page_cache)
+
+
+def find_boxes_for_fields(parsed_result, pages, load_words=None, page_cache=None):
     """
     Find bounding boxes for extracted field values.
     FIXED: Filters out label words and only matches the VALUE, not labels before it.
+    Pages whose "words" is None are loaded through load_words(page_index) when reached.
+    Pass the same page_cache dict to reuse the per-page indexes across calls
+    (streaming finds boxes one field at a time).
     """
     import re
     
@@ -170,54 +401,33 @@ def find_boxes_for_fields(parsed_result, pages):
         """Split into tokens"""
         return re.findall(r'\S+', str(text))
     
-    def is_label_word(word_text, field_name=None):
-        """Check if this word is likely a field label, not the value"""
-        
-        # Special case: For account_number, "ACC" and "BSB" are part of the value!
-        if field_name == 'account_number' and word_text.upper() in ['ACC', 'BSB', 'A.C.C', 'B.S.B']:
-            return False  # Keep it!
-        
-        label_keywords = [
-            'invoice', 'number', 'date', 'due', 'total', 'amount',
-            'vendor', 'address', 'customer', 'bill', 'order',
-            'subtotal', 'tax', 'from', 'to', 'purchase',
-            'po', 'currency', 'balance'
-        ]
-        
-        word_lower = word_text.lower()
-        
-        # Only mark as label if it's an EXACT match or very close
-        return any(keyword == word_lower or keyword in word_lower for keyword in label_keywords)
+    # Geometry and word indexes are built lazily, once per page, and shared by all fields
+    if page_cache is None:
+        page_cache = {}
+    page_geometries = page_cache.setdefault("geometries", {})
+    page_indexes = page_cache.setdefault("indexes", {})
     
-    field_map = {
-        "invoice_number": "invoiceNumber",
-        "invoice_date": "invoiceDate",
-        "due_date": "dueDate",
-        "vendor_name": "vendor",
-        "vendor_address": "vendorAddress",
-        "purchase_order": "purchaseOrder",
-        "account_number": "accountNumber",
-        "total_amount": "total",
-        "currency": "currency",
-    }
+    def geometry_for(page_index, words):
+        if page_index not in page_geometries:
+            page_geometries[page_index] = PageGeometry.from_words(words)
+        return page_geometries[page_index]
+    
+    def page_index_for(page_index, geometry):
+        if page_index not in page_indexes:
+            page_indexes[page_index] = PageWordIndex(geometry)
+        return page_indexes[page_index]
     
     boxes = []
+    debug = logger.isEnabledFor(logging.DEBUG)
     
     # Diagnostic output
-    print("="*60, flush=True)
-    print("🔍 DIAGNOSTIC OUTPUT:", flush=True)
-    total_words = sum(len(page.get("words", [])) for page in pages)
-    print(f"Total pages: {len(pages)}", flush=True)
-    print(f"Total words extracted: {total_words}", flush=True)
-    print(f"Fields from LLM: {list(parsed_result.keys())}", flush=True)
-    for page_idx, page in enumerate(pages):
-        print(f"  Page {page_idx + 1}: {page.get('width', '?')} x {page.get('height', '?')} px, {len(page.get('words', []))} words", flush=True)
-    print("="*60, flush=True)
+    if debug:
+        total_words = sum(len(page.get("words") or []) for page in pages)
+        logger.debug("boxes.start pages=%d words=%d fields=%s", len(pages), total_words, list(parsed_result.keys()))
+        for page_idx, page in enumerate(pages):
+            logger.debug("boxes.page page=%d size=%sx%s words=%d", page_idx + 1, page.get('width', '?'), page.get('height', '?'), len(page.get('words') or []))
     
-    # Fields to skip for bounding boxes
-    SKIP_FIELDS = ['currency', 'line_items', 'email_from', 'email_to', 'additional_info']
-    
-    for api_field, front_field in field_map.items():
+    for api_field, front_field in BOX_FIELD_MAP.items():
         # Skip certain fields
         if api_field in SKIP_FIELDS:
             continue
@@ -237,74 +447,33 @@ def find_boxes_for_fields(parsed_result, pages):
         if not field_tokens:
             continue
         
-        print(f"🔍 Looking for {api_field}: '{field_value_str}'", flush=True)
+        logger.debug("boxes.lookup field=%s value=%r", api_field, field_value_str)
         
         found = False
         
         for page_index, page in enumerate(pages):
-            words = page.get("words", [])
+            words = page.get("words")
+            if words is None and load_words is not None:
+                words = page["words"] = load_words(page_index)
             if not words:
                 continue
+            geometry = geometry_for(page_index, words)
             
             page_w = max(page.get("width", 1), 1)
             page_h = max(page.get("height", 1), 1)
             
             # Special handling for address fields using address finder
             if api_field in ['vendor_address', 'customer_address', 'billing_address', 'shipping_address']:
-                matched_tokens = find_address_tokens(words, field_value_str)
+                matched = find_address_indexes(geometry, field_value_str)
                 
-                if matched_tokens:
-                    print(f"   ✓ FOUND address on page {page_index + 1}: {len(matched_tokens)} tokens", flush=True)
-                    print(f"     Tokens: {[t['text'] for t in matched_tokens]}", flush=True)
+                if matched.size:
+                    if debug:
+                        logger.debug("boxes.found field=%s page=%d tokens=%s", api_field, page_index + 1, geometry.texts(matched))
                     
                     # Create bounding box from address tokens
-                    xs0, xs1, ys0, ys1 = [], [], [], []
-                    
-                    for t in matched_tokens:
-                        x0 = t.get('x0', 0)
-                        x1 = t.get('x1', 0)
-                        if "y0" in t and "y1" in t:
-                            y0 = t.get("y0", 0)
-                            y1 = t.get("y1", 0)
-                        else:
-                            top_val = t.get("top", 0)
-                            bottom_val = t.get("bottom", 0)
-                            y1 = page_h - top_val
-                            y0 = page_h - bottom_val
-                        xs0.append(x0)
-                        xs1.append(x1)
-                        ys0.append(y0)
-                        ys1.append(y1)
-                    
-                    x0 = min(xs0)
-                    x1 = max(xs1)
-                    y0 = min(ys0)
-                    y1 = max(ys1)
-                    
-                    # Add padding
-                    padding_x = (x1 - x0) * 0.05
-                    padding_y = (y1 - y0) * 0.1
-                    
-                    x0 = max(0, x0 - padding_x)
-                    y0 = max(0, y0 - padding_y)
-                    x1 = min(page_w, x1 + padding_x)
-                    y1 = min(page_h, y1 + padding_y)
-                    
-                    # Convert to top-left origin
-                    y_canvas = page_h - y1
-                    
-                    box = {
-                        'field': front_field,
-                        'page': page_index + 1,
-                        'x': x0 / page_w,
-                        'y': y_canvas / page_h,
-                        'width': (x1 - x0) / page_w,
-                        'height': (y1 - y0) / page_h,
-                        'normalized': True
-                    }
+                    box = {'field': front_field, 'page': page_index + 1, **merge_box(geometry, matched, page_w, page_h), 'normalized': True}
                     
                     boxes.append(box)
-                    print(f"     Box: x={box['x']:.3f}, y={box['y']:.3f}, w={box['width']:.3f}, h={box['height']:.3f}", flush=True)
                     found = True
                     break
             
@@ -314,28 +483,33 @@ def find_boxes_for_fields(parsed_result, pages):
             best_match = None
             best_match_score = 0
             
-            # Search for matching tokens (for non-address fields)
-            for i in range(len(words)):
+            index = page_index_for(page_index, geometry)
+            norm_words = index.norm
+            n_words = len(norm_words)
+            is_label = index.label_mask(api_field)
+            norm_tokens = [normalize(t) for t in field_tokens]
+            
+            # Search for matching tokens (for non-address fields). Only positions
+            # whose word matches the first field token can start a match.
+            for i in index.candidates(norm_tokens[0]):
                 matched_tokens = []
                 value_only_tokens = []  # Track tokens that are VALUE, not labels
                 
                 # Try to match consecutive tokens
-                for j, field_token in enumerate(field_tokens):
-                    if i + j >= len(words):
+                for j, field_token in enumerate(norm_tokens):
+                    if i + j >= n_words:
                         break
                     
-                    word = words[i + j]
-                    word_text = word.get('text', '')
+                    word_text = norm_words[i + j]
                     
                     # Check if this word matches the field token
-                    if normalize(field_token) in normalize(word_text) or \
-                       normalize(word_text) in normalize(field_token):
+                    if field_token in word_text or word_text in field_token:
                         
-                        matched_tokens.append(word)
+                        matched_tokens.append(i + j)
                         
                         # Only include if it's NOT a label word (pass field name for special handling)
-                        if not is_label_word(word_text, api_field):
-                            value_only_tokens.append(word)
+                        if not is_label[i + j]:
+                            value_only_tokens.append(i + j)
                     else:
                         break
                 
@@ -358,73 +532,58 @@ def find_boxes_for_fields(parsed_result, pages):
             if best_match and best_match['value_tokens']:
                 value_tokens = best_match['value_tokens']
                 
-                print(f"   ✓ FOUND on page {page_index + 1}: '{' '.join([t['text'] for t in best_match['all_tokens']])}'", flush=True)
-                print(f"     VALUE tokens only: {[t['text'] for t in value_tokens]}", flush=True)
+                if debug:
+                    logger.debug("boxes.found field=%s page=%d matched=%r value_tokens=%s", api_field, page_index + 1, ' '.join(geometry.texts(best_match['all_tokens'])), geometry.texts(value_tokens))
                 
                 # Merge bounding boxes of VALUE tokens only (not labels!)
-                xs0 = []
-                xs1 = []
-                ys0 = []
-                ys1 = []
-                
-                for t in value_tokens:
-                    x0 = t.get('x0', 0)
-                    x1 = t.get('x1', 0)
-                    if "y0" in t and "y1" in t:
-                        y0 = t.get("y0", 0)
-                        y1 = t.get("y1", 0)
-                    else:
-                        top_val = t.get("top", 0)
-                        bottom_val = t.get("bottom", 0)
-                        y1 = page_h - top_val
-                        y0 = page_h - bottom_val
-                    xs0.append(x0)
-                    xs1.append(x1)
-                    ys0.append(y0)
-                    ys1.append(y1)
-                
-                x0 = min(xs0)
-                x1 = max(xs1)
-                y0 = min(ys0)
-                y1 = max(ys1)
-                
-                # Add padding
-                padding_x = (x1 - x0) * 0.05
-                padding_y = (y1 - y0) * 0.1
-                
-                x0 = max(0, x0 - padding_x)
-                y0 = max(0, y0 - padding_y)
-                x1 = min(page_w, x1 + padding_x)
-                y1 = min(page_h, y1 + padding_y)
-                
-                # Convert to top-left origin for canvas
-                y_canvas = page_h - y1
-                
-                # Normalize to 0-1 coordinates
-                box = {
-                    'field': front_field,
-                    'page': page_index + 1,
-                    'x': x0 / page_w,
-                    'y': y_canvas / page_h,
-                    'width': (x1 - x0) / page_w,
-                    'height': (y1 - y0) / page_h,
-                    'normalized': True
-                }
+                box = {'field': front_field, 'page': page_index + 1, **merge_box(geometry, value_tokens, page_w, page_h), 'normalized': True}
                 
                 boxes.append(box)
-                print(f"     Box: x={box['x']:.3f}, y={box['y']:.3f}, w={box['width']:.3f}, h={box['height']:.3f}", flush=True)
+                logger.debug("boxes.box field=%s x=%.3f y=%.3f w=%.3f h=%.3f", api_field, box['x'], box['y'], box['width'], box['height'])
                 found = True
                 break
         
         if not found:
-            print(f"   ✗ NOT FOUND: {api_field} = '{field_value_str}'", flush=True)
+            logger.debug("boxes.not_found field=%s value=%r", api_field, field_value_str)
     
-    print(f"[extract] boxes={len(boxes)}", flush=True)
+    logger.debug("boxes.done boxes=%d", len(boxes))
     return boxes
 
 
 
-app = FastAPI(title="Invoice Extractor API")
+@asynccontextmanager
+async def lifespan(app):
+    configure_logging()
+    llm_pool.start(keepalive=(MODEL_NAME, _model_options))
+    job_queue.start(_run_job)
+    startup_warmup.start([
+        ("pdf_workers", _warm_pdf_workers),
+        ("model", _warm_model),
+        ("extraction", _warm_extraction),
+    ])
+    yield
+    await startup_warmup.stop()
+    await job_queue.stop()
+    await llm_pool.stop()
+    shutdown_pools()
+    shutdown_logging()
+
+
+app = FastAPI(title="Invoice Extractor API", lifespan=lifespan)
+
+# Refuse oversized single uploads before their body is read
+# Covers the paths below these too: /extract-invoice/stream, /extract-invoice/batch, /invoices/{id}/...
+app.add_middleware(
+    UploadLimitMiddleware,
+    paths=["/extract-invoice", "/invoices"],
+    limits={"/extract-invoice/batch": BATCH_MAX_BYTES},
+)
+
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large(request, ex):
+    return JSONResponse(status_code=413, content={"error": ex.detail}, headers={"Connection": "close"})
+
 
 # Enable CORS for frontend integration
 app.add_middleware(
@@ -433,245 +592,1471 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Content-Disposition", "X-Export-Watermark"],
 ) 
 
-def query_invoice_ollama(text, custom_prompt):
-    safe_text = text[:10000]
-    print(f"🔍 Ollama input: {len(safe_text)} chars (truncated from {len(text)})", flush=True)
-    system_prompt = f"""
-    You are an expert invoice parser. 
-    Given the text of an invoice, extract ALL key details and return them as JSON.
-    
-    CRITICAL RULES - READ CAREFULLY:
-    1. Return values EXACTLY as they appear in the PDF text - do not reformat or change anything
-    2. For dates: Copy the EXACT format shown (e.g., "January 25, 2016" NOT "2016-01-25")
-    3. For addresses: Only include address lines, NOT other fields mixed in
-    4. For amounts: Include currency symbol if present (e.g., "$93.50" not "93.50")
-    5. Do NOT include field labels in the values (e.g., "Invoice Number: INV-123" should return "INV-123" only)
-    6. If you cannot find a value for any field, return null (not empty string)
-    
-    REQUIRED FIELDS - Extract all of these:
-    
-    1. invoice_number: The unique invoice/bill identifier (e.g., "INV-123", "F2019-0006224", "Bill #456"). 
-       Look for: Invoice Number, Invoice #, Bill Number, Reference Number, Document Number.
-       Return ONLY the number, NOT the label.
-    
-    2. invoice_date: The date when the invoice was issued (EXACTLY as shown in PDF).
-       Look for: Invoice Date, Issue Date, Date, Billing Date.
-       Return the date in the EXACT format found in PDF (e.g., "January 25, 2016").
-       NOT a date range, service period, or due date.
-    
-    3. due_date: The payment due date (EXACTLY as shown in PDF).
-       Look for: Due Date, Payment Due, Pay By Date, Payment Deadline.
-       Return in the EXACT format found in PDF (e.g., "January 31, 2016").
-    
-    4. vendor_name: The company/person issuing the invoice (the seller/service provider). Name ONLY.
-       Look for: From, Vendor, Supplier, Billed By, Company Name (at the top/header).
-       Do NOT include order numbers or other information.
-    
-    5. vendor_address: The FULL address of the vendor/supplier (address lines ONLY).
-       Look for: Address, Street, City, Postal Code, Country (near vendor name).
-       Include complete address with street, city, zip/postal code.
-       Do NOT include dates, invoice numbers, or other fields mixed in.
-    
-    6. purchase_order: Purchase Order number if mentioned (e.g., "PO-12345", "PO#456").
-       Look for: PO, Purchase Order, PO Number, Order Number, Reference.
-       Return ONLY the number, NOT the label.
-    
-    7. account_number: Customer account number or bank account if mentioned (e.g., "ACC # 1234 1234 BSB # 4321 432").
-       Look for: Account Number, Customer ID, Client Number, Account #, ACC #, BSB #.
-       Return the COMPLETE account info including "ACC" and "BSB" labels.
-    
-    8. line_items: List of items/services with descriptions and amounts.
-       Extract as an array of objects with: description, quantity, unit_price, amount.
-    
-    9. total_amount: The final TOTAL amount to be paid (with currency symbol if present, e.g., "$1500.00").
-       Look for: Total, Grand Total, Amount Due, Final Amount, Balance Due.
-       Include currency symbol if shown.
-    
-    10. currency: The currency symbol (e.g., "$", "€", "£") or code if explicitly written.
-        Look for: Currency symbols or currency codes.
-        Return ONLY the symbol or code.
-        
-    Additional instructions: {custom_prompt}
+extraction_cache = ExtractionCache()
+job_queue = JobQueue()
+vendor_templates = TemplateStore()
+invoice_store = InvoiceStore()
+search_index = SearchIndex()
+duplicate_index = DuplicateIndex()
+llm_pool = OllamaPool()
+startup_warmup = Warmup()
+admission = AdmissionController(ADMISSION_MAX_INFLIGHT or max(1, PDF_WORKERS) + llm_pool.capacity)
+
+REGISTRY.gauge(
+    "invoice_cache_events",
+    "Extraction cache counters (memory_hits, disk_hits, misses, writes, evictions, invalidations)",
+    ["event"],
+    # The counters only: snapshot() would count the disk table on every scrape
+    lambda: {(k,): v for k, v in dict(extraction_cache.stats).items()},
+)
+REGISTRY.gauge(
+    "invoice_jobs",
+    "Extraction jobs by status",
+    ["status"],
+    # The snapshot the queue refreshes with its heartbeat: no SQLite query per scrape
+    lambda: {(k,): v for k, v in job_queue.last_stats["counts"].items()},
+)
+REGISTRY.gauge(
+    "invoice_template_events",
+    "Vendor template counters (hits, low_confidence, misses, learned)",
+    ["event"],
+    lambda: {(k,): v for k, v in vendor_templates.stats.items()},
+)
+REGISTRY.gauge(
+    "invoice_llm_node_outstanding",
+    "LLM requests currently running on each Ollama node",
+    ["node"],
+    lambda: {(n.host,): n.outstanding for n in llm_pool.nodes},
+)
+REGISTRY.gauge(
+    "invoice_llm_node_latency_seconds",
+    "Moving average of LLM request latency per Ollama node",
+    ["node"],
+    lambda: {(n.host,): n.latency_ewma for n in llm_pool.nodes if n.latency_ewma is not None},
+)
+REGISTRY.gauge(
+    "invoice_admission_queue_depth",
+    "Extractions waiting for a pipeline slot, by priority class",
+    ["priority"],
+    lambda: {(p,): len(q) for p, q in admission.queues.items()},
+)
+REGISTRY.gauge(
+    "invoice_admission_inflight",
+    "Extractions holding a pipeline slot",
+    [],
+    lambda: {(): admission.inflight},
+)
+REGISTRY.gauge(
+    "invoice_llm_model_bytes",
+    "Memory of each model loaded on an Ollama node (from /api/ps), by num_ctx it was loaded with",
+    ["node", "model", "num_ctx"],
+    lambda: {
+        (n.host, m["model"], str(m["context_length"])): m["size"]
+        for n in llm_pool.nodes for m in (n.loaded or ()) if m["size"] is not None
+    },
+)
+REGISTRY.gauge(
+    "invoice_llm_node_up",
+    "1 if the Ollama node is healthy and its circuit is not open",
+    ["node"],
+    lambda: {(n.host,): int(n.healthy and n.circuit != "open") for n in llm_pool.nodes},
+)
+
+# Grouped LLM mode: (name, fields, num_predict) per focused prompt. Decode time
+# dominates and line items are most of the output, so the other fields get
+# short prompts with small answer budgets that run next to the line items
+# instead of queueing behind them in one long decode. Longest answer first, so
+# it starts first when the pool has fewer free slots than groups.
+FIELD_GROUPS = (
+    ("items", ("line_items", "total_amount", "currency"), LLM_NUM_PREDICT),
+    ("header", ("invoice_number", "invoice_date", "due_date", "purchase_order", "account_number"), 200),
+    ("vendor", ("vendor_name", "vendor_address"), 150),
+)
+# When the layout extractor already has verified line items, the LLM is only
+# asked for the other fields, with a much smaller answer budget
+# A vendor template answers the header fields; the LLM is asked for these when the layout has no verified items
+ITEMS_GROUP = FIELD_GROUPS[0]
+NO_ITEMS_GROUP = ("no_items", tuple(f for f in FIELD_PROMPTS if f != "line_items"), 300)
+NO_ITEMS_NUM_PREDICT = 100
+LLM_MODES = ("single", "grouped")
+LLM_MODE = os.getenv("INVOICE_LLM_MODE", "single")
+# Tokens the chat template adds around the messages
+CHAT_TEMPLATE_TOKENS = 32
+context_sizer = ContextSizer(LLM_CTX_SIZES, LLM_CTX_SHRINK_AFTER)
+
+
+def field_groups(skip_line_items=False):
+    """FIELD_GROUPS, minus line items (and most of their answer budget) when skip_line_items."""
+    if not skip_line_items:
+        return FIELD_GROUPS
+    return tuple(
+        ("totals", tuple(f for f in fields if f != "line_items"), NO_ITEMS_NUM_PREDICT) if "line_items" in fields
+        else (name, fields, num_predict)
+        for name, fields, num_predict in FIELD_GROUPS
+    )
+
+
+def context_token_budget(custom_prompt):
+    """Prompt tokens left for document text once the system prompt, instructions and the answer fit in num_ctx."""
+    instructions = estimate_tokens(user_message("", custom_prompt))
+    return LLM_NUM_CTX - LLM_NUM_PREDICT - system_prefix("all")["tokens"] - instructions - CHAT_TEMPLATE_TOKENS
+
+
+def build_ollama_request(text, custom_prompt, group=None, full_answer=False):
+    """
+    Build the chat() keyword arguments shared by the sync and async clients.
+    With a FIELD_GROUPS entry, the prompt and answer budget cover just that group.
+    num_predict is sized from the fields and the line item rows the text seems
+    to hold (the group's full budget with full_answer), num_ctx from that plus
+    the estimated prompt.
     """
+    safe_text = text[:LLM_TEXT_CHARS]
+    name, fields, max_predict = ("all", None, LLM_NUM_PREDICT) if group is None else group
+    prefix = system_prefix(name, fields)
+    num_predict = max_predict
+    if not full_answer:
+        expected_items = sum(1 for line in safe_text.splitlines() if MONEY_RE.search(line))
+        num_predict = min(max_predict, answer_budget(prefix["fields"], expected_items))
+    user = user_message(safe_text, custom_prompt)
+    prompt_tokens = prefix["tokens"] + estimate_tokens(user) + CHAT_TEMPLATE_TOKENS
+    num_ctx = context_sizer.choose(prompt_tokens + num_predict)
+    logger.debug(
+        "llm.input chars=%d original_chars=%d prompt=%s est_prompt_tokens=%d num_ctx=%d num_predict=%d",
+        len(safe_text), len(text), prefix["id"], prompt_tokens, num_ctx, num_predict,
+    )
 
-    response = ollama.chat(
-        model="qwen2.5:3b", 
+    return dict(
+        model=MODEL_NAME,
         messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": safe_text}
+            {"role": "system", "content": prefix["text"]},
+            {"role": "user", "content": user}
         ],
         format="json",        # <--- Forces valid JSON (prevents "I can't do that" chat responses)
-        keep_alive="5m",      # <--- Keeps model loaded so 2nd invoice is fast
+        keep_alive=LLM_KEEP_ALIVE,  # <--- Keeps model loaded so 2nd invoice is fast (pinged when idle)
         options={
-            "num_ctx": 4096,     # <--- CRITICAL: Doubles memory capacity
-            "temperature": 0.1,  # <--- CRITICAL: Forces factual/consistent extraction
-            "num_predict": 1000  # <--- CRITICAL: Prevents cutting off halfway
+            "num_ctx": num_ctx,              # <--- Sized per request, see ContextSizer
+            "temperature": 0.1,              # <--- CRITICAL: Forces factual/consistent extraction
+            "num_predict": num_predict       # <--- Sized per request; a cut-off answer is retried at full budget
         }
     )
+
+
+def _truncated(request, response, group):
+    """Did the answer hit an adaptive num_predict below the group's full budget?"""
+    max_predict = LLM_NUM_PREDICT if group is None else group[2]
+    return response.get('done_reason') == "length" and request["options"]["num_predict"] < max_predict
+
+
+def _record_llm_response(stats, request, response):
+    """Add one Ollama answer's counters to a stats dict, and to the prefill metrics."""
+    prefill_seconds = (response.get('prompt_eval_duration') or 0) / 1e9
+    _merge_llm_stats(stats, {
+        "prompt_tokens": response.get('prompt_eval_count') or 0,
+        "completion_tokens": response.get('eval_count') or 0,
+        "prefill_seconds": prefill_seconds,
+        "load_seconds": (response.get('load_duration') or 0) / 1e9,
+        "num_ctx": request["options"]["num_ctx"],
+        "num_predict": request["options"]["num_predict"],
+    })
+    LLM_PREFILL_SECONDS.observe(prefill_seconds)
+    LLM_CONTEXT_REQUESTS.inc(num_ctx=str(request["options"]["num_ctx"]))
+
+
+def _merge_llm_stats(into, stats):
+    """Sum LLM stats (num_ctx is the largest used, not a sum)."""
+    for key, value in stats.items():
+        if key == "num_ctx":
+            into[key] = max(into.get(key, 0), value)
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+async def query_invoice_ollama_async(text, custom_prompt, stats=None, group=None):
+    """
+    Ask the model for the invoice fields (one FIELD_GROUPS group if given) on the Ollama node pool.
+    If a `stats` dict is passed it receives Ollama's token counts and prefill time.
+    An answer cut off by the adaptive num_predict is asked again with the full budget.
+    """
+    stats = {} if stats is None else stats
+    request = build_ollama_request(text, custom_prompt, group)
+    response = await llm_pool.chat(**request)
+    _record_llm_response(stats, request, response)
+    if _truncated(request, response, group):
+        LLM_TRUNCATED.inc()
+        logger.info("llm.truncated num_predict=%d retrying", request["options"]["num_predict"])
+        request = build_ollama_request(text, custom_prompt, group, full_answer=True)
+        response = await llm_pool.chat(**request)
+        _record_llm_response(stats, request, response)
     return response['message']['content']
 
 
-def clean_llm_extraction(fields, pdf_text):
+async def stream_invoice_ollama(text, custom_prompt, stats=None, group=None, full_answer=False):
+    """
+    Streaming variant: yields pieces of the answer as Ollama generates them.
+    stats["truncated"] is set when the adaptive num_predict cut the answer off.
+    """
+    request = build_ollama_request(text, custom_prompt, group, full_answer)
+    async for part in llm_pool.stream_chat(**request):
+        if part.get('done') and stats is not None:
+            _record_llm_response(stats, request, part)
+            if _truncated(request, part, group):
+                LLM_TRUNCATED.inc()
+                stats["truncated"] = 1
+        content = part['message']['content']
+        if content:
+            yield content
+
+
+def parse_llm_output(result):
+    """Strip markdown fences from the LLM output and parse it as JSON."""
+    # Clean up the result - remove markdown code blocks if present
+    cleaned_result = result.strip()
+    if cleaned_result.startswith("```json"):
+        cleaned_result = cleaned_result[7:]
+    elif cleaned_result.startswith("```"):
+        cleaned_result = cleaned_result[3:]
+    if cleaned_result.endswith("```"):
+        cleaned_result = cleaned_result[:-3]
+    cleaned_result = cleaned_result.strip()
+    
+    try: 
+        parsed_result = json.loads(cleaned_result)
+        logger.debug("llm.parsed fields=%s", list(parsed_result.keys()))
+    except Exception as e:
+        logger.warning("llm.parse_error error=%r output=%r", str(e), cleaned_result[:500])
+        parsed_result = {"raw_output": result, "parse_error": str(e)}
+    return parsed_result
+
+
+def clean_llm_extraction(fields, pdf_text, facts=None):
     """
     Clean up LLM output to ensure values match PDF text exactly.
     Fixes common LLM errors like reformatted dates, mixed fields, arrays, etc.
+    The rules live in cleaning.py; pass facts to share text scans between calls.
     """
-    import re
-    import ast
-    
-    cleaned = {}
-    
-    for field_name, field_value in fields.items():
-        if not field_value:
-            cleaned[field_name] = field_value
+    return clean_fields(fields, pdf_text, facts)
+
+
+def _report_stage(on_stage, stage):
+    if on_stage is not None:
+        on_stage(stage)
+
+
+def _record_stage(timings, stage, started):
+    """Store a stage duration in the request's timings and the stage histogram."""
+    elapsed = time.perf_counter() - started
+    timings[stage] = round(elapsed, 4)
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+def _record_document_metrics(text, pages, parsed_result, boxes, llm_stats):
+    DOCUMENT_PAGES.inc(len(pages))
+    parsed_pages = [p for p in pages if p.get("words") is not None]
+    DOCUMENT_PAGES_PARSED.inc(len(parsed_pages))
+    DOCUMENT_WORDS.inc(sum(len(p["words"]) for p in parsed_pages))
+    DOCUMENT_CHARS.inc(len(text))
+    LLM_TOKENS.inc(llm_stats.get("prompt_tokens", 0), kind="prompt")
+    LLM_TOKENS.inc(llm_stats.get("completion_tokens", 0), kind="completion")
+    found = {box["field"] for box in boxes}
+    for api_field, front_field in BOX_FIELD_MAP.items():
+        if api_field in SKIP_FIELDS or not _to_scalar_text(parsed_result.get(api_field)).strip():
             continue
-        
-        value = str(field_value).strip()
-        
-        # Handle address arrays from Mistral (e.g., ['Suite 5A-1204', '123 Somewhere Street'])
-        if field_name in ['vendor_address', 'customer_address', 'billing_address', 'shipping_address']:
-            if value.startswith('['):
-                try:
-                    addr_list = ast.literal_eval(value)
-                    value = ' '.join([str(part).strip() for part in addr_list if part])
-                except:
-                    value = value.replace('[', '').replace(']', '').replace("'", '').replace('"', '')
-                    value = re.sub(r',\s*', ' ', value)
-        
-        # Fix 1: Remove field labels from values
-        label_patterns = [
-            r'^invoice\s+number\s*:?\s*',
-            r'^order\s+number\s*:?\s*',
-            r'^bill\s+number\s*:?\s*',
-            r'^invoice\s+date\s*:?\s*',
-            r'^due\s+date\s*:?\s*',
-            r'^total\s*:?\s*',
-            r'^vendor\s*:?\s*',
-            r'^from\s*:?\s*',
-            r'^address\s*:?\s*',
-            r'^purchase\s+order\s*:?\s*',
-            r'^account\s+number\s*:?\s*',
-            r'^currency\s*:?\s*',
-        ]
-        for pattern in label_patterns:
-            value = re.sub(pattern, '', value, flags=re.IGNORECASE).strip()
-        
-        # Fix 2: For dates, try to find the actual date format in PDF
-        if field_name in ['invoice_date', 'due_date']:
-            # If LLM returned "2016-01-25" but PDF has "January 25, 2016", fix it
-            date_matches = re.findall(r'(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}', pdf_text)
-            if date_matches and not re.match(r'\w+ \d+,? \d{4}', value):
-                # LLM didn't return proper date format, use from PDF
-                if field_name == 'invoice_date' and len(date_matches) >= 1:
-                    value = date_matches[0]
-                elif field_name == 'due_date' and len(date_matches) >= 2:
-                    value = date_matches[1]
-                elif len(date_matches) >= 1:
-                    value = date_matches[0]
-        
-        # Fix 3: Clean vendor name - remove order number if mistakenly included
-        if field_name == 'vendor_name':
-            value = re.sub(r'\s+order\s+number\s+\d+.*$', '', value, flags=re.IGNORECASE)
-            value = re.sub(r'\s+po\s*#?\s*\d+.*$', '', value, flags=re.IGNORECASE)
-        
-        # Fix 4: Clean vendor address - remove dates and other fields
-        if field_name == 'vendor_address':
-            # Remove dates
-            value = re.sub(r'(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}', '', value, flags=re.IGNORECASE)
-            # Remove "Invoice Date", "Due Date" labels and their content
-            value = re.sub(r'invoice\s+date|due\s+date|due', '', value, flags=re.IGNORECASE)
-            # Remove PO numbers if mixed in
-            value = re.sub(r'p\.o\.|po\s*#?\s*\d+', '', value, flags=re.IGNORECASE)
-            # Clean up extra spaces
-            value = re.sub(r'\s+', ' ', value).strip()
-        
-        # Fix 5: Currency - if LLM returned text but PDF has symbol, extract symbol
-        if field_name == 'currency':
-            if value and len(value) > 1 and value.upper() in ['USD', 'EUR', 'GBP', 'AUD', 'CAD']:
-                # LLM returned currency code but PDF might have symbol
-                if '$' in pdf_text:
-                    value = '$'
-                elif '€' in pdf_text:
-                    value = '€'
-                elif '£' in pdf_text:
-                    value = '£'
-        
-        cleaned[field_name] = value if value else None
+        BOX_LOOKUPS.inc(field=api_field)
+        if front_field in found:
+            BOX_HITS.inc(field=api_field)
+
+
+def _template_result(match, pages):
+    """Result dict in the LLM's shape for fields read from a vendor template."""
+    fields = match["fields"]
+    parsed_result = {field: fields.get(field) for field in BOX_FIELD_MAP}
+    # Templates cover the header fields; line items come from the layout extractor or the LLM
+    parsed_result["line_items"] = []
+    total = fields.get("total_amount") or ""
+    symbol = re.search(r"[$€£¥]", total)
+    parsed_result["currency"] = fields.get("currency") or (symbol.group(0) if symbol else None)
+
+    boxes = []
+    for api_field, (page_index, indexes) in match["regions"].items():
+        page = pages[page_index]
+        page_w = max(page.get("width", 1), 1)
+        page_h = max(page.get("height", 1), 1)
+        if api_field in SKIP_FIELDS:
+            continue
+        boxes.append({
+            'field': BOX_FIELD_MAP[api_field],
+            'page': page_index + 1,
+            **merge_box(page["words"], indexes, page_w, page_h),
+            'normalized': True,
+        })
+    parsed_result["extraction_method"] = "template"
+    parsed_result["template"] = {
+        "id": match["template_id"],
+        "similarity": match["similarity"],
+        "confidence": match["confidence"],
+        "field_confidence": match["field_confidence"],
+    }
+    return parsed_result, boxes
+
+
+# Answer fields announced one by one to on_field listeners (streaming)
+RESULT_FIELDS = list(BOX_FIELD_MAP) + ["line_items"]
+
+
+def _emit_fields(on_field, parsed_result, boxes):
+    """on_field(field, value, boxes) for every field of a finished result (cache hit, template)."""
+    if on_field is None:
+        return
+    for api_field in RESULT_FIELDS:
+        if api_field in parsed_result:
+            front_field = BOX_FIELD_MAP.get(api_field)
+            on_field(api_field, parsed_result[api_field], [b for b in boxes if b["field"] == front_field])
+
+
+async def _stream_fields(llm_text, custom_prompt, stats, facts, pages, source, page_cache, on_field, group=None):
+    """
+    Stream the LLM answer and clean + box each top-level field as soon as its JSON
+    is complete, reporting it through on_field(field, value, boxes).
+    Returns the full answer text and {field: (cleaned value, boxes)} of what was reported.
+    """
+    streamed = {}
+    for full_answer in (False, True):
+        parser = IncrementalObjectParser()
+        stats.pop("truncated", None)
+        async for chunk in stream_invoice_ollama(llm_text, custom_prompt, stats, group, full_answer):
+            for api_field, value in parser.feed(chunk):
+                if group is not None and api_field not in group[1]:
+                    continue
+                value = clean_llm_extraction({api_field: value}, facts.text, facts)[api_field]
+                if api_field in streamed and streamed[api_field][0] == value:
+                    # Already reported by the cut-off first answer
+                    continue
+                boxes = []
+                if api_field in BOX_FIELD_MAP:
+                    # One field's lookup is milliseconds; a thread avoids pickling pages per field
+                    boxes = await asyncio.to_thread(find_boxes_in_pdf, {api_field: value}, pages, source, page_cache)
+                streamed[api_field] = (value, boxes)
+                on_field(api_field, value, boxes)
+        if not stats.pop("truncated", None):
+            break
+        logger.info("llm.truncated streaming=1 retrying")
+    return parser.text, streamed
+
+
+async def _query_field_groups(llm_text, custom_prompt, stats, facts, pages, source, page_cache, on_field,
+                              groups=FIELD_GROUPS):
+    """
+    Grouped LLM mode: one focused prompt per group (see field_groups()), all in flight
+    at once, answers merged into a single field dict (streamed through on_field when given).
+    Returns (fields, streamed); fields is None if any group's answer was not valid JSON.
+    """
+    async def run_group(group):
+        group_stats = {}
+        if on_field is None:
+            answer = await query_invoice_ollama_async(llm_text, custom_prompt, group_stats, group)
+            return answer, group_stats, {}
+        answer, streamed = await _stream_fields(
+            llm_text, custom_prompt, group_stats, facts, pages, source, page_cache, on_field, group
+        )
+        return answer, group_stats, streamed
+
+    tasks = [asyncio.ensure_future(run_group(group)) for group in groups]
+    try:
+        answers = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    merged = {}
+    streamed = {}
+    failed = []
+    for (name, fields, _), (answer, group_stats, group_streamed) in zip(groups, answers):
+        _merge_llm_stats(stats, group_stats)
+        parsed = parse_llm_output(answer)
+        if "parse_error" in parsed:
+            failed.append(name)
+            continue
+        for field in fields:
+            merged[field] = parsed.get(field)
+        streamed.update(group_streamed)
+    if failed:
+        logger.warning("llm.group_failed groups=%s", failed)
+        return None, streamed
+    return merged, streamed
+
+
+def _match_template(pages):
+    """(layout fingerprint, vendor_templates.extract result or None) for a parsed document."""
+    first = pages[0] if pages else {}
+    features = fingerprint(first.get("words"), first.get("width", 1), first.get("height", 1))
+    return features, vendor_templates.extract(pages, features) if pages else None
+
+
+def _learn_template(pages, parsed_result, boxes, features):
+    """Feed a successful LLM extraction back into the vendor templates."""
+    api_fields = {front: api for api, front in BOX_FIELD_MAP.items()}
+    boxes_by_field = {api_fields[box["field"]]: box for box in boxes if box["field"] in api_fields}
+    values = {}
+    for field in BOX_FIELD_MAP:
+        value = _to_scalar_text(parsed_result.get(field)).strip()
+        if value and field not in SKIP_FIELDS:
+            values[field] = value
+    try:
+        return vendor_templates.learn(pages, values, boxes_by_field, parsed_result.get("vendor_name"), features)
+    except Exception:
+        # Templates are an optimization; never fail an extraction over them
+        logger.exception("templates.learn_failed")
+        return None
+
+
+async def run_extraction(source, custom_prompt, timings=None, on_stage=None, use_templates=True, on_field=None,
+                         llm_mode="single", content_sha256=None, reuse_duplicates=True):
+    """
+    Full extraction pipeline for one PDF (a file path, or the bytes of a small upload).
+    PDF parsing and box finding run in the process pool, the LLM call is awaited,
+    so the event loop stays free for other requests while this one works.
+    If a `timings` dict is passed it is filled with per-stage seconds, and
+    `on_stage(name)` is called after pdf_parsed, llm_done, cleaned and boxes_done
+    (pdf_parsed, template_matched and boxes_done when a vendor template answers).
+    With use_templates, a confident vendor template replaces the LLM call, and
+    LLM results teach the templates.
+    With on_field, the LLM answer is streamed and on_field(field, value, boxes)
+    is called for each field as soon as it is complete, cleaned and boxed.
+    llm_mode="grouped" asks for FIELD_GROUPS with concurrent focused prompts and
+    falls back to the single prompt if a group's answer does not parse.
+    Line items come from the page layout when the table adds up to a printed
+    total (default prompt only); the LLM is then not asked for them.
+    A near-duplicate of an earlier document with the same numbers (see dedup.py)
+    reuses that document's fields unless reuse_duplicates is False; LLM results
+    are remembered under content_sha256 for later duplicates.
+    """
+    start_time = time.time()
+    if timings is None:
+        timings = {}
+
+    logger.debug("extract.parse source=%s", source if isinstance(source, str) else f"<{len(source)} bytes>")
+    stage_start = time.perf_counter()
+    # Only parse as far as the LLM will read; box finding loads later pages lazily
+    text, pages = await parse_pdf(source, LLM_TEXT_CHARS)
+    _record_stage(timings, "pdf_parse", stage_start)
+    _report_stage(on_stage, "pdf_parsed")
+    logger.debug("extract.parsed chars=%d pages=%d", len(text), len(pages))
+
+    table = None
+    if custom_prompt == DEFAULT_EXTRACTION_PROMPT:
+        stage_start = time.perf_counter()
+        table = await asyncio.to_thread(extract_line_items, pages)
+        _record_stage(timings, "line_items", stage_start)
+        LINE_ITEM_TABLES.inc(outcome="none" if table is None else "verified" if table["verified"] else "unverified")
+        if table is not None:
+            logger.debug("extract.line_items rows=%d pages=%s sum=%s verified=%s",
+                         len(table["rows"]), table["pages"], table["sum"], table["verified"])
+    layout_items = table["rows"] if table is not None and table["verified"] else None
+
+    shingles = None
+    duplicate = None
+    prompt_key = hashlib.sha256(f"{LLM_RESULT_KEY}\n{custom_prompt}".encode()).hexdigest()[:16]
+    if DEDUP_MODE != "off":
+        stage_start = time.perf_counter()
+        shingles = await asyncio.to_thread(duplicate_index.fingerprint, text)
+        if reuse_duplicates:
+            duplicate = await asyncio.to_thread(duplicate_index.lookup, shingles, prompt_key)
+        _record_stage(timings, "dedup", stage_start)
+        reuse = DEDUP_MODE == "reuse" and duplicate is not None and duplicate["same_numbers"]
+        DEDUP_LOOKUPS.inc(outcome=(
+            "skipped" if shingles[0] is None or not reuse_duplicates
+            else "reused" if reuse else "flagged" if duplicate is not None else "unique"
+        ))
+        if reuse:
+            logger.debug("extract.duplicate of=%s similarity=%s", duplicate["content_sha256"][:12], duplicate["similarity"])
+            _report_stage(on_stage, "duplicate_matched")
+            parsed_result = dict(duplicate["result"])
+            if layout_items is not None:
+                parsed_result["line_items"] = layout_items
+                parsed_result["line_items_source"] = "layout"
+            stage_start = time.perf_counter()
+            boxes = await run_cpu(find_boxes_in_pdf, parsed_result, pages, source)
+            _record_stage(timings, "boxes", stage_start)
+            _emit_fields(on_field, parsed_result, boxes)
+            _report_stage(on_stage, "boxes_done")
+            _record_document_metrics(text, pages, parsed_result, boxes, {})
+            logger.info("extract.done method=duplicate of=%s pages=%d boxes=%d timings=%s",
+                        duplicate["content_sha256"][:12], len(pages), len(boxes), timings)
+            parsed_result["execution_time_seconds"] = round(time.time() - start_time, 2)
+            parsed_result["boxes"] = boxes
+            parsed_result["boxes_count"] = len(boxes)
+            parsed_result["words_per_page"] = [len(p["words"]) if p.get("words") is not None else None for p in pages]
+            parsed_result["extraction_method"] = "duplicate"
+            parsed_result["duplicate_of"] = {k: duplicate[k] for k in ("content_sha256", "similarity")}
+            return parsed_result
+    near_duplicate = None
+    if duplicate is not None:
+        near_duplicate = {k: duplicate[k] for k in ("content_sha256", "similarity", "same_numbers")}
+
+    features = None
+    items_stats = {}
+    if use_templates:
+        stage_start = time.perf_counter()
+        features, match = await asyncio.to_thread(_match_template, pages)
+        _record_stage(timings, "template", stage_start)
+        if match is not None:
+            logger.debug("extract.template id=%s similarity=%s confidence=%s fields=%s",
+                          match["template_id"], match["similarity"], match["confidence"], match["field_confidence"])
+        template_result = None
+        if match is not None and match["confidence"] >= TEMPLATE_MIN_CONFIDENCE:
+            template_result, boxes = _template_result(match, pages)
+            if layout_items is not None:
+                template_result["line_items"] = layout_items
+                template_result["line_items_source"] = "layout"
+            else:
+                # Templates hold header fields only: without verified layout rows, ask the
+                # LLM for the items group and keep the template for everything else
+                stage_start = time.perf_counter()
+                items_text, _ = build_context(pages, context_token_budget(custom_prompt))
+                answer = await query_invoice_ollama_async(items_text, custom_prompt, items_stats, ITEMS_GROUP)
+                items = parse_llm_output(answer)
+                _record_stage(timings, "llm", stage_start)
+                if "parse_error" in items:
+                    logger.info("extract.template_items_failed template=%s falling_back=llm", match["template_id"])
+                    template_result = None
+                else:
+                    items = clean_llm_extraction({f: items.get(f) for f in ITEMS_GROUP[1]}, text)
+                    template_result["line_items"] = items["line_items"] or []
+                    for field in ITEMS_GROUP[1]:
+                        if not template_result.get(field):
+                            template_result[field] = items[field]
+                    template_result["line_items_source"] = "llm"
+                    template_result["llm_stats"] = items_stats
+        if template_result is not None:
+            parsed_result = template_result
+            _report_stage(on_stage, "template_matched")
+            await asyncio.to_thread(vendor_templates.record_use, match["template_id"])
+            _emit_fields(on_field, parsed_result, boxes)
+            _report_stage(on_stage, "boxes_done")
+            words_per_page = [len(p["words"]) if p.get("words") is not None else None for p in pages]
+            _record_document_metrics(text, pages, parsed_result, boxes, items_stats)
+            logger.info("extract.done method=template template=%s pages=%d boxes=%d timings=%s",
+                        match["template_id"], len(pages), len(boxes), timings)
+            parsed_result["execution_time_seconds"] = round(time.time() - start_time, 2)
+            parsed_result["boxes"] = boxes
+            parsed_result["boxes_count"] = len(boxes)
+            parsed_result["words_per_page"] = words_per_page
+            if near_duplicate is not None:
+                parsed_result["near_duplicate"] = near_duplicate
+            return parsed_result
+
+    # Header, labelled lines, totals and the last page, fitted to the context window
+    stage_start = time.perf_counter()
+    llm_text, context_stats = build_context(pages, context_token_budget(custom_prompt))
+    _record_stage(timings, "context", stage_start)
+    DOCUMENT_CONTEXT_CHARS.inc(len(llm_text))
+    logger.debug("extract.context %s", context_stats)
     
-    return cleaned
+    llm_stats = {}
+    # A template hit whose items answer did not parse still spent those tokens
+    _merge_llm_stats(llm_stats, items_stats)
+    streamed = {}
+    page_cache = {}
+    stage_start = time.perf_counter()
+    on_streamed_field = None
+    if on_field is not None:
+        def on_streamed_field(api_field, value, boxes):
+            if "llm_first_field" not in timings:
+                _record_stage(timings, "llm_first_field", stage_start)
+            on_field(api_field, value, boxes)
+
+    if layout_items is not None and on_field is not None:
+        on_field("line_items", layout_items, [])
+
+    # Shared by every clean_llm_extraction call on this document
+    facts = DocumentFacts(text)
+    parsed_result = None
+    if llm_mode == "grouped":
+        parsed_result, streamed = await _query_field_groups(
+            llm_text, custom_prompt, llm_stats, facts, pages, source, page_cache, on_streamed_field,
+            field_groups(layout_items is not None),
+        )
+        if parsed_result is None:
+            llm_mode = "grouped_fallback"
+    if parsed_result is None:
+        single_stats = {}
+        group = NO_ITEMS_GROUP if layout_items is not None else None
+        if on_field is None:
+            result = await query_invoice_ollama_async(llm_text, custom_prompt, single_stats, group)
+        else:
+            result, streamed = await _stream_fields(
+                llm_text, custom_prompt, single_stats, facts, pages, source, page_cache, on_streamed_field, group
+            )
+        # After a grouped fallback, count the tokens the failed groups used too
+        _merge_llm_stats(llm_stats, single_stats)
+    _record_stage(timings, "llm", stage_start)
+    _report_stage(on_stage, "llm_done")
+    LLM_MODE_RUNS.inc(mode=llm_mode)
+    logger.debug("extract.llm model=%s mode=%s tokens=%s", MODEL_NAME, llm_mode, llm_stats)
+    
+    if parsed_result is None:
+        stage_start = time.perf_counter()
+        parsed_result = parse_llm_output(result)
+        _record_stage(timings, "json_parse", stage_start)
+
+    # 👇 CLEAN UP LLM OUTPUT before finding boxes
+    stage_start = time.perf_counter()
+    if "parse_error" not in parsed_result:
+        parsed_result = clean_llm_extraction(parsed_result, text, facts)
+        if layout_items is not None:
+            parsed_result["line_items"] = layout_items
+        parsed_result["line_items_source"] = "layout" if layout_items is not None else "llm"
+    _record_stage(timings, "clean", stage_start)
+    _report_stage(on_stage, "cleaned")
+
+    # Derive bounding boxes for extracted fields (best-effort)
+    stage_start = time.perf_counter()
+    if not streamed:
+        boxes = await run_cpu(find_boxes_in_pdf, parsed_result, pages, source)
+    else:
+        # Reuse the boxes found while streaming; only fields whose final value differs are looked up again
+        boxes = []
+        remaining = {}
+        for api_field, value in parsed_result.items():
+            if api_field in streamed and streamed[api_field][0] == value:
+                boxes.extend(streamed[api_field][1])
+            else:
+                remaining[api_field] = value
+        if remaining:
+            boxes += await asyncio.to_thread(find_boxes_in_pdf, remaining, pages, source, page_cache)
+        order = list(BOX_FIELD_MAP.values())
+        boxes.sort(key=lambda box: order.index(box["field"]))
+    _record_stage(timings, "boxes", stage_start)
+    _report_stage(on_stage, "boxes_done")
+    if use_templates and "parse_error" not in parsed_result:
+        await asyncio.to_thread(_learn_template, pages, parsed_result, boxes, features)
+    if shingles is not None and content_sha256 and "parse_error" not in parsed_result:
+        remembered = {key: parsed_result[key] for key in RESULT_FIELDS + ["line_items_source"] if key in parsed_result}
+        await asyncio.to_thread(duplicate_index.add, shingles, prompt_key, content_sha256, remembered)
+    # None marks pages that were never parsed (beyond the LLM text budget)
+    words_per_page = [len(p["words"]) if p.get("words") is not None else None for p in pages]
+    _record_document_metrics(text, pages, parsed_result, boxes, llm_stats)
+    logger.info(
+        "extract.done pages=%d chars=%d boxes=%d prompt_tokens=%s completion_tokens=%s timings=%s",
+        len(pages), len(text), len(boxes),
+        llm_stats.get("prompt_tokens"), llm_stats.get("completion_tokens"), timings,
+    )
+
+    parsed_result["execution_time_seconds"] = round(time.time() - start_time, 2)
+    parsed_result["boxes"] = boxes
+    parsed_result["boxes_count"] = len(boxes)
+    parsed_result["words_per_page"] = words_per_page
+    parsed_result["extraction_method"] = "llm"
+    parsed_result["llm_mode"] = llm_mode
+    parsed_result["llm_stats"] = {
+        "prompt_version": PROMPT_VERSION,
+        **{key: round(value, 4) if isinstance(value, float) else value for key, value in llm_stats.items()},
+    }
+    if near_duplicate is not None:
+        parsed_result["near_duplicate"] = near_duplicate
+    return parsed_result
+
+
+DEFAULT_EXTRACTION_PROMPT = "Extract all invoice fields including invoice number, date, due date, vendor name and address, purchase order, account number, line items, total amount, and currency."
+
+
+async def extract_document(document, custom_prompt, use_cache=True, refresh_cache=False, timings=None, on_stage=None,
+                           use_templates=True, on_field=None, llm_mode=None):
+    """
+    Extract one uploaded PDF (uploads.StoredDocument): cache lookup, pipeline, cache store.
+    The document's hash was computed while it was spooled, so nothing is re-read here.
+    Vendor templates and grouped LLM prompts only apply to the default prompt; a
+    custom prompt asks for something a template or the field groups cannot know.
+    """
+    start_time = time.time()
+    use_templates = use_templates and custom_prompt == DEFAULT_EXTRACTION_PROMPT
+    if custom_prompt != DEFAULT_EXTRACTION_PROMPT:
+        llm_mode = "single"
+    # A template answer must not be served to a caller who opted out of templates
+    cache_key = make_cache_key(document.sha256, custom_prompt, LLM_RESULT_KEY if use_templates else LLM_RESULT_KEY + ":llm")
+
+    # use_cache=false bypasses the cache entirely; refresh_cache=true drops the
+    # stored entry and re-extracts (the fresh result is cached again).
+    if use_cache and refresh_cache:
+        await asyncio.to_thread(extraction_cache.invalidate, cache_key)
+    elif use_cache:
+        cached = await asyncio.to_thread(extraction_cache.get, cache_key)
+        if cached is not None:
+            logger.info("extract.cache_hit key=%s", cache_key[:12])
+            EXTRACTIONS.inc(outcome="cache_hit")
+            cached["execution_time_seconds"] = round(time.time() - start_time, 2)
+            cached["cache"] = "hit"
+            cached["cache_key"] = cache_key
+            _emit_fields(on_field, cached, cached.get("boxes") or [])
+            return cached
+
+    try:
+        parsed_result = await run_extraction(
+            document.source, custom_prompt, timings, on_stage, use_templates, on_field, llm_mode or LLM_MODE,
+            content_sha256=document.sha256, reuse_duplicates=use_cache and not refresh_cache,
+        )
+    except Exception:
+        EXTRACTIONS.inc(outcome="error")
+        raise
+    EXTRACTIONS.inc(outcome="parse_error" if "parse_error" in parsed_result else "ok")
+    parsed_result["execution_time_seconds"] = round(time.time() - start_time, 2)
+    parsed_result["content_sha256"] = document.sha256
+
+    # Only successful parses are worth keeping; a parse error should be retried.
+    if use_cache and "parse_error" not in parsed_result:
+        await asyncio.to_thread(extraction_cache.put, cache_key, parsed_result)
+    parsed_result["cache"] = "miss" if use_cache else "bypass"
+    parsed_result["cache_key"] = cache_key
+    return parsed_result
+
+
+def _rejected(ex):
+    """503/429 response with Retry-After for a request refused by admission control."""
+    return JSONResponse(
+        status_code=ex.status_code,
+        content={"error": str(ex), "retry_after": ex.retry_after},
+        headers={"Retry-After": str(ex.retry_after)},
+    )
 
 
 @app.post("/extract-invoice")
 async def extract_invoice(
+    request: Request,
     file: UploadFile = File(...),
-    custom_prompt: str = Form("Extract all invoice fields including invoice number, date, due date, vendor name and address, purchase order, account number, line items, total amount, and currency.")
+    custom_prompt: str = Form(DEFAULT_EXTRACTION_PROMPT),
+    use_cache: bool = Form(True),
+    refresh_cache: bool = Form(False),
+    async_mode: bool = Form(False),
+    include_timings: bool = Form(False),
+    use_templates: bool = Form(True),
+    llm_mode: str = Form(LLM_MODE),
 ):
-    start_time = time.time()
-    print(f"\n{'='*60}", flush=True)
-    print(f"📄 NEW EXTRACTION REQUEST", flush=True)
-    print(f"{'='*60}", flush=True)
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-        
+    logger.debug("extract.request filename=%s async_mode=%s", file.filename, async_mode)
+    if llm_mode not in LLM_MODES:
+        return JSONResponse(status_code=400, content={"error": f"llm_mode must be one of {', '.join(LLM_MODES)}"})
+    priority = request_priority(request, "bulk" if async_mode else "interactive")
+
+    timings = {}
+    stage_start = time.perf_counter()
+    # Chunked copy + hash off the event loop; small files stay in memory
+    document = await asyncio.to_thread(spool_stream, file.file)
+    _record_stage(timings, "upload_read", stage_start)
+
+    # Checked right before queueing (no await in between), so a burst sees the requests queued ahead of it.
+    # Queued jobs are bulk work with their own queue limit: only the client's rate applies.
     try:
-        print(f"📂 Extracting text from PDF: {tmp_path}", flush=True)
-        text, pages = extract_pdf_content(tmp_path)
-        print(f"✅ Extracted {len(text)} characters from {len(pages)} pages", flush=True)
-        print(f"📝 First 200 chars: {text[:200]}", flush=True)
-        
-        print(f"🤖 Calling Ollama with mistral:7b...", flush=True)
-        result = query_invoice_ollama(text, custom_prompt)
-        print(f"✅ Ollama returned {len(result)} characters", flush=True)
-        print(f"📝 Raw result: {result[:500]}", flush=True)
-        
-        # Clean up the result - remove markdown code blocks if present
-        cleaned_result = result.strip()
-        if cleaned_result.startswith("```json"):
-            cleaned_result = cleaned_result[7:]
-        elif cleaned_result.startswith("```"):
-            cleaned_result = cleaned_result[3:]
-        if cleaned_result.endswith("```"):
-            cleaned_result = cleaned_result[:-3]
-        cleaned_result = cleaned_result.strip()
-        
-        print(f"🧹 Cleaned result: {cleaned_result[:500]}", flush=True)
-        
-        try: 
-            parsed_result = json.loads(cleaned_result)
-            print(f"✅ JSON parsed successfully. Fields: {list(parsed_result.keys())}", flush=True)
-        except Exception as e:
-            print(f"❌ JSON parse error: {e}", flush=True)
-            parsed_result = {"raw_output": result, "parse_error": str(e)}
-
-        # 👇 CLEAN UP LLM OUTPUT before finding boxes
-        if "parse_error" not in parsed_result:
-            parsed_result = clean_llm_extraction(parsed_result, text)
-
-        # Derive bounding boxes for extracted fields (best-effort)
-        boxes = find_boxes_for_fields(parsed_result, pages)
-        words_per_page = [len(p.get("words", [])) for p in pages]
-        print(f"[extract] boxes={len(boxes)} words_per_page={words_per_page} fields={list(parsed_result.keys())}")
-
-        elapsed = round(time.time() - start_time, 2)
-        parsed_result["execution_time_seconds"] = elapsed
-        parsed_result["boxes"] = boxes
-        parsed_result["boxes_count"] = len(boxes)
-        parsed_result["words_per_page"] = words_per_page
-        
+        priority = admission.check(priority, client_id(request), shed=not async_mode)
+    except AdmissionRejected as ex:
+        document.cleanup()
+        return _rejected(ex)
+
+    if async_mode:
+        # Queue the work and answer immediately; the client polls or subscribes
+        params = {
+            "custom_prompt": custom_prompt,
+            "use_cache": use_cache,
+            "refresh_cache": refresh_cache,
+            "use_templates": use_templates,
+            "llm_mode": llm_mode,
+        }
+        try:
+            job_id = await asyncio.to_thread(job_queue.submit, document, params)
+        except QueueFullError as ex:
+            return JSONResponse(
+                status_code=503,
+                content={"error": str(ex)},
+                headers={"Retry-After": str(ex.retry_after)},
+            )
+        finally:
+            document.cleanup()
+        return JSONResponse(status_code=202, content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events",
+        })
+
+    try:
+        async with admission.slot(priority):
+            parsed_result = await extract_document(
+                document, custom_prompt, use_cache, refresh_cache, timings,
+                use_templates=use_templates, llm_mode=llm_mode,
+            )
+        if include_timings:
+            parsed_result["stage_timings"] = timings
         return JSONResponse(content=parsed_result)
+    except AdmissionRejected as ex:
+        return _rejected(ex)
+    except LLMUnavailableError as ex:
+        logger.error("extract.llm_unavailable filename=%s error=%s", file.filename, ex)
+        return JSONResponse(status_code=503, content={"error": str(ex)}, headers={"Retry-After": "5"})
     except Exception as ex:
+        logger.exception("extract.failed filename=%s", file.filename)
         return JSONResponse(status_code=500, content={"error": str(ex)})
     finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        document.cleanup()
+
+
+@app.post("/extract-invoice/stream")
+async def extract_invoice_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    custom_prompt: str = Form(DEFAULT_EXTRACTION_PROMPT),
+    use_cache: bool = Form(True),
+    refresh_cache: bool = Form(False),
+    use_templates: bool = Form(True),
+    llm_mode: str = Form(LLM_MODE),
+):
+    """
+    Extract one PDF and stream progress while the LLM is still generating:
+    {"event": "stage"} lines, one {"event": "field"} line per field (cleaned
+    value plus its boxes) as soon as it is complete, then {"event": "result"}
+    with the same body /extract-invoice returns (or {"event": "error"}).
+    NDJSON by default; Server-Sent Events when the client accepts text/event-stream.
+    """
+    if llm_mode not in LLM_MODES:
+        return JSONResponse(status_code=400, content={"error": f"llm_mode must be one of {', '.join(LLM_MODES)}"})
+    document = await asyncio.to_thread(spool_stream, file.file)
+    try:
+        priority = admission.check(request_priority(request, "interactive"), client_id(request))
+    except AdmissionRejected as ex:
+        document.cleanup()
+        return _rejected(ex)
+    return _extraction_stream(request, document, file.filename, dict(
+        custom_prompt=custom_prompt, use_cache=use_cache, refresh_cache=refresh_cache,
+        use_templates=use_templates, llm_mode=llm_mode,
+    ), priority=priority)
+
+
+def _extraction_stream(request, document, label, params, on_result=None, priority="interactive"):
+    """
+    StreamingResponse running extract_document(document, **params) with stage,
+    field and result/error events (see extract_invoice_stream). The coroutine
+    on_result(result) is awaited before the result event is sent. The pipeline
+    slot is taken in `priority`'s class once the stream runs; a request still
+    queued at its deadline ends with an error event carrying retry_after.
+    """
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    events = asyncio.Queue()
+    timings = {}
+
+    def on_stage(stage):
+        events.put_nowait({"event": "stage", "stage": stage})
+
+    def on_field(field, value, boxes):
+        events.put_nowait({"event": "field", "field": field, "value": value, "boxes": boxes})
+
+    async def run():
+        try:
+            async with admission.slot(priority):
+                result = await extract_document(
+                    document, params["custom_prompt"], params["use_cache"], params["refresh_cache"], timings,
+                    on_stage=on_stage, use_templates=params["use_templates"], on_field=on_field,
+                    llm_mode=params["llm_mode"],
+                )
+            result["stage_timings"] = timings
+            if on_result is not None:
+                await on_result(result)
+            events.put_nowait({"event": "result", "result": result})
+        except AdmissionRejected as ex:
+            events.put_nowait({"event": "error", "error": str(ex), "retry_after": ex.retry_after})
+        except Exception as ex:
+            logger.exception("extract.stream_failed filename=%s", label)
+            events.put_nowait({"event": "error", "error": str(ex)})
+        finally:
+            events.put_nowait(None)
+
+    async def body():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                if sse:
+                    yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+                else:
+                    yield json.dumps(event) + "\n"
+        finally:
+            # Client gone or stream finished: stop the pipeline, then drop the upload
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            document.cleanup()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class BatchTooLargeError(Exception):
+    """Raised while spooling a batch with more than BATCH_MAX_DOCUMENTS documents."""
+
+
+def _spool_batch_documents(files, workdir, max_documents=BATCH_MAX_DOCUMENTS):
+    """
+    Copy uploaded PDFs (and the PDF members of uploaded ZIP archives) into workdir.
+    Returns a list of (filename, path, error); a bad archive or an oversized PDF
+    becomes one error entry instead of failing the whole batch. Raises
+    BatchTooLargeError as soon as the documents counted pass max_documents,
+    before writing out an archive that would pass it.
+    """
+    documents = []
+    too_large = f"Document exceeds the {UPLOAD_MAX_BYTES} byte limit"
+    for upload in files:
+        name = os.path.basename(upload.filename or "document.pdf")
+        upload.file.seek(0)
+        if name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(upload.file) as archive:
+                    # The member list is the archive's directory: counting costs no decompression
+                    members = [
+                        info for info in archive.infolist()
+                        if not info.is_dir() and info.filename.lower().endswith(".pdf")
+                    ]
+                    if len(documents) + len(members) > max_documents:
+                        raise BatchTooLargeError(max_documents)
+                    for info in members:
+                        if UPLOAD_MAX_BYTES and info.file_size > UPLOAD_MAX_BYTES:
+                            documents.append((f"{name}/{info.filename}", None, too_large))
+                            continue
+                        path = os.path.join(workdir, f"{len(documents)}.pdf")
+                        with archive.open(info) as src, open(path, "wb") as dst:
+                            shutil.copyfileobj(src, dst)
+                        documents.append((f"{name}/{info.filename}", path, None))
+            except zipfile.BadZipFile as ex:
+                documents.append((name, None, f"Invalid ZIP archive: {ex}"))
+            continue
+        if len(documents) >= max_documents:
+            raise BatchTooLargeError(max_documents)
+        if UPLOAD_MAX_BYTES and upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+            documents.append((name, None, too_large))
+            continue
+        path = os.path.join(workdir, f"{len(documents)}.pdf")
+        with open(path, "wb") as dst:
+            shutil.copyfileobj(upload.file, dst)
+        documents.append((name, path, None))
+    return documents
+
+
+async def _stream_batch(documents, workdir, custom_prompt, use_cache):
+    """
+    Run documents through the pipeline with a sliding window and yield one NDJSON
+    line per document as soon as it finishes (completion order, not upload order).
+    """
+    batch_start = time.time()
+    results = asyncio.Queue()
+    window = asyncio.Semaphore(BATCH_WINDOW or max(1, PDF_WORKERS) + llm_pool.capacity)
+
+    async def process(index, filename, path, error):
+        started = time.time()
+        timings = {}
+        line = {"index": index, "filename": filename}
+        try:
+            if error:
+                raise ValueError(error)
+            document = await asyncio.to_thread(document_from_path, path)
+            # The batch was admitted as a whole; its documents wait for slots without a deadline
+            async with admission.slot("bulk", deadline=False):
+                result = await extract_document(document, custom_prompt, use_cache, timings=timings)
+            line["status"] = "parse_error" if "parse_error" in result else "ok"
+            line["result"] = result
+        except Exception as ex:
+            line["status"] = "error"
+            line["error"] = str(ex)
+        finally:
+            window.release()
+            if path and os.path.exists(path):
+                os.unlink(path)
+        line["timing"] = {"total_seconds": round(time.time() - started, 4), **timings}
+        await results.put(line)
+
+    async def feed():
+        tasks = []
+        for index, (filename, path, error) in enumerate(documents):
+            await window.acquire()
+            tasks.append(asyncio.create_task(process(index, filename, path, error)))
+        await asyncio.gather(*tasks)
+        await results.put(None)
+
+    feeder = asyncio.create_task(feed())
+    counts = {"ok": 0, "parse_error": 0, "error": 0}
+    try:
+        while True:
+            line = await results.get()
+            if line is None:
+                break
+            counts[line["status"]] += 1
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": {
+            "documents": len(documents),
+            **counts,
+            "elapsed_seconds": round(time.time() - batch_start, 4),
+        }}) + "\n"
+    finally:
+        feeder.cancel()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@app.post("/extract-invoice/batch")
+async def extract_invoice_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    custom_prompt: str = Form(DEFAULT_EXTRACTION_PROMPT),
+    use_cache: bool = Form(True),
+):
+    """
+    Extract many PDFs (multipart list and/or ZIP archives) and stream results back
+    as NDJSON: one line per document, then a final summary line.
+    """
+    try:
+        admission.check("bulk", client_id(request), shed=False)
+    except AdmissionRejected as ex:
+        return _rejected(ex)
+    workdir = tempfile.mkdtemp(prefix="invoice-batch-")
+    try:
+        documents = await asyncio.to_thread(_spool_batch_documents, files, workdir)
+    except BatchTooLargeError:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return JSONResponse(status_code=413, content={"error": f"Batch exceeds {BATCH_MAX_DOCUMENTS} documents"})
+    except Exception as ex:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return JSONResponse(status_code=400, content={"error": str(ex)})
+    if not documents:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return JSONResponse(status_code=400, content={"error": "No PDF documents in request"})
+
+    return StreamingResponse(
+        _stream_batch(documents, workdir, custom_prompt, use_cache),
+        media_type="application/x-ndjson",
+    )
+
+
+async def _run_job(pdf_path, params, on_stage):
+    """Job queue handler: run one queued extraction through the normal pipeline."""
+    document = await asyncio.to_thread(document_from_path, pdf_path)
+    async with admission.slot("bulk", deadline=False):
+        return await extract_document(
+            document,
+            params.get("custom_prompt", DEFAULT_EXTRACTION_PROMPT),
+            params.get("use_cache", True),
+            params.get("refresh_cache", False),
+            on_stage=on_stage,
+            use_templates=params.get("use_templates", True),
+            llm_mode=params.get("llm_mode"),
+        )
+
+
+WARMUP_PDF = warmup_pdf()
+
+
+def _model_options():
+    """Options that load the model the way requests will use it (a different num_ctx means a reload)."""
+    return {"num_ctx": context_sizer.current}
+
+
+def _warm_pdf_worker():
+    """Runs in a PDF worker: parse the warm-up PDF so pdfplumber's lazy imports and caches are done."""
+    extract_pdf_content(WARMUP_PDF)
+    return os.getpid()
+
+
+async def _warm_pdf_workers():
+    # One task per worker: busy workers make the pool spawn the next one
+    pids = await asyncio.gather(*(run_cpu(_warm_pdf_worker) for _ in range(max(1, PDF_WORKERS))))
+    logger.debug("warmup.pdf_workers processes=%d", len(set(pids)))
+
+
+async def _warm_model():
+    loaded = await llm_pool.preload_all(MODEL_NAME, _model_options())
+    logger.debug("warmup.model model=%s load_seconds=%s", MODEL_NAME, loaded)
+
+
+async def _warm_extraction():
+    """One tiny extraction end to end (nothing is cached, learned or indexed)."""
+    result = await run_extraction(WARMUP_PDF, DEFAULT_EXTRACTION_PROMPT, use_templates=False, reuse_duplicates=False)
+    if "parse_error" in result:
+        # The model answered, so it is loaded; a tiny document is allowed to confuse it
+        logger.warning("warmup.extraction_parse_error error=%s", result["parse_error"])
+
+
+@app.get("/jobs")
+async def jobs_stats():
+    """Queue depth and job counts per status"""
+    return await asyncio.to_thread(job_queue.stats)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll one extraction job; `result` is present once status is done"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events stream of stage progress, ending with the final job state"""
+    if await asyncio.to_thread(job_queue.get, job_id) is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+
+    async def events():
+        last_status = None
+        sent = 0
+        idle = 0.0
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            progress = job.pop("progress")
+            if len(progress) < sent:
+                # Job was re-queued after a restart; replay from the start
+                sent = 0
+            if job["status"] != last_status or len(progress) > sent:
+                last_status = job["status"]
+                idle = 0.0
+                for step in progress[sent:]:
+                    yield f"event: stage\ndata: {json.dumps({'id': job_id, 'status': 'running', **step})}\n\n"
+                sent = len(progress)
+                if job["status"] in TERMINAL_STATUSES:
+                    yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+                    return
+                if job["status"] == "queued":
+                    yield f"event: queued\ndata: {json.dumps({'id': job_id, 'queue_position': job.get('queue_position')})}\n\n"
+            elif idle >= 15:
+                # Comment line keeps proxies from closing an idle stream
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            if await request.is_disconnected():
+                return
+            await job_queue.wait_for_change(1.0)
+            idle += 1.0
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/")
 async def root():
     """Root endpoint to check API status"""
-    return {"message": "Invoice Extractor API is running", "version": "1.0.0"}
\ No newline at end of file
+    return {"message": "Invoice Extractor API is running", "version": "1.0.0"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once startup warm-up has finished, 503 with its progress until then"""
+    snapshot = startup_warmup.snapshot()
+    if not snapshot["ready"]:
+        return JSONResponse(status_code=503, content=snapshot)
+    return snapshot
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics for this worker process"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/templates")
+async def list_templates():
+    """Learned vendor templates with their sample counts and trusted fields"""
+    templates = await asyncio.to_thread(vendor_templates.list)
+    return {"templates": templates, "stats": await asyncio.to_thread(vendor_templates.snapshot)}
+
+
+@app.delete("/templates/{template_id}")
+async def delete_template(template_id: str):
+    """Forget one vendor template (e.g. after the vendor changed its layout)"""
+    return {"template_id": template_id, "removed": await asyncio.to_thread(vendor_templates.delete, template_id)}
+
+
+# -----------------------------------------------------------------------------
+# Invoice store
+# -----------------------------------------------------------------------------
+
+async def _index_invoice(invoice, pdf_path=None):
+    """
+    Bring an invoice's search row up to date. With pdf_path, the PDF text is
+    (re)read if the index does not hold the text of this very PDF yet.
+    Indexing problems are logged, never raised: search is not worth a failed save.
+    """
+    try:
+        text = None
+        if pdf_path and await asyncio.to_thread(search_index.needs_text, invoice):
+            text, _ = await parse_pdf(pdf_path)
+        await asyncio.to_thread(search_index.index, invoice, text)
+    except Exception:
+        logger.exception("search.index_failed invoice=%s", invoice.get("id"))
+
+
+async def _invoice_or_404(invoice_id):
+    invoice = await asyncio.to_thread(invoice_store.get, invoice_id)
+    if invoice is None:
+        return None, JSONResponse(status_code=404, content={"error": "Invoice not found"})
+    return invoice, None
+
+
+@app.post("/invoices")
+async def create_invoice(file: UploadFile = File(...), case_name: str = Form(None)):
+    """Upload a PDF as a new Pending invoice (the PDF is stored with it)"""
+    name = os.path.basename(file.filename or "invoice.pdf")
+    document = await asyncio.to_thread(spool_stream, file.file)
+    try:
+        try:
+            pages = await asyncio.to_thread(count_pdf_pages, document.source)
+        except Exception as ex:
+            return JSONResponse(status_code=400, content={"error": f"Not a readable PDF: {ex}"})
+        invoice = await asyncio.to_thread(invoice_store.create, case_name or name, name, pages, document)
+    finally:
+        document.cleanup()
+    await _index_invoice(invoice)
+    return JSONResponse(status_code=201, content=invoice)
+
+
+@app.get("/invoices")
+async def list_invoices(
+    status: str = None,
+    vendor: str = None,
+    q: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    min_total: float = None,
+    max_total: float = None,
+    sort: str = "id",
+    order: str = "desc",
+    limit: int = PAGE_SIZE_DEFAULT,
+    cursor: str = None,
+):
+    """
+    One page of invoices. status takes a comma-separated list; pass the returned
+    next_cursor to get the following page (null on the last one).
+    """
+    try:
+        return await asyncio.to_thread(
+            invoice_store.list,
+            status=[s for s in status.split(",") if s] if status else None,
+            vendor=vendor, q=q, date_from=date_from, date_to=date_to,
+            min_total=min_total, max_total=max_total, sort=sort, order=order, limit=limit, cursor=cursor,
+        )
+    except ValueError as ex:
+        return JSONResponse(status_code=400, content={"error": str(ex)})
+
+
+@app.get("/invoices/stats")
+async def invoice_stats():
+    """Invoice count in total and per status"""
+    return await asyncio.to_thread(invoice_store.status_counts)
+
+
+@app.get("/invoices/{invoice_id}")
+async def get_invoice(invoice_id: int):
+    invoice, error = await _invoice_or_404(invoice_id)
+    return error or invoice
+
+
+@app.patch("/invoices/{invoice_id}")
+async def update_invoice(invoice_id: int, request: Request):
+    """Change case_name, status, fields (API field names) and/or boxes"""
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
+    if not isinstance(body, dict):
+        return JSONResponse(status_code=400, content={"error": "Body must be a JSON object"})
+    try:
+        invoice = await asyncio.to_thread(
+            invoice_store.update, invoice_id,
+            case_name=body.get("case_name"), status=body.get("status"),
+            fields=body.get("fields"), boxes=body.get("boxes"),
+        )
+    except InvoiceNotFoundError:
+        return JSONResponse(status_code=404, content={"error": "Invoice not found"})
+    except ValueError as ex:
+        return JSONResponse(status_code=400, content={"error": str(ex)})
+    if "case_name" in body or "fields" in body:
+        await _index_invoice(invoice)
+    return invoice
+
+
+@app.delete("/invoices/{invoice_id}")
+async def delete_invoice(invoice_id: int):
+    if not await asyncio.to_thread(invoice_store.delete, invoice_id):
+        return JSONResponse(status_code=404, content={"error": "Invoice not found"})
+    await asyncio.to_thread(search_index.remove, invoice_id)
+    return {"deleted": invoice_id}
+
+
+@app.get("/invoices/{invoice_id}/pdf")
+async def get_invoice_pdf(invoice_id: int):
+    path = await asyncio.to_thread(invoice_store.pdf_path, invoice_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "Invoice PDF not found"})
+    return FileResponse(path, media_type="application/pdf")
+
+
+@app.post("/invoices/{invoice_id}/extract")
+async def extract_stored_invoice(
+    invoice_id: int,
+    request: Request,
+    custom_prompt: str = Form(DEFAULT_EXTRACTION_PROMPT),
+    use_cache: bool = Form(True),
+    refresh_cache: bool = Form(False),
+    use_templates: bool = Form(True),
+    llm_mode: str = Form(LLM_MODE),
+):
+    """
+    Extract an invoice's stored PDF, streaming events like /extract-invoice/stream,
+    and save the extracted fields and boxes on the invoice.
+    """
+    if llm_mode not in LLM_MODES:
+        return JSONResponse(status_code=400, content={"error": f"llm_mode must be one of {', '.join(LLM_MODES)}"})
+    path = await asyncio.to_thread(invoice_store.pdf_path, invoice_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "Invoice PDF not found"})
+    document = await asyncio.to_thread(document_from_path, path)
+    try:
+        priority = admission.check(request_priority(request, "interactive"), client_id(request))
+    except AdmissionRejected as ex:
+        return _rejected(ex)
+
+    async def save(result):
+        if "parse_error" in result:
+            return
+        invoice = await asyncio.to_thread(
+            invoice_store.update, invoice_id,
+            fields={field: result.get(field) for field in RESULT_FIELDS if field in result},
+            boxes=result.get("boxes") or [],
+        )
+        await _index_invoice(invoice, path)
+
+    return _extraction_stream(request, document, f"invoice {invoice_id}", dict(
+        custom_prompt=custom_prompt, use_cache=use_cache, refresh_cache=refresh_cache,
+        use_templates=use_templates, llm_mode=llm_mode,
+    ), on_result=save, priority=priority)
+
+
+@app.get("/export/{table}")
+async def export_invoices(
+    table: str,
+    format: str = "csv",
+    since: str = None,
+    until: str = None,
+    status: str = None,
+    date_from: str = None,
+    date_to: str = None,
+):
+    """
+    Stream stored invoices (table=invoices) or their line items (table=line_items)
+    as csv, jsonl or parquet. Covers invoices updated after `since` up to `until`
+    (default: a few seconds ago); pass the X-Export-Watermark response header as
+    the next export's since. status takes a comma-separated list; date_from and
+    date_to bound the invoice date (ISO).
+    """
+    try:
+        since_value = parse_watermark(since)
+        until_value = parse_watermark(until)
+        if until_value is None:
+            until_value = default_until()
+        chunks = export_table(
+            invoice_store, table, format, since_value, until_value,
+            status=[s for s in status.split(",") if s] if status else None,
+            date_from=date_from, date_to=date_to,
+        )
+    except ValueError as ex:
+        return JSONResponse(status_code=400, content={"error": str(ex)})
+    except ExportUnavailableError as ex:
+        return JSONResponse(status_code=501, content={"error": str(ex)})
+    logger.info("export.start table=%s format=%s since=%s until=%s", table, format, since_value, until_value)
+    # A plain generator: Starlette iterates it in a worker thread
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table}-{int(until_value)}.{format}"',
+            "X-Export-Watermark": repr(until_value),
+        },
+    )
+
+
+@app.get("/search")
+async def search_invoices(q: str, limit: int = SEARCH_PAGE_SIZE_DEFAULT, cursor: str = None, prefix: bool = False):
+    """
+    Ranked full-text search over stored invoices (names, extracted fields, PDF
+    text). Supports phrases, prefix* terms, -exclusions and field:value scopes
+    (see search.py); prefix=true also treats the last word as a prefix.
+    Each item is the invoice plus its score and a snippet with [matched] terms.
+    """
+    try:
+        page = await asyncio.to_thread(search_index.search, q, limit, cursor, prefix)
+    except ValueError as ex:
+        return JSONResponse(status_code=400, content={"error": str(ex)})
+    invoices = await asyncio.to_thread(invoice_store.get_many, [hit["id"] for hit in page["hits"]])
+    items = [
+        {**invoices[hit["id"]], "score": hit["score"], "snippet": hit["snippet"]}
+        for hit in page["hits"] if hit["id"] in invoices
+    ]
+    return {"items": items, "next_cursor": page["next_cursor"], "window_limited": page["window_limited"]}
+
+
+@app.get("/search/stats")
+async def search_stats():
+    """Documents in the full-text index, and how many include their PDF text"""
+    return await asyncio.to_thread(search_index.snapshot)
+
+
+@app.get("/dedup/stats")
+async def dedup_stats():
+    """Mode, threshold and size of the near-duplicate index"""
+    return await asyncio.to_thread(duplicate_index.snapshot)
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Pipeline slots in use, queue depth and estimated wait per priority class, and shed counts"""
+    return admission.snapshot()
+
+
+@app.get("/llm/nodes")
+async def llm_nodes():
+    """Health, circuit state, queue depth and latency of each Ollama node"""
+    return llm_pool.snapshot()
+
+
+@app.get("/llm/prompts")
+async def llm_prompts():
+    """Static system prefixes in use, the current num_ctx, and what each Ollama node has loaded"""
+    return {
+        "version": PROMPT_VERSION,
+        "prefixes": prompt_registry(),
+        "context": context_sizer.snapshot(),
+        "loaded": {node.host: node.loaded for node in llm_pool.nodes},
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and tier sizes for the extraction cache"""
+    return await asyncio.to_thread(extraction_cache.snapshot)
+
+
+@app.delete("/cache/{cache_key}")
+async def invalidate_cache_entry(cache_key: str):
+    """Drop one cached extraction (the cache_key is returned with every result)"""
+    return {"cache_key": cache_key, "removed": await asyncio.to_thread(extraction_cache.invalidate, cache_key)}
+
+
+@app.delete("/cache")
+async def clear_cache():
+    """Drop every cached extraction"""
+    await asyncio.to_thread(extraction_cache.clear)
+    return {"cleared": True}
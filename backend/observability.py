@@ -0,0 +1,240 @@
+import os
+import sys
+import queue
+import logging
+import threading
+import logging.handlers
+
+# -----------------------------------------------------------------------------
+# Logging
+# -----------------------------------------------------------------------------
+#
+# Records go through a QueueHandler, so the request path only appends to an
+# in-memory queue; a background listener thread does the formatting and the
+# stdout writes. Per-request diagnostics are DEBUG and cost nothing at the
+# default INFO level.
+
+LOG_LEVEL = os.getenv("INVOICE_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("invoice_extractor")
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Attach the queue-backed handler to the invoice_extractor logger (idempotent)."""
+    global _listener
+    logger.setLevel(level)
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(
+        "%(asctime)s level=%(levelname)s logger=%(name)s %(message)s"
+    ))
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# -----------------------------------------------------------------------------
+# Metrics (Prometheus text exposition format)
+# -----------------------------------------------------------------------------
+#
+# A deliberately small registry: counters, histograms and callback gauges with
+# labels, rendered in the text format Prometheus scrapes. Values are
+# per-process; with several uvicorn workers, scrape each one or aggregate.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_str(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = _label_str(self.labelnames, key, [("le", _fmt(float(bound)))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = _label_str(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_fmt(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackGauge:
+    """Gauge whose samples are read at scrape time: fn() -> {label tuple: value}."""
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.fn()
+        except Exception:
+            logger.exception("metric=%s callback failed", self.name)
+            return lines
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames, fn):
+        return self.register(CallbackGauge(name, documentation, labelnames, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "invoice_stage_seconds",
+    "Time spent per extraction pipeline stage",
+    ["stage"],
+)
+EXTRACTIONS = REGISTRY.counter(
+    "invoice_extractions_total",
+    "Extraction requests by outcome (ok, parse_error, error, cache_hit)",
+    ["outcome"],
+)
+DOCUMENT_PAGES = REGISTRY.counter("invoice_pages_total", "PDF pages seen by the pipeline")
+DOCUMENT_PAGES_PARSED = REGISTRY.counter("invoice_pages_parsed_total", "PDF pages whose words were parsed")
+DOCUMENT_WORDS = REGISTRY.counter("invoice_words_total", "Words extracted from PDFs")
+DOCUMENT_CHARS = REGISTRY.counter("invoice_text_chars_total", "Characters of text extracted from PDFs")
+DOCUMENT_CONTEXT_CHARS = REGISTRY.counter("invoice_context_chars_total", "Characters of document text sent to the LLM")
+LLM_TOKENS = REGISTRY.counter(
+    "invoice_llm_tokens_total",
+    "LLM tokens reported by Ollama",
+    ["kind"],
+)
+LLM_MODE_RUNS = REGISTRY.counter(
+    "invoice_llm_mode_total",
+    "LLM extractions by prompt mode (single, grouped, grouped_fallback)",
+    ["mode"],
+)
+LLM_PREFILL_SECONDS = REGISTRY.histogram(
+    "invoice_llm_prefill_seconds",
+    "Prompt evaluation time per LLM request, as reported by Ollama",
+)
+LLM_CONTEXT_REQUESTS = REGISTRY.counter(
+    "invoice_llm_context_requests_total",
+    "LLM requests by the num_ctx they were sent with",
+    ["num_ctx"],
+)
+LLM_TRUNCATED = REGISTRY.counter(
+    "invoice_llm_truncated_total",
+    "LLM answers cut off by the adaptive num_predict and asked again with the full budget",
+)
+LINE_ITEM_TABLES = REGISTRY.counter(
+    "invoice_line_item_tables_total",
+    "Layout line-item extraction by outcome (verified, unverified, none)",
+    ["outcome"],
+)
+BOX_LOOKUPS = REGISTRY.counter(
+    "invoice_box_lookups_total",
+    "Fields with a value for which a bounding box was searched",
+    ["field"],
+)
+BOX_HITS = REGISTRY.counter(
+    "invoice_box_hits_total",
+    "Fields for which a bounding box was found",
+    ["field"],
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,177 @@
+import hashlib
+import threading
+
+from context_builder import estimate_tokens
+
+# -----------------------------------------------------------------------------
+# Prompt registry
+# -----------------------------------------------------------------------------
+#
+# The system message is a static prefix per field set: the rules and the field
+# specs, and nothing that changes between requests. Ollama keeps the KV cache
+# of each slot's last prompt and only prefills what comes after the longest
+# shared prefix, so with the per-request instructions and the document moved
+# into the user message, every request with the same field set skips the
+# prefill of the ~1k token system prompt.
+#
+# Any change to the prefix text must bump PROMPT_VERSION: the version is part
+# of the extraction cache and near-duplicate keys, so answers produced under an
+# older prompt are not served for the new one.
+#
+# Requests are sized from a character-count token estimate of what is actually
+# sent: num_predict from the requested fields (and the line item rows the text
+# seems to hold), num_ctx from the prompt plus that answer, rounded up to a few
+# fixed sizes. The KV cache Ollama allocates per slot scales with num_ctx, so
+# small invoices run in a smaller model instance. Ollama reloads a model when
+# num_ctx changes, so ContextSizer grows the size at once but only shrinks it
+# after a run of requests that all fit a smaller one.
+
+PROMPT_VERSION = "2"
+
+PROMPT_RULES = """
+    You are an expert invoice parser. 
+    Given the text of an invoice, extract {scope} and return them as JSON.
+    
+    CRITICAL RULES - READ CAREFULLY:
+    1. Return values EXACTLY as they appear in the PDF text - do not reformat or change anything
+    2. For dates: Copy the EXACT format shown (e.g., "January 25, 2016" NOT "2016-01-25")
+    3. For addresses: Only include address lines, NOT other fields mixed in
+    4. For amounts: Include currency symbol if present (e.g., "$93.50" not "93.50")
+    5. Do NOT include field labels in the values (e.g., "Invoice Number: INV-123" should return "INV-123" only)
+    6. If you cannot find a value for any field, return null (not empty string)
+    
+    REQUIRED FIELDS - Extract {which}:
+    """
+
+FIELD_PROMPTS = {
+    "invoice_number": """invoice_number: The unique invoice/bill identifier (e.g., "INV-123", "F2019-0006224", "Bill #456"). 
+       Look for: Invoice Number, Invoice #, Bill Number, Reference Number, Document Number.
+       Return ONLY the number, NOT the label.""",
+    "invoice_date": """invoice_date: The date when the invoice was issued (EXACTLY as shown in PDF).
+       Look for: Invoice Date, Issue Date, Date, Billing Date.
+       Return the date in the EXACT format found in PDF (e.g., "January 25, 2016").
+       NOT a date range, service period, or due date.""",
+    "due_date": """due_date: The payment due date (EXACTLY as shown in PDF).
+       Look for: Due Date, Payment Due, Pay By Date, Payment Deadline.
+       Return in the EXACT format found in PDF (e.g., "January 31, 2016").""",
+    "vendor_name": """vendor_name: The company/person issuing the invoice (the seller/service provider). Name ONLY.
+       Look for: From, Vendor, Supplier, Billed By, Company Name (at the top/header).
+       Do NOT include order numbers or other information.""",
+    "vendor_address": """vendor_address: The FULL address of the vendor/supplier (address lines ONLY).
+       Look for: Address, Street, City, Postal Code, Country (near vendor name).
+       Include complete address with street, city, zip/postal code.
+       Do NOT include dates, invoice numbers, or other fields mixed in.""",
+    "purchase_order": """purchase_order: Purchase Order number if mentioned (e.g., "PO-12345", "PO#456").
+       Look for: PO, Purchase Order, PO Number, Order Number, Reference.
+       Return ONLY the number, NOT the label.""",
+    "account_number": """account_number: Customer account number or bank account if mentioned (e.g., "ACC # 1234 1234 BSB # 4321 432").
+       Look for: Account Number, Customer ID, Client Number, Account #, ACC #, BSB #.
+       Return the COMPLETE account info including "ACC" and "BSB" labels.""",
+    "line_items": """line_items: List of items/services with descriptions and amounts.
+       Extract as an array of objects with: description, quantity, unit_price, amount.""",
+    "total_amount": """total_amount: The final TOTAL amount to be paid (with currency symbol if present, e.g., "$1500.00").
+       Look for: Total, Grand Total, Amount Due, Final Amount, Balance Due.
+       Include currency symbol if shown.""",
+    "currency": """currency: The currency symbol (e.g., "$", "€", "£") or code if explicitly written.
+       Look for: Currency symbols or currency codes.
+       Return ONLY the symbol or code.""",
+}
+
+# Upper bound on the answer tokens per field (key, quotes and value), before
+# PREDICT_MARGIN; line items add LINE_ITEM_TOKENS per expected row
+FIELD_ANSWER_TOKENS = {
+    "invoice_number": 16,
+    "invoice_date": 16,
+    "due_date": 16,
+    "vendor_name": 24,
+    "vendor_address": 48,
+    "purchase_order": 16,
+    "account_number": 24,
+    "line_items": 16,
+    "total_amount": 12,
+    "currency": 8,
+}
+LINE_ITEM_TOKENS = 60
+PREDICT_MARGIN = 1.25
+PREDICT_OVERHEAD_TOKENS = 16
+
+
+_PREFIXES = {}
+
+
+def system_prefix(name, fields=None):
+    """
+    The static system message for one field set ("all" when fields is None):
+    {"id", "version", "fields", "text", "sha256", "tokens"}. Built once per process.
+    """
+    key = (name, fields)
+    if key in _PREFIXES:
+        return _PREFIXES[key]
+    if fields is None:
+        text = PROMPT_RULES.format(scope="ALL key details", which="all of these")
+        fields = tuple(FIELD_PROMPTS)
+    else:
+        text = PROMPT_RULES.format(scope="ONLY the fields listed below", which="only these, no other keys")
+    for number, field in enumerate(fields, 1):
+        text += f"\n    {number}. {FIELD_PROMPTS[field]}\n    "
+    prefix = _PREFIXES[key] = {
+        "id": f"v{PROMPT_VERSION}/{name}",
+        "version": PROMPT_VERSION,
+        "fields": fields,
+        "text": text,
+        "sha256": hashlib.sha256(text.encode()).hexdigest()[:16],
+        "tokens": estimate_tokens(text),
+    }
+    return prefix
+
+
+def user_message(text, custom_prompt):
+    """The per-request part: instructions first, so requests with the same instructions share them too."""
+    return f"Additional instructions: {custom_prompt}\n\nInvoice text:\n{text}"
+
+
+def answer_budget(fields, expected_items=0):
+    """Tokens the JSON answer for `fields` may need, with expected_items line item rows."""
+    tokens = sum(FIELD_ANSWER_TOKENS[field] for field in fields)
+    if "line_items" in fields:
+        tokens += expected_items * LINE_ITEM_TOKENS
+    return int(tokens * PREDICT_MARGIN) + PREDICT_OVERHEAD_TOKENS
+
+
+def prompt_registry():
+    """Every prefix built so far, without its text."""
+    return [{key: value for key, value in prefix.items() if key != "text"} for prefix in _PREFIXES.values()]
+
+
+class ContextSizer:
+    def __init__(self, sizes, shrink_after):
+        self.sizes = tuple(sorted(set(sizes)))
+        self.shrink_after = max(1, shrink_after)
+        self.current = self.sizes[0]
+        self._smaller = 0
+        self._smaller_max = 0
+        self._lock = threading.Lock()
+
+    def fit(self, tokens):
+        """Smallest size holding `tokens` (the largest size if none does)."""
+        return next((size for size in self.sizes if size >= tokens), self.sizes[-1])
+
+    def choose(self, tokens):
+        """num_ctx for a request needing `tokens` of prompt plus answer."""
+        size = self.fit(tokens)
+        with self._lock:
+            if size > self.current:
+                self.current = size
+                self._smaller = 0
+            elif size < self.current:
+                self._smaller += 1
+                self._smaller_max = size if self._smaller == 1 else max(self._smaller_max, size)
+                if self._smaller >= self.shrink_after:
+                    self.current = self._smaller_max
+                    self._smaller = 0
+            else:
+                self._smaller = 0
+            return self.current
+
+    def snapshot(self):
+        return {"sizes": list(self.sizes), "current": self.current, "shrink_after": self.shrink_after}
@@ -1,14 +1,53 @@
 """
 Helper script to run the FastAPI backend server
-Usage: python run.py
+Usage:
+    python run.py                 development: one worker, debug logging
+    python run.py --production    INVOICE_SERVE_WORKERS workers, INVOICE_LOG_LEVEL logging
+    python run.py --check         import the app once and exit (deploy smoke test)
 """
+import os
+import argparse
+import importlib
+
 import uvicorn
 
+SERVE_HOST = os.getenv("INVOICE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("INVOICE_PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("INVOICE_SERVE_WORKERS", "2"))
+# Seconds in-flight requests get to finish when a worker is told to stop
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("INVOICE_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=False,
-        log_level="debug"
-    )
+    parser = argparse.ArgumentParser(description="Run the invoice extractor API")
+    parser.add_argument("--production", action="store_true",
+                        help="several worker processes, no debug logging; route traffic on GET /ready")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--check", action="store_true",
+                        help="import the app (settings, stores, PDF pool) and exit; non-zero if that fails")
+    args = parser.parse_args()
+
+    if args.check:
+        importlib.import_module("main")
+        print("main:app imports cleanly")
+    elif not args.production:
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            reload=False,
+            log_level="debug"
+        )
+    else:
+        from observability import LOG_LEVEL
+
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=max(1, args.workers),
+            log_level=LOG_LEVEL.lower(),
+            proxy_headers=True,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+        )
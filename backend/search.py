@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+from extraction_cache import CACHE_DIR
+from invoices import encode_cursor, decode_cursor
+from observability import REGISTRY
+
+# -----------------------------------------------------------------------------
+# Full-text search over stored invoices
+# -----------------------------------------------------------------------------
+#
+# One SQLite FTS5 row per invoice (rowid = invoice id): its id, case and file name,
+# the cleaned fields in their own columns, and the full PDF text. Rows are
+# rewritten whenever the invoice changes; the PDF text is only re-read when the
+# invoice's PDF is not the one already indexed, so re-extracting or editing
+# fields costs one row write.
+#
+# Query syntax (terms are ANDed):
+#   acme              word                "net 30"        phrase
+#   acme*             prefix              -draft          exclude
+#   po:4500*          field-scoped, with the field names in FIELD_ALIASES
+#
+# Results are ranked by BM25 with identifiers weighted above body text and
+# paginated with a cursor carrying the last hit's (rank, id). BM25 has to score
+# every match before the top ones are known, which is what makes a query like
+# "invoice" slow on a large index. A query matching more than RANK_WINDOW
+# invoices therefore ranks only the newest RANK_WINDOW of them (the response
+# says so with "window_limited"); narrower queries rank everything.
+
+SEARCH_COLUMNS = (
+    "case_name", "vendor", "invoice_number", "purchase_order", "account_number",
+    "vendor_address", "line_items", "other", "text",
+)
+# BM25 weight per column, same order: an identifier hit beats a body-text hit
+COLUMN_WEIGHTS = (3.0, 5.0, 10.0, 10.0, 10.0, 2.0, 1.5, 2.0, 1.0)
+
+FIELD_ALIASES = {
+    "case": "case_name", "case_name": "case_name", "file": "case_name",
+    "vendor": "vendor", "vendor_name": "vendor",
+    "number": "invoice_number", "invoice": "invoice_number", "invoice_number": "invoice_number",
+    "po": "purchase_order", "purchase_order": "purchase_order",
+    "account": "account_number", "account_number": "account_number",
+    "address": "vendor_address", "vendor_address": "vendor_address",
+    "items": "line_items", "line_items": "line_items",
+    "date": "other", "total": "other", "currency": "other",
+    "text": "text",
+}
+
+SEARCH_PAGE_SIZE_DEFAULT = 20
+SEARCH_PAGE_SIZE_MAX = 100
+RANK_WINDOW = int(os.getenv("INVOICE_SEARCH_RANK_WINDOW", "5000"))
+SNIPPET_TOKENS = 12
+# Matched terms in snippets are wrapped in these
+HIGHLIGHT = ("[", "]")
+
+TERM_RE = re.compile(r'(-?)(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+
+def _phrase(value, prefix=False):
+    """FTS5 string for one user term, or None if it has nothing searchable."""
+    if prefix:
+        value = value.rstrip("*")
+    if not re.search(r"\w", value):
+        return None
+    quoted = '"' + value.replace('"', '""') + '"'
+    return quoted + "*" if prefix else quoted
+
+
+def build_match(query, prefix_last=False):
+    """
+    FTS5 MATCH expression for a user query (see the syntax above). Everything is
+    quoted, so FTS operators typed by the user are searched for as words.
+    With prefix_last, the final plain term also matches as a prefix (type-ahead).
+    Raises ValueError for a query without any positive term.
+    """
+    terms = []
+    for m in TERM_RE.finditer(query or ""):
+        negate, field, phrase, word = m.group(1) == "-", m.group(2), m.group(3), m.group(4)
+        column = FIELD_ALIASES.get(field.lower()) if field else None
+        if field and column is None:
+            # Not a field we know ("12:30", "re:"): search the whole token
+            word = f"{field}:{word}" if word is not None else f'{field}:"{phrase}"'
+            phrase = None
+        if phrase is not None:
+            expr = _phrase(phrase)
+        else:
+            expr = _phrase(word, prefix=word.endswith("*") and len(word) > 1)
+        if expr is None:
+            continue
+        terms.append({"expr": expr, "column": column, "negate": negate, "plain": phrase is None})
+
+    positive = [t for t in terms if not t["negate"]]
+    if not positive:
+        raise ValueError("Search query needs at least one term that is not excluded")
+    last = positive[-1]
+    if prefix_last and last["plain"] and not last["expr"].endswith("*"):
+        last["expr"] += "*"
+
+    def render(term):
+        return f"{term['column']} : {term['expr']}" if term["column"] else term["expr"]
+
+    match = " AND ".join(render(t) for t in positive)
+    for term in terms:
+        if term["negate"]:
+            match = f"({match}) NOT {render(term)}"
+    return match
+
+
+def _join(value):
+    """Searchable text for one field value (line items flatten to their cell values)."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return " ".join(_join(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(_join(v) for v in value)
+    return str(value)
+
+
+def document_columns(invoice):
+    """Column values for one invoice (InvoiceStore row)."""
+    fields = invoice.get("fields") or {}
+    return {
+        # The id too, so "1042" finds case #1042
+        "case_name": " ".join(str(v) for v in (invoice["id"], invoice.get("case_name"), invoice.get("file_name")) if v),
+        "vendor": _join(fields.get("vendor_name")),
+        "invoice_number": _join(fields.get("invoice_number")),
+        "purchase_order": _join(fields.get("purchase_order")),
+        "account_number": _join(fields.get("account_number")),
+        "vendor_address": _join(fields.get("vendor_address")),
+        "line_items": _join(fields.get("line_items")),
+        "other": " ".join(_join(fields.get(f)) for f in ("invoice_date", "due_date", "total_amount", "currency")),
+    }
+
+
+class SearchIndex:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "search.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoice_fts'"
+            ).fetchone()
+            if not exists:
+                conn.execute(
+                    f"CREATE VIRTUAL TABLE invoice_fts USING fts5({', '.join(SEARCH_COLUMNS)},"
+                    " tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+                )
+                weights = ", ".join(str(w) for w in COLUMN_WEIGHTS)
+                conn.execute("INSERT INTO invoice_fts(invoice_fts, rank) VALUES ('rank', ?)", (f"bm25({weights})",))
+            # Which PDF (by content hash) each invoice's indexed text came from
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS indexed ("
+                " id INTEGER PRIMARY KEY,"
+                " text_sha256 TEXT,"
+                " indexed_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def needs_text(self, invoice):
+        """Is the invoice's PDF text missing from the index or from another PDF?"""
+        with self._lock:
+            row = self._db().execute("SELECT text_sha256 FROM indexed WHERE id = ?", (invoice["id"],)).fetchone()
+        return row is None or row[0] is None or row[0] != invoice.get("content_sha256")
+
+    def index(self, invoice, text=None):
+        """
+        (Re)index one invoice (InvoiceStore row). text is the PDF's full text;
+        None keeps whatever text is already indexed for it.
+        """
+        columns = document_columns(invoice)
+        started = time.perf_counter()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                text_sha256 = invoice.get("content_sha256")
+                if text is None:
+                    row = db.execute(
+                        "SELECT f.text, i.text_sha256 FROM invoice_fts f JOIN indexed i ON i.id = f.rowid"
+                        " WHERE f.rowid = ?", (invoice["id"],)
+                    ).fetchone()
+                    text, text_sha256 = row if row else ("", None)
+                db.execute("DELETE FROM invoice_fts WHERE rowid = ?", (invoice["id"],))
+                db.execute(
+                    f"INSERT INTO invoice_fts(rowid, {', '.join(SEARCH_COLUMNS)})"
+                    f" VALUES (?, {', '.join('?' for _ in SEARCH_COLUMNS)})",
+                    [invoice["id"]] + [columns[c] for c in SEARCH_COLUMNS[:-1]] + [text or ""],
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO indexed (id, text_sha256, indexed_at) VALUES (?, ?, ?)",
+                    (invoice["id"], text_sha256 if text else None, time.time()),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        SEARCH_SECONDS.observe(time.perf_counter() - started, op="index")
+
+    def remove(self, invoice_id):
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM invoice_fts WHERE rowid = ?", (invoice_id,))
+            db.execute("DELETE FROM indexed WHERE id = ?", (invoice_id,))
+            db.execute("COMMIT")
+
+    def indexed_ids(self):
+        with self._lock:
+            return {row[0] for row in self._db().execute("SELECT id FROM indexed")}
+
+    def search(self, query, limit=SEARCH_PAGE_SIZE_DEFAULT, cursor=None, prefix_last=False):
+        """
+        One page of hits, best first:
+        {"hits": [{"id", "score", "snippet"}], "next_cursor", "window_limited"}.
+        score is BM25 (higher is better). Raises ValueError for an empty query or a bad cursor.
+        """
+        match = build_match(query, prefix_last)
+        limit = max(1, min(int(limit), SEARCH_PAGE_SIZE_MAX))
+        floor = None
+        after = None
+        if cursor:
+            position, last_id = decode_cursor(cursor)
+            if (not isinstance(position, list) or len(position) != 2
+                    or not isinstance(position[0], (int, float)) or not isinstance(position[1], (int, type(None)))):
+                raise ValueError("Invalid cursor")
+            (rank, floor), after = position, (position[0], last_id)
+
+        started = time.perf_counter()
+        with self._lock:
+            db = self._db()
+            try:
+                if not cursor and RANK_WINDOW > 0:
+                    # Lowest id among the newest RANK_WINDOW matches, if there are more
+                    row = db.execute(
+                        "SELECT rowid FROM invoice_fts WHERE invoice_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                        (match, RANK_WINDOW),
+                    ).fetchone()
+                    floor = row[0] + 1 if row else None
+                sql = (
+                    "SELECT rowid, rank, snippet(invoice_fts, -1, ?, ?, '…', ?) FROM invoice_fts"
+                    " WHERE invoice_fts MATCH ?"
+                )
+                args = [HIGHLIGHT[0], HIGHLIGHT[1], SNIPPET_TOKENS, match]
+                if floor is not None:
+                    sql += " AND rowid >= ?"
+                    args.append(floor)
+                if after is not None:
+                    sql += " AND (rank > ? OR (rank = ? AND rowid > ?))"
+                    args += [after[0], after[0], after[1]]
+                sql += " ORDER BY rank, rowid LIMIT ?"
+                args.append(limit + 1)
+                rows = db.execute(sql, args).fetchall()
+            except sqlite3.OperationalError as ex:
+                raise ValueError(f"Invalid search query: {ex}") from ex
+        SEARCH_SECONDS.observe(time.perf_counter() - started, op="query")
+
+        hits = [{"id": row[0], "score": round(-row[1], 4), "snippet": row[2]} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor([[last[1], floor], last[0]])
+        return {"hits": hits, "next_cursor": next_cursor, "window_limited": floor is not None}
+
+    def snapshot(self):
+        with self._lock:
+            db = self._db()
+            documents = db.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+            with_text = db.execute("SELECT COUNT(*) FROM indexed WHERE text_sha256 IS NOT NULL").fetchone()[0]
+        return {"documents": documents, "with_text": with_text, "path": self.path}
+
+
+SEARCH_SECONDS = REGISTRY.histogram(
+    "invoice_search_seconds",
+    "Full-text index time per operation (query, index)",
+    ["op"],
+)
@@ -0,0 +1,547 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import Counter
+
+import numpy as np
+
+from extraction_cache import CACHE_DIR
+
+# -----------------------------------------------------------------------------
+# Vendor layout templates
+# -----------------------------------------------------------------------------
+#
+# Recurring vendors send the same layout every time. After an LLM extraction we
+# remember, per vendor, where each field's value sat on the page and which word
+# labels it (the anchor). The next invoice whose first-page layout matches is
+# read straight from those regions; the LLM is only called when the template
+# is not confident.
+#
+# Fingerprint: the set of alphabetic words in the top part of page 1 with their
+# coarse position. Numbers change per invoice and are left out, so two invoices
+# from one vendor share most features. Templates are matched through an inverted
+# feature index by overlap (shared / smaller set): a template keeps only the
+# features all its samples shared, so it is a subset of each new invoice rather
+# than equal to it.
+#
+# A field is trusted once TEMPLATE_MIN_SAMPLES extractions agreed on its region.
+
+TEMPLATE_MIN_SIMILARITY = float(os.getenv("INVOICE_TEMPLATE_MIN_SIMILARITY", "0.7"))
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("INVOICE_TEMPLATE_MIN_CONFIDENCE", "0.7"))
+TEMPLATE_MIN_SAMPLES = int(os.getenv("INVOICE_TEMPLATE_MIN_SAMPLES", "2"))
+
+FINGERPRINT_TOP = 0.3
+FINGERPRINT_GRID = (10, 20)
+MIN_FEATURES = 8
+ANCHOR_MAX_DISTANCE = 0.15
+
+_ALPHA_RE = re.compile(r"^[^\w]*([a-z]{3,})[^\w]*$")
+_SHAPE_RE = ((re.compile(r"\d+"), "9"), (re.compile(r"[^\W\d_]+"), "a"), (re.compile(r"\s+"), " "))
+
+
+def fingerprint(geometry, page_w, page_h):
+    """Layout features of a first page: 'word@col,row' for alphabetic words near the top."""
+    features = set()
+    if geometry is None or not len(geometry):
+        return features
+    cx = (geometry.x0 + geometry.x1) / 2 / max(page_w, 1)
+    cy = (geometry.top + geometry.bottom) / 2 / max(page_h, 1)
+    cols, rows = FINGERPRINT_GRID
+    for i in np.flatnonzero(cy <= FINGERPRINT_TOP):
+        match = _ALPHA_RE.match(geometry.text[i].lower())
+        if match:
+            features.add(f"{match.group(1)}@{int(cx[i] * cols)},{int(cy[i] * rows)}")
+    return features
+
+
+def value_shape(value):
+    """'INV-20417' -> 'a-9', 'January 25, 2016' -> 'a 9, 9'."""
+    shape = str(value).strip()
+    for pattern, repl in _SHAPE_RE:
+        shape = pattern.sub(repl, shape)
+    return shape
+
+
+def _shape_score(learned, value):
+    if value_shape(value) == learned:
+        return 1.0
+    # Same kind of value (has digits or not) but a different shape
+    return 0.8 if ("9" in learned) == any(ch.isdigit() for ch in value) else 0.4
+
+
+def _norm(text):
+    return str(text).strip().lower()
+
+
+def _line_height(geometry, indexes):
+    heights = geometry.bottom[indexes] - geometry.top[indexes]
+    return float(np.median(heights)) if len(heights) else 10.0
+
+
+def read_region(geometry, region, page_w, page_h):
+    """
+    Word indexes making up the value in a normalized region {x, y, width, height}
+    (top-left origin). Words whose centre lies in the region seed each line; the
+    line then extends rightwards while the gaps stay word-sized, since values
+    vary in length between invoices.
+    """
+    if geometry is None or not len(geometry):
+        return np.empty(0, dtype=np.intp)
+    x0 = region["x"] * page_w
+    x1 = (region["x"] + region["width"]) * page_w
+    top = region["y"] * page_h
+    bottom = (region["y"] + region["height"]) * page_h
+    cx = (geometry.x0 + geometry.x1) / 2
+    cy = (geometry.top + geometry.bottom) / 2
+    tol_y = max(2.0, (bottom - top) * 0.15)
+    seeds = np.flatnonzero((cx >= x0 - 2) & (cx <= x1 + 2) & (cy >= top - tol_y) & (cy <= bottom + tol_y))
+    if seeds.size == 0:
+        return seeds
+
+    height = _line_height(geometry, seeds)
+    picked = set(seeds.tolist())
+    for line_cy in np.unique(np.round(cy[seeds] / (height / 2))):
+        on_line = np.flatnonzero(np.abs(cy - line_cy * height / 2) <= height / 2)
+        on_line = on_line[np.argsort(geometry.x0[on_line])]
+        right = max(geometry.x1[i] for i in on_line if i in picked) if any(i in picked for i in on_line) else None
+        if right is None:
+            continue
+        for i in on_line:
+            if i in picked or geometry.x0[i] < right:
+                continue
+            if geometry.x0[i] - right > 1.2 * height:
+                break
+            picked.add(int(i))
+            right = geometry.x1[i]
+    indexes = np.fromiter(picked, dtype=np.intp)
+    return indexes[np.lexsort((geometry.x0[indexes], np.round(cy[indexes] / height)))]
+
+
+def _region_of(geometry, indexes, page_w, page_h):
+    """Tight normalized region of the given words (no padding)."""
+    x0 = geometry.x0[indexes].min()
+    x1 = geometry.x1[indexes].max()
+    top = geometry.top[indexes].min()
+    bottom = geometry.bottom[indexes].max()
+    return {
+        "x": float(x0 / page_w),
+        "y": float(top / page_h),
+        "width": float((x1 - x0) / page_w),
+        "height": float((bottom - top) / page_h),
+    }
+
+
+def _covers_value(texts, value):
+    """Do the boxed words spell (most of) the value? Guards against boxes on a stray substring match."""
+    value_key = re.sub(r"\W", "", str(value).lower())
+    words_key = re.sub(r"\W", "", "".join(str(t) for t in texts).lower())
+    return bool(words_key) and words_key in value_key and len(words_key) >= 0.6 * len(value_key)
+
+
+def _find_anchor(geometry, indexes, page_w, page_h):
+    """Nearest word left of the value on its line, else the nearest word above it."""
+    chosen = set(indexes.tolist())
+    vx0 = geometry.x0[indexes].min()
+    vx1 = geometry.x1[indexes].max()
+    vtop = geometry.top[indexes].min()
+    first_line_bottom = geometry.bottom[indexes[0]]
+    height = _line_height(geometry, indexes)
+    cy = (geometry.top + geometry.bottom) / 2
+
+    others = np.array([i for i in range(len(geometry)) if i not in chosen], dtype=np.intp)
+    if others.size == 0:
+        return None
+    left = others[(cy[others] >= vtop) & (cy[others] <= first_line_bottom) &
+                  (geometry.x1[others] <= vx0 + 1) & (vx0 - geometry.x1[others] <= 0.4 * page_w)]
+    if left.size:
+        anchor = left[np.argmax(geometry.x1[left])]
+    else:
+        above = others[(geometry.bottom[others] <= vtop + 1) & (vtop - geometry.bottom[others] <= 3 * height) &
+                       (geometry.x1[others] >= vx0) & (geometry.x0[others] <= vx1)]
+        if not above.size:
+            return None
+        anchor = above[np.argmax(geometry.bottom[above])]
+    if not _norm(geometry.text[anchor]):
+        return None
+    return {
+        "text": _norm(geometry.text[anchor]),
+        "dx": float((vx0 - geometry.x0[anchor]) / page_w),
+        "dy": float((vtop - geometry.top[anchor]) / page_h),
+    }
+
+
+def _value_words(pages, value, last=False):
+    """
+    (page_index, word indexes) of a run of consecutive words spelling the value,
+    ignoring punctuation and spacing; the first occurrence, or the last with last=True.
+    """
+    key = re.sub(r"\W", "", str(value).lower())
+    if not key:
+        return None
+    found = None
+    for page_index, page in enumerate(pages):
+        geometry = page.get("words")
+        if geometry is None:
+            continue
+        norm = [re.sub(r"\W", "", str(t).lower()) for t in geometry.text]
+        for i, word in enumerate(norm):
+            if not word or not key.startswith(word):
+                continue
+            spelled = word
+            j = i
+            while len(spelled) < len(key) and j + 1 < len(norm):
+                j += 1
+                spelled += norm[j]
+            if spelled == key:
+                found = (page_index, np.arange(i, j + 1))
+                if not last:
+                    return found
+    return found
+
+
+def _similarity(shared, a, b):
+    return shared / max(1, min(len(a), len(b)))
+
+
+def _iou(a, b):
+    ix = max(0.0, min(a["x"] + a["width"], b["x"] + b["width"]) - max(a["x"], b["x"]))
+    iy = max(0.0, min(a["y"] + a["height"], b["y"] + b["height"]) - max(a["y"], b["y"]))
+    inter = ix * iy
+    union = a["width"] * a["height"] + b["width"] * b["height"] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class TemplateStore:
+    """Vendor templates in SQLite (shared between workers), mirrored in memory for matching."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "templates.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._templates = {}
+        self._index = {}
+        self._data_version = None
+        self.stats = {"hits": 0, "low_confidence": 0, "misses": 0, "learned": 0}
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vendor_templates ("
+                " id TEXT PRIMARY KEY,"
+                " vendor_name TEXT,"
+                " features TEXT NOT NULL,"
+                " fields TEXT NOT NULL,"
+                " seen TEXT NOT NULL DEFAULT '{}',"
+                " samples INTEGER NOT NULL,"
+                " uses INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _refresh(self):
+        """Reload from SQLite when another connection (worker) changed it. Caller holds the lock."""
+        db = self._db()
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        self._templates = {}
+        self._index = {}
+        for tid, vendor, features, fields, seen, samples, uses in db.execute(
+            "SELECT id, vendor_name, features, fields, seen, samples, uses FROM vendor_templates"
+        ):
+            self._add(tid, {
+                "vendor_name": vendor,
+                "features": set(json.loads(features)),
+                "fields": json.loads(fields),
+                "seen": json.loads(seen),
+                "samples": samples,
+                "uses": uses,
+            })
+
+    def _add(self, tid, template):
+        old = self._templates.get(tid)
+        if old is not None:
+            for feature in old["features"]:
+                self._index.get(feature, set()).discard(tid)
+        self._templates[tid] = template
+        for feature in template["features"]:
+            self._index.setdefault(feature, set()).add(tid)
+
+    def _save(self, tid, template, created=False):
+        now = time.time()
+        db = self._db()
+        if created:
+            db.execute(
+                "INSERT INTO vendor_templates (id, vendor_name, features, fields, seen, samples, uses, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (tid, template["vendor_name"], json.dumps(sorted(template["features"])),
+                 json.dumps(template["fields"]), json.dumps(template["seen"]), template["samples"],
+                 template["uses"], now, now),
+            )
+        else:
+            db.execute(
+                "UPDATE vendor_templates SET vendor_name = ?, features = ?, fields = ?, seen = ?, samples = ?,"
+                " updated_at = ? WHERE id = ?",
+                (template["vendor_name"], json.dumps(sorted(template["features"])),
+                 json.dumps(template["fields"]), json.dumps(template["seen"]), template["samples"], now, tid),
+            )
+        db.commit()
+
+    def match(self, features):
+        """(template_id, template, similarity) of the most similar template, or None."""
+        if len(features) < MIN_FEATURES:
+            return None
+        with self._lock:
+            self._refresh()
+            overlap = Counter()
+            for feature in features:
+                for tid in self._index.get(feature, ()):
+                    overlap[tid] += 1
+            best = None
+            for tid, shared in overlap.items():
+                template = self._templates[tid]
+                similarity = _similarity(shared, features, template["features"])
+                if similarity >= TEMPLATE_MIN_SIMILARITY and (best is None or similarity > best[2]):
+                    best = (tid, template, similarity)
+            return best
+
+    def extract(self, pages, features=None):
+        """
+        Read the trusted fields of the matching template from the pages.
+        Returns None when no template matches, else a dict with template_id,
+        similarity, confidence (the weakest field's), fields {api_field: value},
+        field_confidence and regions {api_field: (page_index, word indexes)}.
+        A field this vendor usually fills but the template cannot locate yet
+        counts as confidence 0, so the template never answers with less than
+        the LLM would.
+        """
+        first = pages[0]
+        if features is None:
+            features = fingerprint(first.get("words"), first.get("width", 1), first.get("height", 1))
+        found = self.match(features)
+        if found is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        tid, template, similarity = found
+
+        fields = {}
+        confidence = {}
+        regions = {}
+        for api_field, count in template["seen"].items():
+            if count * 2 >= template["samples"]:
+                confidence[api_field] = 0.0
+        for api_field, spec in template["fields"].items():
+            if spec["hits"] < TEMPLATE_MIN_SAMPLES:
+                continue
+            page_index = spec["page"]
+            if page_index >= len(pages) or pages[page_index].get("words") is None:
+                confidence[api_field] = 0.0
+                continue
+            page = pages[page_index]
+            geometry = page["words"]
+            page_w = max(page.get("width", 1), 1)
+            page_h = max(page.get("height", 1), 1)
+
+            region, located = self._locate(geometry, spec, page_w, page_h)
+            indexes = read_region(geometry, region, page_w, page_h)
+            if indexes.size == 0:
+                confidence[api_field] = 0.0
+                continue
+            value = " ".join(str(t) for t in geometry.texts(indexes))
+            fields[api_field] = value
+            regions[api_field] = (page_index, indexes)
+            confidence[api_field] = round((1.0 if located else 0.8) * _shape_score(spec["shape"], value), 3)
+
+        overall = min(confidence.values()) if confidence else 0.0
+        with self._lock:
+            self.stats["hits" if overall >= TEMPLATE_MIN_CONFIDENCE else "low_confidence"] += 1
+        return {
+            "template_id": tid,
+            "vendor_name": template["vendor_name"],
+            "similarity": round(similarity, 3),
+            "confidence": round(overall, 3),
+            "fields": fields,
+            "field_confidence": confidence,
+            "regions": regions,
+        }
+
+    def _locate(self, geometry, spec, page_w, page_h):
+        """Region for a field: relative to its anchor word if present near the learned spot."""
+        region = spec["region"]
+        anchor = spec.get("anchor")
+        if not anchor:
+            return region, False
+        expected_x = (region["x"] - anchor["dx"]) * page_w
+        expected_y = (region["y"] - anchor["dy"]) * page_h
+        best = None
+        for i, text in enumerate(geometry.text):
+            if _norm(text) != anchor["text"]:
+                continue
+            distance = max(abs(geometry.x0[i] - expected_x) / page_w, abs(geometry.top[i] - expected_y) / page_h)
+            if distance <= ANCHOR_MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, i)
+        if best is None:
+            return region, False
+        i = best[1]
+        return {
+            **region,
+            "x": float(geometry.x0[i] / page_w + anchor["dx"]),
+            "y": float(geometry.top[i] / page_h + anchor["dy"]),
+        }, True
+
+    def _boxed_words(self, pages, box, value):
+        """Word indexes inside a find_boxes_for_fields box, if they really spell the value."""
+        page_index = box["page"] - 1
+        page = pages[page_index] if page_index < len(pages) else None
+        geometry = page.get("words") if page else None
+        if geometry is None or not len(geometry):
+            return None
+        page_w = max(page.get("width", 1), 1)
+        page_h = max(page.get("height", 1), 1)
+        cx = (geometry.x0 + geometry.x1) / 2 / page_w
+        cy = (geometry.top + geometry.bottom) / 2 / page_h
+        indexes = np.flatnonzero(
+            (cx >= box["x"]) & (cx <= box["x"] + box["width"]) &
+            (cy >= box["y"]) & (cy <= box["y"] + box["height"])
+        )
+        if indexes.size == 0:
+            return None
+        indexes = indexes[np.lexsort((geometry.x0[indexes], geometry.top[indexes]))]
+        if not _covers_value(geometry.texts(indexes), value):
+            return None
+        return page_index, indexes
+
+    def learn(self, pages, values, boxes_by_field, vendor_name=None, features=None):
+        """
+        Update (or create) the template for this layout from an LLM extraction:
+        values {api_field: value} for every field the LLM filled, and
+        boxes_by_field {api_field: box} as produced by find_boxes_for_fields.
+        A field without a usable box is located by spelling its value in the
+        words. Returns the template id, or None if the page has too little
+        layout to fingerprint.
+        """
+        first = pages[0]
+        if features is None:
+            features = fingerprint(first.get("words"), first.get("width", 1), first.get("height", 1))
+        if len(features) < MIN_FEATURES:
+            return None
+
+        learned = {}
+        for api_field, value in values.items():
+            box = boxes_by_field.get(api_field)
+            located = self._boxed_words(pages, box, value) if box else None
+            if located is None:
+                # Totals are repeated (subtotal/total/amount due); the last one is the final amount
+                located = _value_words(pages, value, last=api_field == "total_amount")
+            if located is None:
+                continue
+            page_index, indexes = located
+            page = pages[page_index]
+            geometry = page["words"]
+            page_w = max(page.get("width", 1), 1)
+            page_h = max(page.get("height", 1), 1)
+            learned[api_field] = {
+                "page": page_index,
+                "region": _region_of(geometry, indexes, page_w, page_h),
+                "anchor": _find_anchor(geometry, indexes, page_w, page_h),
+                "shape": value_shape(values.get(api_field, "")),
+                "hits": 1,
+            }
+        if not learned:
+            return None
+
+        with self._lock:
+            self._refresh()
+            found = None
+            overlap = Counter(tid for f in features for tid in self._index.get(f, ()))
+            for tid, shared in overlap.items():
+                similarity = _similarity(shared, features, self._templates[tid]["features"])
+                if similarity >= TEMPLATE_MIN_SIMILARITY and (found is None or similarity > found[1]):
+                    found = (tid, similarity)
+
+            if found is None:
+                tid = uuid.uuid4().hex[:16]
+                template = {
+                    "vendor_name": vendor_name,
+                    "features": set(features),
+                    "fields": learned,
+                    "seen": {api_field: 1 for api_field in values},
+                    "samples": 1,
+                    "uses": 0,
+                }
+                self._save(tid, template, created=True)
+            else:
+                tid = found[0]
+                old = self._templates[tid]
+                fields = dict(old["fields"])
+                for api_field, spec in learned.items():
+                    previous = fields.get(api_field)
+                    # Same place as before: one more agreeing sample
+                    if previous and previous["page"] == spec["page"] and _iou(previous["region"], spec["region"]) >= 0.3:
+                        spec["hits"] = previous["hits"] + 1
+                    fields[api_field] = spec
+                # Keep the layout words every sample shares, unless that leaves too few
+                shared = old["features"] & features
+                seen = dict(old["seen"])
+                for api_field in values:
+                    seen[api_field] = seen.get(api_field, 0) + 1
+                template = {
+                    "vendor_name": vendor_name or old["vendor_name"],
+                    "features": shared if len(shared) >= MIN_FEATURES else set(features),
+                    "fields": fields,
+                    "seen": seen,
+                    "samples": old["samples"] + 1,
+                    "uses": old["uses"],
+                }
+                self._save(tid, template)
+            self._add(tid, template)
+            self.stats["learned"] += 1
+            return tid
+
+    def record_use(self, tid):
+        with self._lock:
+            template = self._templates.get(tid)
+            if template is not None:
+                template["uses"] += 1
+            self._db().execute("UPDATE vendor_templates SET uses = uses + 1 WHERE id = ?", (tid,))
+            self._db().commit()
+
+    def list(self):
+        with self._lock:
+            self._refresh()
+            return [
+                {
+                    "id": tid,
+                    "vendor_name": t["vendor_name"],
+                    "samples": t["samples"],
+                    "uses": t["uses"],
+                    "features": len(t["features"]),
+                    "trusted_fields": sorted(f for f, spec in t["fields"].items() if spec["hits"] >= TEMPLATE_MIN_SAMPLES),
+                    "expected_fields": sorted(f for f, n in t["seen"].items() if n * 2 >= t["samples"]),
+                }
+                for tid, t in self._templates.items()
+            ]
+
+    def delete(self, tid):
+        with self._lock:
+            removed = self._db().execute("DELETE FROM vendor_templates WHERE id = ?", (tid,)).rowcount
+            self._db().commit()
+            self._data_version = None
+            return removed > 0
+
+    def snapshot(self):
+        with self._lock:
+            self._refresh()
+            return {**self.stats, "templates": len(self._templates)}
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import, so they are fixed here before any test imports
+# the backend: throwaway SQLite files, no PDF process pool, no warm-up, and an
+# Ollama address that refuses connections. The upload and batch limits are
+# small so the limit tests need no large bodies.
+os.environ.update(
+    INVOICE_CACHE_DIR=tempfile.mkdtemp(prefix="invoice-tests-"),
+    INVOICE_PDF_WORKERS="0",
+    INVOICE_WARMUP="0",
+    INVOICE_LOG_LEVEL="WARNING",
+    OLLAMA_HOST="http://127.0.0.1:1",
+    INVOICE_LLM_RETRIES="0",
+    INVOICE_UPLOAD_MAX_BYTES="100000",
+    INVOICE_UPLOAD_MEMORY_BYTES="10000",
+    INVOICE_BATCH_MAX_BYTES="400000",
+    INVOICE_BATCH_MAX_DOCUMENTS="3",
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
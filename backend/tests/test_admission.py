@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+# No refill to speak of during a test: each client gets exactly its burst
+SLOW = {"interactive": (0.001, 3), "bulk": (0.001, 2)}
+UNLIMITED = {"interactive": (0, 0), "bulk": (0, 0)}
+
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(rate=2.0, burst=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    assert bucket.take(0.25) == pytest.approx(0.25)
+    assert bucket.take(0.5) == 0.0
+    # Never more than the burst, however long it sat idle
+    assert [bucket.take(100.0) for _ in range(4)][-1] > 0
+
+
+def test_interactive_over_its_rate_is_demoted_then_limited():
+    controller = AdmissionController(4, rate_limits=SLOW)
+    classes = [controller.check("interactive", "a", shed=False) for _ in range(5)]
+    assert classes == ["interactive"] * 3 + ["bulk"] * 2
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.check("interactive", "a", shed=False)
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= 1
+    # The refused one is counted as rate limited, not as demoted
+    assert controller.counts["demoted"] == 2
+    assert controller.counts["rate_limited"] == 1
+
+
+def test_one_client_exhausting_its_bucket_does_not_limit_another():
+    controller = AdmissionController(4, rate_limits=SLOW)
+    for _ in range(2):
+        controller.check("bulk", "greedy", shed=False)
+    with pytest.raises(AdmissionRejected):
+        controller.check("bulk", "greedy", shed=False)
+    assert controller.check("interactive", "quiet", shed=False) == "interactive"
+    assert controller.check("bulk", "quiet", shed=False) == "bulk"
+
+
+async def served_order(controller, waiting):
+    """Queue `waiting` [(name, priority)] behind one held slot; the order they get the slot in."""
+    order = []
+    release = asyncio.Event()
+
+    async def holder():
+        async with controller.slot("interactive"):
+            await release.wait()
+
+    async def waiter(name, priority):
+        async with controller.slot(priority, deadline=False):
+            order.append(name)
+
+    held = asyncio.create_task(holder())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, priority in waiting:
+        tasks.append(asyncio.create_task(waiter(name, priority)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(held, *tasks)
+    return order
+
+
+def test_slots_are_shared_by_weight_while_both_classes_wait():
+    controller = AdmissionController(1, weights={"interactive": 4, "bulk": 1}, rate_limits=UNLIMITED)
+    waiting = [(f"b{i}", "bulk") for i in range(10)] + [(f"i{i}", "interactive") for i in range(10)]
+    order = asyncio.run(served_order(controller, waiting))
+    classes = "".join(name[0] for name in order)
+    # Four interactive for every bulk while both wait (stride order, interactive first
+    # on a tie), then the bulk backlog; FIFO within a class
+    assert classes == "ibiiiibiiiibib" + "b" * 6
+    assert [name for name in order if name[0] == "b"] == [f"b{i}" for i in range(10)]
+    assert [name for name in order if name[0] == "i"] == [f"i{i}" for i in range(10)]
+    assert controller.inflight == 0
+
+
+def test_bulk_is_not_starved_by_a_steady_interactive_load():
+    controller = AdmissionController(1, weights={"interactive": 4, "bulk": 1}, rate_limits=UNLIMITED)
+    waiting = [("b0", "bulk")] + [(f"i{i}", "interactive") for i in range(40)]
+    order = asyncio.run(served_order(controller, waiting))
+    assert order.index("b0") <= 5
+
+
+def test_full_queue_is_shed_with_503():
+    controller = AdmissionController(1, max_queued=2, rate_limits=UNLIMITED)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold(priority):
+            async with controller.slot(priority, deadline=False):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold("bulk")) for _ in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.check("interactive", "c")
+        release.set()
+        await asyncio.gather(*tasks)
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 503
+    assert controller.counts["shed"] == 1
@@ -0,0 +1,79 @@
+import re
+import random
+
+import pytest
+
+from benchmarks.clean import legacy_clean, make_records, make_text
+from benchmarks.synth import INVOICE_FIELDS
+from cleaning import DocumentFacts, clean_fields, clean_many
+
+TEXT = "\n".join([
+    "INVOICE",
+    "East Repair Inc.",
+    "Invoice Number: US-001",
+    "Invoice Date: January 25, 2016",
+    "Due Date: February 24, 2016",
+    "Total $154.06",
+])
+
+
+@pytest.mark.parametrize("chars", [300, 5000])
+def test_same_fields_as_the_function_it_replaced(chars):
+    rng = random.Random(chars)
+    text = make_text(chars, rng)
+    for fields in make_records(rng, 100):
+        assert clean_fields(fields, text) == legacy_clean(fields, text)
+
+
+@pytest.mark.parametrize("fields", [
+    {"invoice_number": "Invoice Number: US-001", "total_amount": "Total: $154.06"},
+    {"vendor_name": "East Repair Inc. Order Number 12 ref", "currency": "Currency: USD"},
+    {"vendor_name": "East Repair Inc. PO # 4411", "currency": "GBP"},
+    {"vendor_address": "['1912 Harvest Lane', 'New York, NY 12210']"},
+    {"vendor_address": "['1912 Harvest Lane', 'New York"},
+    {"vendor_address": "1912 Harvest Lane Due Date February 24, 2016 PO 12 New York"},
+    {"customer_address": "Address: ['3787 Pineview Drive', 'Cambridge, MA 12210']"},
+    {"invoice_date": "25/01/2016", "due_date": "2016-02-24"},
+    {"invoice_date": "Jan 25, 2016", "due_date": "Due Date: February 24, 2016"},
+    {"invoice_date": "", "due_date": None, "purchase_order": "  "},
+    {"currency": "€"},
+])
+def test_same_fields_on_the_usual_model_mistakes(fields):
+    assert clean_fields(fields, TEXT) == legacy_clean(fields, TEXT)
+    assert clean_fields(fields, "no dates or symbols") == legacy_clean(fields, "no dates or symbols")
+
+
+def test_reformatted_date_becomes_the_whole_printed_date():
+    # The original findall had a capture group, so it swapped in the month name
+    # alone ("January"); the printed date is what was meant
+    legacy_dates = re.findall(
+        r"(January|February|March|April|May|June|July|August|September|October|November|December)"
+        r"\s+\d{1,2},?\s+\d{4}", TEXT,
+    )
+    assert legacy_dates == ["January", "February"]
+    cleaned = clean_fields({"invoice_date": "2016-01-25", "due_date": "2016-02-24"}, TEXT)
+    assert cleaned == {"invoice_date": "January 25, 2016", "due_date": "February 24, 2016"}
+
+
+def test_due_date_falls_back_to_the_first_date():
+    cleaned = clean_fields({"due_date": "2016-01-25"}, "Invoice Date: January 25, 2016")
+    assert cleaned == {"due_date": "January 25, 2016"}
+
+
+def test_date_scan_stops_after_the_dates_rules_read():
+    facts = DocumentFacts(TEXT + "\nMarch 3, 2016 shipped\nApril 4, 2016 paid")
+    assert facts.dates == ["January 25, 2016", "February 24, 2016"]
+
+
+def test_clean_many_matches_clean_fields():
+    rng = random.Random(7)
+    texts = [make_text(1000, rng) for _ in range(3)]
+    records = [(fields, texts[i % 3]) for i, fields in enumerate(make_records(rng, 30))]
+    assert clean_many(records) == [clean_fields(fields, text) for fields, text in records]
+
+
+def test_fields_are_not_modified():
+    fields = dict(INVOICE_FIELDS, invoice_date="2016-01-25")
+    before = dict(fields)
+    clean_fields(fields, TEXT)
+    assert fields == before
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import extraction_cache
+from extraction_cache import ExtractionCache
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two caches on one file, as two uvicorn workers have."""
+    path = str(tmp_path / "extractions.sqlite3")
+    return ExtractionCache(path), ExtractionCache(path)
+
+
+def test_repeat_is_served_from_memory(workers):
+    a, _ = workers
+    a.put("k", {"total_amount": "$1"})
+    assert a.get("k") == {"total_amount": "$1"}
+    assert a.stats["memory_hits"] == 1
+
+
+def test_other_worker_reads_from_disk(workers):
+    a, b = workers
+    a.put("k", {"total_amount": "$1"})
+    assert b.get("k") == {"total_amount": "$1"}
+    assert b.stats["disk_hits"] == 1
+
+
+def test_invalidate_on_another_worker_is_seen(workers):
+    a, b = workers
+    a.put("k", {"total_amount": "$1"})
+    assert b.invalidate("k")
+    assert a.get("k") is None
+
+
+def test_clear_on_another_worker_is_seen(workers):
+    a, b = workers
+    a.put("k", {"total_amount": "$1"})
+    b.clear()
+    assert a.get("k") is None
+
+
+def test_refresh_on_another_worker_is_seen(workers):
+    a, b = workers
+    a.put("k", {"total_amount": "$1"})
+    b.put("k", {"total_amount": "$2"})
+    assert a.get("k") == {"total_amount": "$2"}
+    # Re-read once, then memory again until the next foreign write
+    assert a.get("k") == {"total_amount": "$2"}
+    assert a.stats["disk_hits"] == 1
+    assert a.stats["memory_hits"] == 1
+
+
+def test_own_writes_keep_the_memory_tier(workers):
+    a, _ = workers
+    a.put("k", {"n": 1})
+    a.put("other", {"n": 2})
+    a.get("other")
+    assert a.get("k") == {"n": 1}
+    assert a.stats["memory_hits"] == 2
+    assert a.stats["disk_hits"] == 0
+
+
+def test_expired_entry_is_a_miss(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path / "c.sqlite3"), ttl_seconds=60)
+    cache.put("k", {"n": 1})
+    later = time.time() + 61
+    monkeypatch.setattr(extraction_cache.time, "time", lambda: later)
+    assert cache.get("k") is None
+    assert cache.stats["misses"] == 1
+
+
+def test_disk_tier_is_trimmed_to_its_size(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "c.sqlite3"), memory_entries=2, disk_entries=10, evict_every=5)
+    for i in range(23):
+        cache.put(f"k{i}", {"n": i})
+    # Eviction runs on every 5th put, so the table may run up to 4 over in between
+    assert cache.snapshot()["disk_entries"] <= 10 + 4
+    assert cache.get("k22") == {"n": 22}
+    assert cache.get("k0") is None
@@ -0,0 +1,61 @@
+import json
+
+from incremental_json import IncrementalObjectParser
+
+ANSWER = json.dumps({
+    "vendor_name": "Acme, Inc. {Sydney}",
+    "invoice_number": "INV-3337",
+    "vendor_address": ["Suite 5A-1204", "123 \"Somewhere\" Street"],
+    "total_amount": "$93.50",
+    "due_date": None,
+    "line_items": [{"description": "Web design, [phase 1]", "amount": "$85.00"}],
+})
+
+
+def parse(chunks):
+    parser = IncrementalObjectParser()
+    members = []
+    for chunk in chunks:
+        members += parser.feed(chunk)
+    return members, parser
+
+
+def test_one_chunk_gives_every_member_in_order():
+    members, parser = parse([ANSWER])
+    assert members == list(json.loads(ANSWER).items())
+    assert parser.done
+
+
+def test_every_split_point_gives_the_same_members():
+    expected = list(json.loads(ANSWER).items())
+    for i in range(len(ANSWER) + 1):
+        members, _ = parse([ANSWER[:i], ANSWER[i:]])
+        assert members == expected, f"split at {i}: {ANSWER[:i]!r}"
+
+
+def test_character_by_character():
+    members, _ = parse(ANSWER)
+    assert members == list(json.loads(ANSWER).items())
+
+
+def test_member_is_emitted_once_its_separator_arrives():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"invoice_number": "INV-1"') == []
+    assert parser.feed(', "total') == [("invoice_number", "INV-1")]
+    assert parser.feed('_amount": "$5"}') == [("total_amount", "$5")]
+
+
+def test_fence_before_the_object_is_skipped():
+    members, _ = parse(["```js", "on\n{\"currency\": ", "\"$\"}\n``", "`"])
+    assert members == [("currency", "$")]
+
+
+def test_text_after_the_object_is_ignored():
+    members, parser = parse(['{"a": 1}', ' {"b": 2}'])
+    assert members == [("a", 1)]
+    assert parser.done
+
+
+def test_malformed_member_is_skipped():
+    members, _ = parse(['{"a": nope, "b": 2}'])
+    assert members == [("b", 2)]
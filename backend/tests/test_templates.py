@@ -0,0 +1,83 @@
+import pytest
+
+from geometry import PageGeometry
+from templates import TemplateStore
+
+WIDTH, HEIGHT = 612, 792
+
+
+def page(header, number, total):
+    """One page: header words across the top, an invoice number and a total with their labels."""
+    words = []
+    for i, text in enumerate(header):
+        x, y = 40 + (i % 4) * 140, 30 + (i // 4) * 30
+        words.append({"text": text, "x0": x, "x1": x + 60, "top": y, "bottom": y + 10})
+    words += [
+        {"text": "Invoice", "x0": 40, "x1": 80, "top": 200, "bottom": 210},
+        {"text": "Number:", "x0": 84, "x1": 130, "top": 200, "bottom": 210},
+        {"text": number, "x0": 140, "x1": 200, "top": 200, "bottom": 210},
+        {"text": "Total", "x0": 40, "x1": 70, "top": 600, "bottom": 610},
+        {"text": total, "x0": 140, "x1": 190, "top": 600, "bottom": 610},
+    ]
+    return [{"words": PageGeometry.from_words(words), "width": WIDTH, "height": HEIGHT}]
+
+
+ACME = ["Acme", "Supplies", "Harbour", "Street", "Sydney", "Phone", "Email", "Website", "Invoice", "Terms"]
+GLOBEX = ["Globex", "Corporation", "Industrial", "Park", "Springfield", "Billing", "Remit", "Account", "Statement"]
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two template stores on one file, as two uvicorn workers have."""
+    path = str(tmp_path / "templates.sqlite3")
+    return TemplateStore(path), TemplateStore(path)
+
+
+def learn(store, header, n, vendor):
+    number, total = f"INV-{1000 + n}", f"${10 + n}.50"
+    return store.learn(page(header, number, total), {"invoice_number": number, "total_amount": total}, {},
+                       vendor_name=vendor)
+
+
+def test_template_learned_on_one_worker_is_used_by_another(workers):
+    a, b = workers
+    assert b.list() == []
+    learn(a, ACME, 1, "Acme")
+    learn(a, ACME, 2, "Acme")
+    found = b.extract(page(ACME, "INV-2001", "$99.00"))
+    assert found is not None and found["vendor_name"] == "Acme"
+    assert found["fields"] == {"invoice_number": "INV-2001", "total_amount": "$99.00"}
+    assert b.stats["hits"] == 1
+
+
+def test_delete_on_another_worker_is_seen(workers):
+    a, b = workers
+    tid = learn(a, ACME, 1, "Acme")
+    assert [t["id"] for t in b.list()] == [tid]
+    assert b.delete(tid)
+    assert a.list() == []
+    assert a.extract(page(ACME, "INV-2001", "$99.00")) is None
+
+
+def test_write_by_another_worker_during_a_learn_is_not_missed(workers, monkeypatch):
+    a, b = workers
+    assert a.list() == []
+    save = a._save
+
+    def save_after_another_worker(*args, **kwargs):
+        # Another worker commits between this learn's refresh and its own save
+        learn(b, GLOBEX, 1, "Globex")
+        save(*args, **kwargs)
+
+    monkeypatch.setattr(a, "_save", save_after_another_worker)
+    learn(a, ACME, 1, "Acme")
+    monkeypatch.undo()
+    assert sorted(t["vendor_name"] for t in a.list()) == ["Acme", "Globex"]
+
+
+def test_different_layout_does_not_match(workers):
+    a, _ = workers
+    learn(a, ACME, 1, "Acme")
+    learn(a, ACME, 2, "Acme")
+    assert a.extract(page(GLOBEX, "INV-2001", "$99.00")) is None
+    assert a.stats["misses"] == 1
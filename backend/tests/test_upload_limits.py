@@ -0,0 +1,93 @@
+import io
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+
+import main
+from uploads import UPLOAD_MAX_BYTES, UploadLimitMiddleware
+
+# conftest.py: INVOICE_UPLOAD_MAX_BYTES=100000, INVOICE_BATCH_MAX_BYTES=400000,
+# INVOICE_BATCH_MAX_DOCUMENTS=3. The middleware allows 64 KB of multipart
+# framing on top of each limit.
+FRAMING = 64 * 1024
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def pdf(size):
+    return b"%PDF-1.4\n" + b"x" * (size - 9)
+
+
+def zip_of(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_limits_cover_every_path_below_the_configured_ones():
+    middleware = UploadLimitMiddleware(None, ["/extract-invoice", "/invoices"], max_bytes=10,
+                                       limits={"/extract-invoice/batch": 99})
+    assert middleware._limit("/extract-invoice") == 10
+    assert middleware._limit("/extract-invoice/stream") == 10
+    assert middleware._limit("/extract-invoice/batch") == 99
+    assert middleware._limit("/extract-invoice/batch/") == 99
+    assert middleware._limit("/invoices/7/extract") == 10
+    assert middleware._limit("/extract-invoices") == 0
+    assert middleware._limit("/jobs") == 0
+
+
+@pytest.mark.parametrize("path", ["/extract-invoice", "/extract-invoice/stream", "/invoices"])
+def test_oversized_upload_is_refused_by_content_length(client, path):
+    response = client.post(path, files={"file": ("a.pdf", pdf(UPLOAD_MAX_BYTES + FRAMING + 1))})
+    assert response.status_code == 413
+    assert "byte limit" in response.json()["error"]
+
+
+def test_chunked_upload_is_cut_off_on_the_stream_endpoint(client):
+    body = (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"\r\n\r\n"
+            + pdf(UPLOAD_MAX_BYTES + FRAMING + 1) + b"\r\n--b--\r\n")
+
+    def chunks():
+        for i in range(0, len(body), 16384):
+            yield body[i:i + 16384]
+
+    response = client.post("/extract-invoice/stream", content=chunks(),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+
+
+def test_batch_zip_over_the_batch_limit_is_refused(client):
+    archive = zip_of({f"{i}.pdf": pdf(90000) for i in range(6)})
+    assert len(archive) > main.BATCH_MAX_BYTES + FRAMING
+    response = client.post("/extract-invoice/batch", files=[("files", ("a.zip", archive))])
+    assert response.status_code == 413
+
+
+def test_batch_zip_may_exceed_the_single_upload_limit(client):
+    archive = zip_of({f"{i}.pdf": pdf(90000) for i in range(3)})
+    assert UPLOAD_MAX_BYTES + FRAMING < len(archive) < main.BATCH_MAX_BYTES
+    response = client.post("/extract-invoice/batch", files=[("files", ("a.zip", archive))])
+    assert response.status_code == 200
+
+
+def test_batch_zip_with_too_many_documents_is_refused(client):
+    archive = zip_of({f"{i}.pdf": pdf(100) for i in range(main.BATCH_MAX_DOCUMENTS + 1)})
+    response = client.post("/extract-invoice/batch", files=[("files", ("a.zip", archive))])
+    assert response.status_code == 413
+    assert "documents" in response.json()["error"]
+
+
+def test_oversized_zip_member_becomes_a_document_error(tmp_path):
+    upload = UploadFile(io.BytesIO(zip_of({"small.pdf": pdf(100), "big.pdf": pdf(UPLOAD_MAX_BYTES + 1)})),
+                             filename="a.zip")
+    documents = main._spool_batch_documents([upload], str(tmp_path))
+    assert [(name, error is None) for name, _, error in documents] == [("a.zip/small.pdf", True), ("a.zip/big.pdf", False)]
+    assert "byte limit" in documents[1][2]
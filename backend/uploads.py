@@ -0,0 +1,176 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException
+
+# -----------------------------------------------------------------------------
+# Upload handling
+# -----------------------------------------------------------------------------
+#
+# Uploads are copied to disk in fixed-size chunks and hashed on the way, so a
+# 200 MB scanned statement never sits in memory as one bytes object. Files up
+# to UPLOAD_MEMORY_BYTES stay in memory and are parsed straight from a buffer
+# (no temp file at all). Anything over UPLOAD_MAX_BYTES is refused with 413,
+# by Content-Length before the body is read when the client sends one.
+
+UPLOAD_MAX_BYTES = int(os.getenv("INVOICE_UPLOAD_MAX_BYTES", str(250 * 1024 * 1024)))
+UPLOAD_MEMORY_BYTES = int(os.getenv("INVOICE_UPLOAD_MEMORY_BYTES", str(2 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(HTTPException):
+    # An HTTPException so it survives FastAPI's form parsing and becomes a 413
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Upload exceeds the {limit} byte limit")
+        self.limit = limit
+
+
+class StoredDocument:
+    """
+    One PDF ready for the pipeline: either in-memory `data` or an on-disk `path`,
+    plus its size and SHA-256. `source` is what pdfplumber gets (see open_pdf_source).
+    """
+
+    def __init__(self, sha256, size, data=None, path=None, owns_path=True):
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.path = path
+        self.owns_path = owns_path
+
+    @property
+    def source(self):
+        return self.data if self.data is not None else self.path
+
+    def save_to(self, dest):
+        """Persist the document at dest (moves a temp file we own instead of copying)."""
+        if self.data is not None:
+            with open(dest, "wb") as fh:
+                fh.write(self.data)
+        elif self.owns_path:
+            shutil.move(self.path, dest)
+            self.path = dest
+            self.owns_path = False
+        else:
+            shutil.copyfile(self.path, dest)
+
+    def cleanup(self):
+        if self.owns_path and self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def open_pdf_source(source):
+    """pdfplumber.open() argument for a path or raw PDF bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def spool_stream(stream, max_bytes=UPLOAD_MAX_BYTES, memory_bytes=UPLOAD_MEMORY_BYTES):
+    """
+    Read a file object in chunks, hashing as we go. Stays in memory up to
+    memory_bytes, then rolls over to a temp file. Blocking; run in a thread.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    tmp = None
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLargeError(max_bytes)
+            digest.update(chunk)
+            if tmp is None and size <= memory_bytes:
+                buffer += chunk
+                continue
+            if tmp is None:
+                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+                tmp.write(buffer)
+                buffer = None
+            tmp.write(chunk)
+    except BaseException:
+        if tmp is not None:
+            tmp.close()
+            os.unlink(tmp.name)
+        raise
+
+    if tmp is None:
+        return StoredDocument(digest.hexdigest(), size, data=bytes(buffer))
+    tmp.close()
+    return StoredDocument(digest.hexdigest(), size, path=tmp.name)
+
+
+def document_from_path(path):
+    """Wrap a PDF that is already on disk (hash read in chunks). Blocking."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return StoredDocument(digest.hexdigest(), size, path=path, owns_path=False)
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping request bodies on `paths` and everything below them
+    (/extract-invoice covers /extract-invoice/stream) at max_bytes, or at the
+    `limits` entry of the longest matching path: a larger Content-Length gets 413
+    before anything is read, and a body that runs past the limit without one
+    (chunked transfer) raises UploadTooLargeError as soon as it does.
+    """
+
+    def __init__(self, app, paths, max_bytes=UPLOAD_MAX_BYTES, limits=None):
+        self.app = app
+        self.limits = {path.rstrip("/"): max_bytes for path in paths}
+        self.limits.update({path.rstrip("/"): limit for path, limit in (limits or {}).items()})
+
+    def _limit(self, path):
+        """Byte limit for a request path (0: none)."""
+        path = path.rstrip("/")
+        while path:
+            if path in self.limits:
+                return self.limits[path]
+            path = path.rpartition("/")[0]
+        return 0
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit(scope["path"]) if scope["type"] == "http" else 0
+        if not limit:
+            return await self.app(scope, receive, send)
+        # Multipart framing and form fields ride on top of the file itself
+        max_bytes = limit + 64 * 1024
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+            return await self._reject(scope, receive, send, limit)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise UploadTooLargeError(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, scope, receive, send, limit):
+        response = JSONResponse(
+            status_code=413,
+            content={"error": str(UploadTooLargeError(limit).detail)},
+            headers={"Connection": "close"},
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+
+from observability import logger
+
+# -----------------------------------------------------------------------------
+# Startup warm-up
+# -----------------------------------------------------------------------------
+#
+# A fresh worker has cold PDF processes (spawned and importing pdfplumber on
+# the first parse) and, often, no model loaded in Ollama. Instead of making the
+# first users pay for that, the lifespan runs warm-up steps in the background:
+# spawn and prime the PDF workers, load the model on every node, and run one
+# tiny extraction end to end. /ready answers 503 until every step has passed,
+# so a load balancer only sends traffic to warm workers. Failed steps are
+# retried every WARMUP_RETRY_SECONDS (Ollama may come up after us); steps that
+# already passed are not repeated.
+
+WARMUP_ENABLED = os.getenv("INVOICE_WARMUP", "1") != "0"
+WARMUP_RETRY_SECONDS = float(os.getenv("INVOICE_WARMUP_RETRY_SECONDS", "10"))
+
+WARMUP_LINES = (
+    (50, 740, "INVOICE"),
+    (50, 710, "Warm-up Supplies Ltd"),
+    (50, 695, "1 Example Street Springfield"),
+    (380, 710, "Invoice Number: W-0001"),
+    (380, 695, "Invoice Date: January 1, 2024"),
+    (50, 640, "Description                Qty    Amount"),
+    (50, 625, "Warm-up item               1      $1.00"),
+    (380, 590, "Total: $1.00"),
+)
+
+
+def warmup_pdf():
+    """A one-page invoice PDF (built-in Helvetica, no PDF library needed) for the warm-up extraction."""
+    ops = ["BT /F1 10 Tf"]
+    for x, y, text in WARMUP_LINES:
+        ops.append(f"1 0 0 1 {x} {y} Tm ({text}) Tj")
+    ops.append("ET")
+    stream = "\n".join(ops).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792]"
+        b" /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class Warmup:
+    def __init__(self, enabled=WARMUP_ENABLED, retry_seconds=WARMUP_RETRY_SECONDS):
+        self.enabled = enabled
+        self.retry_seconds = retry_seconds
+        self.status = "pending" if enabled else "skipped"
+        self.steps = {}
+        self.attempts = 0
+        self.error = None
+        self.started_at = None
+        self.ready_seconds = None
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.status in ("ready", "skipped")
+
+    def start(self, steps):
+        """Run [(name, coroutine function)] in the background until all have passed."""
+        if self.enabled and self._task is None:
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run(steps))
+
+    async def _run(self, steps):
+        while True:
+            self.attempts += 1
+            self.status = "running"
+            try:
+                for name, step in steps:
+                    if name in self.steps:
+                        continue
+                    started = time.perf_counter()
+                    await step()
+                    self.steps[name] = round(time.perf_counter() - started, 3)
+                    logger.info("warmup.step name=%s seconds=%.3f", name, self.steps[name])
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.status = "retrying"
+                self.error = f"{type(ex).__name__}: {ex}"[:300]
+                logger.warning("warmup.failed attempt=%d error=%s retry_in=%.0fs", self.attempts, self.error, self.retry_seconds)
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            self.status = "ready"
+            self.error = None
+            self.ready_seconds = round(time.monotonic() - self.started_at, 3)
+            logger.info("warmup.ready seconds=%.3f steps=%s", self.ready_seconds, self.steps)
+            return
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self):
+        return {
+            "ready": self.ready,
+            "status": self.status,
+            "steps": self.steps,
+            "attempts": self.attempts,
+            "error": self.error,
+            "ready_seconds": self.ready_seconds,
+        }
@@ -0,0 +1,53 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from observability import configure_logging
+
+# -----------------------------------------------------------------------------
+# Worker pools
+# -----------------------------------------------------------------------------
+#
+# pdfplumber parsing and box finding are CPU-bound pure Python, so they run in
+# a bounded process pool. LLM calls are I/O-bound and go through the Ollama
+# node pool (llm_pool.py), which runs at most LLM_CONCURRENCY generations per
+# node so we never queue more on a server than it can run in parallel
+# (OLLAMA_NUM_PARALLEL).
+
+PDF_WORKERS = int(os.getenv("INVOICE_PDF_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+LLM_CONCURRENCY = int(os.getenv("INVOICE_LLM_CONCURRENCY", "2"))
+# Long PDFs are parsed in page ranges of PDF_SHARD_PAGES, up to PDF_SHARD_WORKERS
+# ranges of one document at a time (see parse_pdf in main.py); 0 turns it off
+PDF_SHARD_PAGES = int(os.getenv("INVOICE_PDF_SHARD_PAGES", "16"))
+PDF_SHARD_WORKERS = int(os.getenv("INVOICE_PDF_SHARD_WORKERS", str(PDF_WORKERS)))
+
+_pdf_pool = None
+
+
+def get_pdf_pool():
+    """Lazily create the process pool. INVOICE_PDF_WORKERS=0 runs CPU work in threads instead."""
+    global _pdf_pool
+    if _pdf_pool is None and PDF_WORKERS > 0:
+        # spawn, not fork: the server process already runs an event loop and threads
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_logging,
+        )
+    return _pdf_pool
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a picklable CPU-bound function in the PDF process pool."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(fn, *args, **kwargs)
+    return await loop.run_in_executor(get_pdf_pool(), call)
+
+
+def shutdown_pools():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
@@ -1,37 +1,35 @@
-import React, { useMemo, useState, useRef } from 'react';
+import React, { useState, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import useInvoices from '../store/useInvoices.js';
 
 export default function DashboardPage() {
-  const { invoices, statusCounts, update, addInvoice, deleteInvoice } = useInvoices();
   const [query, setQuery] = useState('');
+  const {
+    invoices, statusCounts, total, update, addInvoice, deleteInvoice,
+    page, hasPrev, hasNext, prevPage, nextPage, error,
+  } = useInvoices({ query });
   const fileInputRef = useRef(null);
   const navigate = useNavigate();
-  const filtered = useMemo(() => invoices.filter(inv => inv.caseName.toLowerCase().includes(query.toLowerCase()) || String(inv.id).includes(query)), [invoices, query]);
 
   const handleStatusChange = (invoiceId, newStatus) => {
-    update(invoiceId, { status: newStatus });
+    update(invoiceId, { status: newStatus }).catch(err => alert(`Could not update status: ${err.message}`));
   };
 
-  const handleFileUpload = (e) => {
-    const files = Array.from(e.target.files);
-    
-    files.forEach(file => {
-      if (file.type === 'application/pdf') {
-        const invoiceData = {
-          caseName: file.name,
-          file: file.name,
-          pages: 1 // Default, can be updated after extraction
-        };
-        
-        addInvoice(invoiceData, file);
-      }
-    });
-    
+  const handleFileUpload = async (e) => {
+    const files = Array.from(e.target.files).filter(file => file.type === 'application/pdf');
+
     // Reset file input
     if (fileInputRef.current) {
       fileInputRef.current.value = '';
     }
+
+    for (const file of files) {
+      try {
+        await addInvoice(file);
+      } catch (err) {
+        alert(`Could not upload ${file.name}: ${err.message}`);
+      }
+    }
   };
 
   const handleUploadClick = () => {
@@ -40,7 +38,7 @@ export default function DashboardPage() {
 
   const handleDelete = (invoiceId, e) => {
     e.stopPropagation();
-    deleteInvoice(invoiceId);
+    deleteInvoice(invoiceId).catch(err => alert(`Could not delete invoice: ${err.message}`));
   };
 
   return (
@@ -67,14 +65,14 @@ export default function DashboardPage() {
       </button>
       
       <div className="grid stats">
-        <StatCard label="Total" value={invoices.length} />
+        <StatCard label="Total" value={total} />
         <StatCard label="Pending" value={statusCounts.Pending || 0} variant="Pending" />
         <StatCard label="Done" value={statusCounts.Done || 0} variant="Done" />
         <StatCard label="Error" value={statusCounts.Error || 0} variant="Error" />
       </div>
       <div className="table-wrapper">
         <div className="search-row">
-          <input placeholder="Search by case id or name" value={query} onChange={e=>setQuery(e.target.value)} />
+          <input placeholder='Search invoices: vendor, PO, any phrase ("net 30", po:4500*, vendor:acme)' value={query} onChange={e=>setQuery(e.target.value)} />
         </div>
         <table className="table">
           <thead>
@@ -89,10 +87,13 @@ export default function DashboardPage() {
             </tr>
           </thead>
           <tbody>
-            {filtered.map(inv => (
+            {invoices.map(inv => (
               <tr key={inv.id}>
                 <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>{inv.id}</td>
-                <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>{inv.caseName}</td>
+                <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>
+                  {inv.caseName}
+                  {inv.snippet && <div style={{ color: '#64748b', fontSize: '0.75rem', marginTop: 4 }}>{inv.snippet}</div>}
+                </td>
                 <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>{inv.pages}</td>
                 <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>{inv.uploadedAt}</td>
                 <td onClick={()=>navigate(`/invoices/${inv.id}`)} style={{cursor:'pointer'}}>{inv.modifiedAt}</td>
@@ -136,13 +137,20 @@ export default function DashboardPage() {
                 </td>
               </tr>
             ))}
-            {filtered.length === 0 && (
+            {invoices.length === 0 && (
               <tr><td colSpan={7} style={{textAlign:'center', padding:40, color:'#64748b'}}>
-                {invoices.length === 0 ? '📄 No invoices yet. Click "Upload PDF Invoices" to get started!' : 'No cases match your search.'}
+                {error ? `Could not load invoices: ${error}` : total === 0 ? '📄 No invoices yet. Click "Upload PDF Invoices" to get started!' : 'No cases match your search.'}
               </td></tr>
             )}
           </tbody>
         </table>
+        {(hasPrev || hasNext) && (
+          <div style={{ display: 'flex', justifyContent: 'flex-end', alignItems: 'center', gap: 8, padding: '12px 0' }}>
+            <button className="button" onClick={prevPage} disabled={!hasPrev}>← Prev</button>
+            <span style={{ color: '#64748b', fontSize: '0.875rem' }}>Page {page}</span>
+            <button className="button" onClick={nextPage} disabled={!hasNext}>Next →</button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -1,16 +1,16 @@
 import { useParams, useNavigate } from 'react-router-dom';
 import { useState } from 'react';
-import useInvoices from '../store/useInvoices.js';
+import { useInvoice } from '../store/useInvoices.js';
 import InvoiceForm from '../ui/InvoiceForm.jsx';
 import InvoicePreview from '../ui/InvoicePreview.jsx';
 
 export default function InvoiceDetailPage() {
   const { id } = useParams();
   const navigate = useNavigate();
-  const { getById, update } = useInvoices();
-  const invoice = getById(Number(id));
+  const { invoice, loading, update, reload } = useInvoice(Number(id));
   const [selectedField, setSelectedField] = useState(null);
 
+  if(loading && !invoice) return <div style={{padding:40}}>Loading…</div>;
   if(!invoice) return <div style={{padding:40}}>Invoice not found. <button onClick={()=>navigate('/invoices')}>Back</button></div>;
 
   return (
@@ -30,11 +30,10 @@ export default function InvoiceDetailPage() {
         <span style={{ marginLeft: 8 }}>id={invoice.id}</span>
         <span style={{ marginLeft: 8 }}>file={invoice.file || 'N/A'}</span>
         <span style={{ marginLeft: 8 }}>fileUrl={invoice.fileUrl ? 'yes' : 'no'}</span>
-        <span style={{ marginLeft: 8 }}>pdfFile={invoice.pdfFile ? 'yes' : 'no'}</span>
       </div>
       <div className="detail-layout">
-        <InvoicePreview invoice={invoice} pdfFile={invoice.pdfFile || null} selectedField={selectedField} onFieldSelect={setSelectedField} />
-        <InvoiceForm invoice={invoice} update={update} selectedField={selectedField} />
+        <InvoicePreview invoice={invoice} pdfFile={null} selectedField={selectedField} onFieldSelect={setSelectedField} />
+        <InvoiceForm invoice={invoice} update={update} reload={reload} selectedField={selectedField} />
       </div>
     </div>
   );
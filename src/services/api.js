@@ -2,33 +2,284 @@
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+const DEFAULT_PROMPT = "Extract all invoice fields including invoice number, date, due date, vendor name and address, purchase order, account number, line items, total amount, and currency.";
+
 /**
- * Extract invoice data from a PDF file
+ * Extract invoice data from a PDF file.
+ * Submits an extraction job and waits for it, so no single HTTP request stays
+ * open for the whole LLM run (long requests get cut off by proxies).
  * @param {File} file - PDF file to extract data from
  * @param {string} customPrompt - Custom prompt for the extraction
+ * @param {(stage: string) => void} [onStage] - Optional progress callback (pdf_parsed, template_matched, llm_done, cleaned, boxes_done)
  * @returns {Promise<Object>} Extracted invoice data
  */
-export async function extractInvoice(file, customPrompt = "Extract all invoice fields including invoice number, date, due date, vendor name and address, purchase order, account number, line items, total amount, and currency.") {
+export async function extractInvoice(file, customPrompt = DEFAULT_PROMPT, onStage) {
   try {
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('custom_prompt', customPrompt);
+    const job = await submitExtractionJob(file, customPrompt);
+    return await waitForJob(job.job_id, onStage);
+  } catch (error) {
+    console.error('Error extracting invoice:', error);
+    throw error;
+  }
+}
+
+/**
+ * Extract invoice data while the model is still generating: each field is
+ * reported as soon as the backend has it (cleaned, with its boxes), and the
+ * promise resolves with the same result object as extractInvoice.
+ * @param {File} file - PDF file to extract data from
+ * @param {string} customPrompt - Custom prompt for the extraction
+ * @param {{onField?: (field: string, value: any, boxes: Array) => void, onStage?: (stage: string) => void}} [handlers]
+ * @returns {Promise<Object>} Extracted invoice data
+ */
+export async function extractInvoiceStream(file, customPrompt = DEFAULT_PROMPT, { onField, onStage } = {}) {
+  const formData = new FormData();
+  formData.append('file', file);
+  formData.append('custom_prompt', customPrompt);
+
+  const response = await fetch(`${API_BASE_URL}/extract-invoice/stream`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok || !response.body) {
+    let message = `HTTP error! status: ${response.status}`;
+    try { message = (await response.json()).error || message; } catch { /* not JSON */ }
+    throw new Error(message);
+  }
+
+  return readExtractionStream(response, { onField, onStage });
+}
+
+// NDJSON events from /extract-invoice/stream and /invoices/{id}/extract
+async function readExtractionStream(response, { onField, onStage } = {}) {
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (!line) continue;
+      const event = JSON.parse(line);
+      if (event.event === 'field') {
+        if (onField) onField(event.field, event.value, event.boxes);
+      } else if (event.event === 'stage') {
+        if (onStage) onStage(event.stage);
+      } else if (event.event === 'result') {
+        return event.result;
+      } else if (event.event === 'error') {
+        throw new Error(event.error || 'Extraction failed');
+      }
+    }
+  }
+  throw new Error('Extraction stream ended without a result');
+}
+
+/**
+ * Queue an extraction job on the backend
+ * @param {File} file - PDF file to extract data from
+ * @param {string} customPrompt - Custom prompt for the extraction
+ * @returns {Promise<{job_id: string, status_url: string, events_url: string}>}
+ */
+export async function submitExtractionJob(file, customPrompt = DEFAULT_PROMPT) {
+  const formData = new FormData();
+  formData.append('file', file);
+  formData.append('custom_prompt', customPrompt);
+  formData.append('async_mode', 'true');
+
+  const response = await fetch(`${API_BASE_URL}/extract-invoice`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+  }
+
+  return await response.json();
+}
+
+/**
+ * Fetch the current state of an extraction job
+ * @param {string} jobId
+ * @returns {Promise<Object>}
+ */
+export async function getJob(jobId) {
+  const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+  }
+  return await response.json();
+}
+
+/**
+ * Wait for a job to finish. Uses the SSE progress stream when available and
+ * falls back to polling if the stream cannot be opened.
+ * @param {string} jobId
+ * @param {(stage: string) => void} [onStage]
+ * @returns {Promise<Object>} The job result
+ */
+export function waitForJob(jobId, onStage) {
+  const finish = (job) => {
+    if (job.status === 'failed') throw new Error(job.error || 'Extraction failed');
+    return job.result;
+  };
 
-    const response = await fetch(`${API_BASE_URL}/extract-invoice`, {
-      method: 'POST',
-      body: formData,
+  if (typeof EventSource === 'undefined') {
+    return pollJob(jobId, onStage).then(finish);
+  }
+
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+    let settled = false;
+    const settle = (job) => {
+      settled = true;
+      source.close();
+      try { resolve(finish(job)); } catch (e) { reject(e); }
+    };
+    source.addEventListener('stage', (e) => {
+      if (onStage) onStage(JSON.parse(e.data).stage);
     });
+    source.addEventListener('done', (e) => settle(JSON.parse(e.data)));
+    source.addEventListener('failed', (e) => settle(JSON.parse(e.data)));
+    source.onerror = () => {
+      if (settled) return;
+      settled = true;
+      source.close();
+      pollJob(jobId, onStage).then(finish).then(resolve, reject);
+    };
+  });
+}
 
-    if (!response.ok) {
-      const errorData = await response.json();
-      throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+async function pollJob(jobId, onStage, intervalMs = 1000) {
+  let lastStage = null;
+  for (;;) {
+    const job = await getJob(jobId);
+    if (onStage && job.stage !== lastStage) {
+      lastStage = job.stage;
+      onStage(job.stage);
     }
+    if (job.status === 'done' || job.status === 'failed') return job;
+    await new Promise(r => setTimeout(r, intervalMs));
+  }
+}
 
-    return await response.json();
-  } catch (error) {
-    console.error('Error extracting invoice:', error);
-    throw error;
+// ---------------------------------------------------------------------------
+// Invoice store
+// ---------------------------------------------------------------------------
+
+const formatTimestamp = (seconds) => seconds ? new Date(seconds * 1000).toISOString().slice(0,16).replace('T',' ') : '';
+
+// Server invoice row -> the shape the pages use
+function toInvoice(row) {
+  return {
+    id: row.id,
+    caseName: row.case_name,
+    file: row.file_name || '',
+    fileUrl: invoicePdfUrl(row.id),
+    pages: row.pages,
+    status: row.status,
+    uploadedAt: formatTimestamp(row.created_at),
+    modifiedAt: formatTimestamp(row.updated_at),
+    vendor: row.vendor_name,
+    invoiceDate: row.invoice_date,
+    total: row.total_amount,
+    fields: row.fields || {},
+    boxes: row.boxes || [],
+    snippet: row.snippet,
+  };
+}
+
+async function requestJson(path, options) {
+  const response = await fetch(`${API_BASE_URL}${path}`, options);
+  if (!response.ok) {
+    let message = `HTTP error! status: ${response.status}`;
+    try { message = (await response.json()).error || message; } catch { /* not JSON */ }
+    throw new Error(message);
+  }
+  return await response.json();
+}
+
+export function invoicePdfUrl(id) {
+  return `${API_BASE_URL}/invoices/${id}/pdf`;
+}
+
+/**
+ * One page of invoices.
+ * @param {{q?: string, status?: string, vendor?: string, sort?: string, order?: string, limit?: number, cursor?: string}} params
+ * @returns {Promise<{items: Array<Object>, nextCursor: string|null}>}
+ */
+export async function listInvoices(params = {}) {
+  const query = new URLSearchParams(Object.entries(params).filter(([, v]) => v !== undefined && v !== null && v !== ''));
+  const page = await requestJson(`/invoices?${query}`);
+  return { items: page.items.map(toInvoice), nextCursor: page.next_cursor };
+}
+
+/**
+ * Ranked full-text search over stored invoices (fields and PDF text).
+ * Supports "phrases", prefix*, -exclusions and field:value (vendor:, po:, account:, number:, ...).
+ * @param {{q: string, prefix?: boolean, limit?: number, cursor?: string}} params
+ * @returns {Promise<{items: Array<Object>, nextCursor: string|null}>}
+ */
+export async function searchInvoices(params) {
+  const query = new URLSearchParams(Object.entries(params).filter(([, v]) => v !== undefined && v !== null && v !== ''));
+  const page = await requestJson(`/search?${query}`);
+  return { items: page.items.map(toInvoice), nextCursor: page.next_cursor };
+}
+
+/** @returns {Promise<{total: number, by_status: Object<string, number>}>} */
+export async function getInvoiceStats() {
+  return await requestJson('/invoices/stats');
+}
+
+export async function getInvoice(id) {
+  return toInvoice(await requestJson(`/invoices/${id}`));
+}
+
+/** Upload a PDF as a new Pending invoice */
+export async function createInvoice(file, caseName) {
+  const formData = new FormData();
+  formData.append('file', file);
+  if (caseName) formData.append('case_name', caseName);
+  return toInvoice(await requestJson('/invoices', { method: 'POST', body: formData }));
+}
+
+/**
+ * @param {number} id
+ * @param {{caseName?: string, status?: string, fields?: Object, boxes?: Array}} partial - fields use API names (invoice_number, ...)
+ */
+export async function updateInvoice(id, { caseName, status, fields, boxes }) {
+  return toInvoice(await requestJson(`/invoices/${id}`, {
+    method: 'PATCH',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ case_name: caseName, status, fields, boxes }),
+  }));
+}
+
+export async function deleteInvoice(id) {
+  return await requestJson(`/invoices/${id}`, { method: 'DELETE' });
+}
+
+/**
+ * Extract a stored invoice's PDF on the server. Fields stream in like
+ * extractInvoiceStream; the backend saves the result on the invoice.
+ */
+export async function extractStoredInvoice(id, customPrompt = DEFAULT_PROMPT, { onField, onStage } = {}) {
+  const formData = new FormData();
+  formData.append('custom_prompt', customPrompt);
+  const response = await fetch(`${API_BASE_URL}/invoices/${id}/extract`, { method: 'POST', body: formData });
+  if (!response.ok || !response.body) {
+    let message = `HTTP error! status: ${response.status}`;
+    try { message = (await response.json()).error || message; } catch { /* not JSON */ }
+    throw new Error(message);
   }
+  return readExtractionStream(response, { onField, onStage });
 }
 
 /**
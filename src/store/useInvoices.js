@@ -1,88 +1,131 @@
 import { useCallback, useEffect, useState } from 'react';
+import {
+  listInvoices,
+  searchInvoices,
+  getInvoiceStats,
+  getInvoice,
+  createInvoice,
+  updateInvoice,
+  deleteInvoice as removeInvoice,
+} from '../services/api.js';
 
-const KEY = 'invoice-demo-data-v1';
-const pdfFilesStorage = {}; // Global storage for PDF files
+const PAGE_SIZE = 50;
+const SEARCH_DEBOUNCE_MS = 250;
 
-export default function useInvoices() {
-  const [invoices, setInvoices] = useState(() => {
-    const cached = localStorage.getItem(KEY);
-    if (cached) return JSON.parse(cached);
-    return [];
-  });
+// One page of the server-side invoice list, plus the status counts. With a
+// query, the page comes from the full-text search, best match first.
+// Pages are walked with the backend's cursors; `cursors` holds the cursor of
+// every page visited so far so prevPage() can step back.
+export default function useInvoices({ query = '', pageSize = PAGE_SIZE } = {}) {
+  const [invoices, setInvoices] = useState([]);
+  const [statusCounts, setStatusCounts] = useState({});
+  const [total, setTotal] = useState(0);
+  const [paging, setPaging] = useState({ query, cursors: [null] });
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
+  const [error, setError] = useState(null);
+  const [version, setVersion] = useState(0);
 
-  const [pdfFiles, setPdfFiles] = useState(pdfFilesStorage);
+  // A new search starts again from the first page
+  if (paging.query !== query) setPaging({ query, cursors: [null] });
+  const cursor = paging.cursors[paging.cursors.length - 1];
 
-  useEffect(()=>{ localStorage.setItem(KEY, JSON.stringify(invoices)); }, [invoices]);
+  useEffect(() => {
+    let cancelled = false;
+    setLoading(true);
+    const timer = setTimeout(async () => {
+      try {
+        const [page, stats] = await Promise.all([
+          paging.query.trim()
+            ? searchInvoices({ q: paging.query, prefix: true, limit: pageSize, cursor })
+            : listInvoices({ limit: pageSize, cursor }),
+          getInvoiceStats(),
+        ]);
+        if (cancelled) return;
+        setInvoices(page.items);
+        setNextCursor(page.nextCursor);
+        setStatusCounts(stats.by_status);
+        setTotal(stats.total);
+        setError(null);
+      } catch (e) {
+        if (!cancelled) { setInvoices([]); setError(e.message); }
+      } finally {
+        if (!cancelled) setLoading(false);
+      }
+    }, paging.query.trim() ? SEARCH_DEBOUNCE_MS : 0);
+    return () => { cancelled = true; clearTimeout(timer); };
+  }, [paging.query, cursor, pageSize, version]);
 
-  const update = useCallback((id, partial) => {
-    setInvoices(list => list.map(inv => inv.id === id ? { ...inv, ...partial, modifiedAt: new Date().toISOString().slice(0,16).replace('T',' ') } : inv));
-  }, []);
+  const reload = useCallback(() => setVersion(v => v + 1), []);
 
-  const addInvoice = useCallback((invoiceData, pdfFile) => {
-    let newId;
-    let newInvoice;
-    
-    setInvoices(prev => {
-      newId = prev.length > 0 ? Math.max(...prev.map(i => i.id)) + 1 : 1;
-      const now = new Date().toISOString().slice(0,16).replace('T',' ');
-      
-      // Create a blob URL for runtime preview (not persisted across reloads)
-      const fileUrl = pdfFile ? URL.createObjectURL(pdfFile) : '';
-
-      newInvoice = {
-        id: newId,
-        caseName: invoiceData.caseName || 'Unnamed Invoice',
-        pages: invoiceData.pages || 1,
-        uploadedAt: now,
-        modifiedAt: now,
-        status: 'Pending',
-        file: invoiceData.file || '',
-        fileUrl,
-        data: {},
-        boxes: []
-      };
-      
-      return [...prev, newInvoice];
-    });
-    
-    if (pdfFile && newId) {
-      // Store the File in module-level storage so all hook instances can access it
-      pdfFilesStorage[newId] = pdfFile;
-      // Update local state for components using this hook instance
-      setPdfFiles({ ...pdfFilesStorage });
-    }
-    
-    return newId;
-  }, []);
+  const nextPage = useCallback(() => {
+    if (nextCursor) setPaging(p => ({ ...p, cursors: [...p.cursors, nextCursor] }));
+  }, [nextCursor]);
 
-  const deleteInvoice = useCallback((id) => {
-    setInvoices(list => list.filter(inv => inv.id !== id));
-    // Also remove PDF file from storage
-    delete pdfFilesStorage[id];
-    setPdfFiles({...pdfFilesStorage});
+  const prevPage = useCallback(() => {
+    setPaging(p => p.cursors.length > 1 ? { ...p, cursors: p.cursors.slice(0, -1) } : p);
   }, []);
 
-  const getById = useCallback((id) => {
-    const invoice = invoices.find(i => i.id === id);
-    // Always read the latest from module-level storage to avoid stale state across hook instances
-    const pdfFile = pdfFilesStorage[id];
-    if (invoice && pdfFile) {
-      return { ...invoice, pdfFile };
-    }
-    return invoice;
-  }, [invoices]);
+  const update = useCallback(async (id, partial) => {
+    const saved = await updateInvoice(id, partial);
+    setInvoices(list => list.map(inv => inv.id === id ? saved : inv));
+    // Status counts live on the server
+    if (partial.status) reload();
+    return saved;
+  }, [reload]);
 
-  const statusCounts = useMemoCounts(invoices);
+  const addInvoice = useCallback(async (file) => {
+    const created = await createInvoice(file);
+    reload();
+    return created.id;
+  }, [reload]);
 
-  return { invoices, update, addInvoice, deleteInvoice, getById, statusCounts };
+  const deleteInvoice = useCallback(async (id) => {
+    await removeInvoice(id);
+    reload();
+  }, [reload]);
+
+  return {
+    invoices,
+    statusCounts,
+    total,
+    update,
+    addInvoice,
+    deleteInvoice,
+    reload,
+    page: paging.cursors.length,
+    hasPrev: paging.cursors.length > 1,
+    hasNext: Boolean(nextCursor),
+    nextPage,
+    prevPage,
+    loading,
+    error,
+  };
 }
 
-function useMemoCounts(invoices) {
-  const [counts, setCounts] = useState({});
-  useEffect(()=>{
-    const c = {};
-    for (const inv of invoices) c[inv.status] = (c[inv.status]||0)+1;
-    setCounts(c);
-  }, [invoices]);
-  return counts;
+// A single invoice, for the detail page
+export function useInvoice(id) {
+  const [invoice, setInvoice] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [version, setVersion] = useState(0);
+
+  useEffect(() => {
+    let cancelled = false;
+    setLoading(true);
+    getInvoice(id)
+      .then(inv => { if (!cancelled) setInvoice(inv); })
+      .catch(() => { if (!cancelled) setInvoice(null); })
+      .finally(() => { if (!cancelled) setLoading(false); });
+    return () => { cancelled = true; };
+  }, [id, version]);
+
+  const update = useCallback(async (invoiceId, partial) => {
+    const saved = await updateInvoice(invoiceId, partial);
+    setInvoice(saved);
+    return saved;
+  }, []);
+
+  const reload = useCallback(() => setVersion(v => v + 1), []);
+
+  return { invoice, loading, update, reload };
 }
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { extractInvoice } from '../services/api.js';
+import { extractStoredInvoice } from '../services/api.js';
 
 const fields = [
   ['invoiceNumber','Invoice Number'],
@@ -14,8 +14,50 @@ const fields = [
   ['currency','Currency'],
 ];
 
-export default function InvoiceForm({ invoice, update, selectedField }) {
-  const [form, setForm] = useState(()=> ({ ...fields.reduce((a,[k]) => ({...a, [k]: invoice.data?.[k] || ''}), {} ) }));
+// API field -> form field
+const API_FIELDS = {
+  invoice_number: 'invoiceNumber',
+  invoice_date: 'invoiceDate',
+  due_date: 'dueDate',
+  vendor_name: 'vendor',
+  vendor_address: 'vendorAddress',
+  purchase_order: 'purchaseOrder',
+  account_number: 'accountNumber',
+  line_items: 'lineItems',
+  total_amount: 'total',
+  currency: 'currency',
+};
+
+const toText = (v) => {
+  if (v === null || v === undefined) return '';
+  if (typeof v === 'string') return v;
+  if (typeof v === 'number') return String(v);
+  try { return JSON.stringify(v); } catch { return String(v); }
+};
+
+const lineItemsText = (v) => v ? (typeof v === 'string' ? v : JSON.stringify(v, null, 2)) : '';
+
+// Stored invoice fields (API names) -> form values
+const formFromFields = (data = {}) => Object.fromEntries(
+  Object.entries(API_FIELDS).map(([field, name]) => [
+    name,
+    field === 'line_items' ? lineItemsText(data[field]) : toText(data[field]),
+  ])
+);
+
+// Form values -> API fields; line items go back as JSON when they still parse
+const fieldsFromForm = (form) => Object.fromEntries(
+  Object.entries(API_FIELDS).map(([field, name]) => {
+    const value = form[name];
+    if (field === 'line_items' && value) {
+      try { return [field, JSON.parse(value)]; } catch { return [field, value]; }
+    }
+    return [field, value || null];
+  })
+);
+
+export default function InvoiceForm({ invoice, update, reload, selectedField }) {
+  const [form, setForm] = useState(() => formFromFields(invoice.fields));
   const [saving, setSaving] = useState(false);
   const [extracting, setExtracting] = useState(false);
   const [extractError, setExtractError] = useState(null);
@@ -25,74 +67,35 @@ export default function InvoiceForm({ invoice, update, selectedField }) {
     setForm(f => ({ ...f, [name]: value }));
   }
 
-  function handleSave() {
+  async function handleSave() {
     setSaving(true);
-    setTimeout(()=>{
-      update(invoice.id, { data: form });
+    try {
+      await update(invoice.id, { fields: fieldsFromForm(form) });
+    } catch (error) {
+      alert(`Could not save: ${error.message}`);
+    } finally {
       setSaving(false);
-    }, 400);
+    }
   }
 
   async function handleExtract() {
-    let sourceFile = invoice.pdfFile;
-    // Fallback: if pdfFile missing but we have a blob URL, fetch and reconstruct a File
-    if (!sourceFile && invoice.fileUrl) {
-      try {
-        const res = await fetch(invoice.fileUrl);
-        const blob = await res.blob();
-        sourceFile = new File([blob], invoice.file || 'invoice.pdf', { type: blob.type || 'application/pdf' });
-      } catch (e) {
-        setExtractError('Could not access PDF from preview URL. Please re-upload from the dashboard.');
-        return;
-      }
-    }
-
-    if (!sourceFile) {
-      setExtractError('No PDF file found. Please upload a PDF from the dashboard first.');
-      return;
-    }
-
     setExtracting(true);
     setExtractError(null);
 
     try {
-      const result = await extractInvoice(sourceFile);
-      
-      // Map API response to form fields
-      const toText = (v) => {
-        if (v === null || v === undefined) return '';
-        if (typeof v === 'string') return v;
-        if (typeof v === 'number') return String(v);
-        try { return JSON.stringify(v); } catch { return String(v); }
-      };
-
-      const extractedData = {
-        invoiceNumber: toText(result.invoice_number),
-        invoiceDate: toText(result.invoice_date),
-        dueDate: toText(result.due_date),
-        vendor: toText(result.vendor_name),
-        vendorAddress: toText(result.vendor_address),
-        purchaseOrder: toText(result.purchase_order),
-        accountNumber: toText(result.account_number),
-        lineItems: result.line_items ? (typeof result.line_items === 'string' ? result.line_items : JSON.stringify(result.line_items, null, 2)) : '',
-        total: toText(result.total_amount),
-        currency: toText(result.currency),
+      // Fill each field as soon as the backend streams it
+      const onField = (field, value) => {
+        const name = API_FIELDS[field];
+        if (!name) return;
+        setForm(f => ({ ...f, [name]: field === 'line_items' ? lineItemsText(value) : toText(value) }));
       };
+      // The backend extracts the stored PDF and saves fields and boxes on the invoice
+      const result = await extractStoredInvoice(invoice.id, undefined, { onField });
 
-      // Capture bounding boxes if backend provides them
-      const extractedBoxes = result.boxes || result.bounding_boxes || result.regions || [];
-
-      setForm(extractedData);
+      setForm(formFromFields(result));
       setExtractError(null);
+      reload();
 
-      // Persist extracted data and boxes to store so preview can render boxes
-      // Debug: surface boxes in console for quick verification
-      if (result.boxes) {
-        // eslint-disable-next-line no-console
-        console.log('extract boxes', result.boxes.length, result.boxes.slice(0,3));
-      }
-      update(invoice.id, { data: extractedData, boxes: extractedBoxes });
-      
       // Show success message
       alert(`Invoice extracted successfully in ${result.execution_time_seconds}s! Review and save the data.`);
     } catch (error) {
@@ -117,7 +120,7 @@ export default function InvoiceForm({ invoice, update, selectedField }) {
           Extract from PDF
         </h3>
         
-        {invoice.pdfFile || invoice.fileUrl ? (
+        {invoice.fileUrl ? (
           <div style={{ 
             marginBottom: '0.75rem', 
             padding: '0.5rem', 